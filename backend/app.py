@@ -1,27 +1,297 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from datetime import datetime
 from zoneinfo import ZoneInfo # Python 3.9
+import hashlib
+import logging
 import math
+import os
+import threading
+import time
+import metrics
+import occupancy
+import profiler
 import unipi_calendar
+import snapshot_store
+import loader
+from snapshot_follower import SnapshotFollower
+from functools import lru_cache
+from logs import configure_logging
+from response_cache import ResponseCache, SUPPORTED_ENCODINGS, compress
+from status_versions import StatusVersions
+from model import STATUS_FIELDS, status_delta, status_to_columns
+
+try:
+    import msgpack  # opzionale: senza, le risposte compatte sono disponibili solo in JSON a colonne
+except ImportError:
+    msgpack = None
 
 
 app = Flask(__name__)
+configure_logging()
+log = logging.getLogger(__name__)
 
 
-calendari = {} # chiavi : 'date' , 'lessons'
+calendari = {} # snapshot servito (in sola lettura), chiavi : 'date' , 'lessons', 'timeline', ... (sostituito in blocco ad ogni aggiornamento)
+published_at = None # epoch della pubblicazione dello snapshot servito
 pisa_timezone = ZoneInfo("Europe/Rome")
+# Cache della risposta di /api/open-classrooms già serializzata (stessa codifica di jsonify).
+# Lo stato interno viene convertito nel JSON del frontend solo qui, una volta per intervallo della timeline
+response_cache = ResponseCache(lambda status: (app.json.dumps(unipi_calendar.buildings_status_to_json(status),
+                                                              separators=(",", ":")) + "\n").encode('utf-8'))
+# Versioni dello stato degli edifici, per ?since=<versione> e per lo stream SSE
+status_versions = StatusVersions()
+
+# Formati delle risposte di /api/open-classrooms (?format= oppure header Accept), in ordine di preferenza
+RESPONSE_FORMATS = {'json': 'application/json', 'columns': 'application/vnd.aulepi.columns+json'}
+if msgpack is not None:
+    RESPONSE_FORMATS['msgpack'] = 'application/msgpack'
+MIMETYPE_FORMATS = {mimetype: name for name, mimetype in RESPONSE_FORMATS.items()}
+
+
+INITIAL_LOAD_TIMEOUT = 20 # secondi che una richiesta attende il primo caricamento dei calendari prima di rispondere 503
+MAX_FREE_ROOMS_LIMIT = 100 # massimo numero di aule restituite da /api/free-rooms
+MAX_CACHE_AGE = 600 # secondi massimi di cache delle risposte: un aggiornamento dei calendari è visibile al più dopo 10 minuti
+AT_MAX_AGE = 300 # secondi di cache delle risposte con ?at= (lo stato in un istante fisso cambia solo con i calendari)
+MAX_TIMESTAMP = 253402214400 # epoch del 31/12/9999: gli istanti oltre non sono rappresentabili come date
+SSE_HEARTBEAT = 25 # secondi massimi senza messaggi sullo stream SSE (i proxy chiudono le connessioni inattive)
+SSE_MAX_LIFETIME = 600 # secondi dopo cui uno stream SSE viene chiuso: il client si riconnette con Last-Event-ID
+# Stream SSE aperti contemporaneamente in un processo: ognuno occupa un thread finché resta collegato, quindi
+# con i worker gthread di gunicorn (GUNICORN_THREADS thread) ne resta libera almeno metà per le richieste all'API
+MAX_SSE_STREAMS = int(os.environ.get("AULEPI_MAX_SSE_STREAMS", max(int(os.environ.get("GUNICORN_THREADS", "4")) // 2, 1)))
+sse_streams = threading.BoundedSemaphore(MAX_SSE_STREAMS)
+
+# Metriche delle richieste, esposte da /metrics insieme a quelle dell'aggiornamento dei calendari.
+# Le richieste sono raggruppate per regola dell'url (es. '/api/open-classrooms'), non per url completo
+request_seconds = metrics.request_registry.histogram(
+    'aulepi_request_duration_seconds', "Durata delle richieste", ['route', 'status'])
+response_bytes = metrics.request_registry.histogram(
+    'aulepi_response_size_bytes', "Dimensione delle risposte, dopo la compressione", ['route'], buckets=metrics.SIZE_BUCKETS)
+snapshot_age = metrics.request_registry.gauge(
+    'aulepi_snapshot_age_seconds', "Secondi dalla pubblicazione dello snapshot servito")
+snapshot_lessons = metrics.request_registry.gauge(
+    'aulepi_snapshot_lessons', "Lezioni nello snapshot servito")
+response_cache_hits = metrics.request_registry.gauge(
+    'aulepi_response_cache_hits', "Risposte di /api/open-classrooms servite dalla cache (vedi ResponseCache.stats)")
+response_cache_misses = metrics.request_registry.gauge(
+    'aulepi_response_cache_misses', "Risposte di /api/open-classrooms serializzate o compresse di nuovo")
+response_cache_hit_rate = metrics.request_registry.gauge(
+    'aulepi_response_cache_hit_rate', "Frazione delle risposte servite dalla cache")
+
+
+def publish_calendars(snapshot):
+    # sostituisce lo snapshot servito con un solo assegnamento: le richieste vedono il vecchio o il nuovo, mai uno a metà.
+    # Gli snapshot sono in sola lettura, quindi le richieste possono essere servite da più thread senza lock
+    global calendari, published_at
+    calendari = snapshot
+    published_at = time.time()
+    response_cache.invalidate()
+    delta_body.cache_clear()
+    view_body.cache_clear()
+    occupancy_body.cache_clear()
+    status_versions.publish(snapshot)
+
+
+# I calendari vengono aggiornati in background: le richieste leggono sempre l'ultimo snapshot valido.
+# Con AULEPI_ROLE=worker (server di produzione, vedi gunicorn.conf.py) i calendari vengono scaricati solo dal
+# processo loader e questo processo segue lo snapshot che il loader salva su file.
+# Altrimenti (sviluppo, Vercel) il processo scarica i calendari da solo, ripartendo dall'ultimo snapshot salvato se è di oggi.
+if os.environ.get("AULEPI_ROLE") == "worker":
+    refresher = SnapshotFollower(snapshot_store.SNAPSHOT_PATH, snapshot_store.load_snapshot_file, publish_calendars)
+else:
+    refresher = loader.make_refresher(publish_calendars)
 
 
 def update_calendars():
-    today = datetime.now(pisa_timezone).date()
-    today = today.strftime("%Y-%m-%d")
-
-    if calendari == {} or calendari['date'] != today:
-        print("Calendari non presenti o non aggiornati")
-        # scarico i calendari e li aggiungo al dizionario globale
-        calendari['date'] = today
-        calendari['lessons'] = unipi_calendar.load_calendars_and_parse()
-    
+    # avvia l'aggiornamento in background e aspetta solo il primo caricamento (all'avvio non c'è nulla da servire),
+    # per al massimo INITIAL_LOAD_TIMEOUT secondi. Restituisce None se non c'è ancora nessuno snapshot
+    if not refresher.wait_until_loaded(INITIAL_LOAD_TIMEOUT):
+        return None
+    return refresher.current()
+
+
+def error_response(message, status_code):
+    response = jsonify({"error": message})
+    response.status_code = status_code
+    return response
+
+
+def loading_response():
+    response = error_response("Calendari in caricamento, riprova tra poco", 503)
+    response.headers['Retry-After'] = '30'
+    return response
+
+
+def current_status(snapshot, at, fallback=True):
+    """
+    Restituisce (versione, stato, istante del prossimo cambio) dello stato all'istante 'at'.
+    Lo snapshot contiene anche le giornate successive: se la mezzanotte è passata da poco e lo snapshot
+    non è ancora stato sostituito, lo stato di oggi si legge comunque dalla sua timeline.
+    Se 'at' è fuori dalle giornate dello snapshot si usa la giornata dello snapshot, oppure, con fallback=False,
+    viene restituito None.
+    """
+    day = datetime.fromtimestamp(at, pisa_timezone).strftime("%Y-%m-%d")
+    timeline = snapshot['timelines'].get(day)
+    if timeline is None:
+        if not fallback:
+            return None
+        day, timeline = snapshot['date'], snapshot['timeline']
+    return status_versions.status_at(snapshot, timeline, day, at)
+
+
+@lru_cache(maxsize=256)
+def delta_body(since, version):
+    """
+    Restituisce i bytes JSON delle differenze tra lo stato 'since' e lo stato 'version':
+    {"version": ..., "full": false, "buildings": {solo poli e aule cambiati}}. Se 'since' non è più disponibile
+    (o è vuota) restituisce lo stato completo con "full": true. Le coppie di versioni si ripetono per tutti
+    i client aggiornati allo stesso stato, quindi ogni differenza viene calcolata una volta sola.
+    """
+    state = status_versions.state_of(version)
+    old = status_versions.state_of(since) if since else None
+    delta = status_delta(old, state, pisa_timezone) if old is not None else None
+    if delta is None:
+        payload = {'version': version, 'full': True, 'buildings': unipi_calendar.buildings_status_to_json(state)}
+    else:
+        payload = {'version': version, 'full': False, 'buildings': delta}
+    return (app.json.dumps(payload, separators=(",", ":")) + "\n").encode('utf-8')
+
+
+def response_etag(version, poli, rooms, fields, response_format, encoding, since):
+    """
+    ETag forte della risposta: la versione dello stato più un hash della variante richiesta
+    (poli, aule, campi, formato, compressione e versione di partenza delle differenze).
+    """
+    variant = repr((sorted(poli or ()), sorted(rooms or ()), sorted(fields), response_format, encoding, since))
+    return f"{version}-{hashlib.sha256(variant.encode('utf-8')).hexdigest()[:12]}"
+
+
+def parse_names(args, name):
+    """
+    Legge il parametro 'name' come lista separata da virgola. Restituisce None se non è indicato.
+    """
+    value = args.get(name)
+    return frozenset(item.strip() for item in value.split(",") if item.strip()) if value else None
+
+
+def parse_view(args):
+    """
+    Legge i parametri ?polo=, ?room= e ?fields= (liste separate da virgola). Restituisce (poli, aule, campi),
+    con None per i poli e le aule se non sono indicati. Solleva ValueError se un campo non esiste.
+    """
+    fields = parse_names(args, 'fields') or STATUS_FIELDS
+    if not fields <= STATUS_FIELDS:
+        raise ValueError(f"Campi non validi in 'fields', usa: {', '.join(sorted(STATUS_FIELDS))}")
+    return parse_names(args, 'polo'), parse_names(args, 'room'), fields
+
+
+@lru_cache(maxsize=256)
+def view_body(version, poli, rooms, fields, response_format, encoding):
+    """
+    Restituisce i bytes (già compressi con 'encoding') dello stato 'version' limitato a poli, aule e campi
+    richiesti, nel formato 'response_format'. Come per la risposta completa, ogni combinazione
+    viene serializzata una sola volta per ogni stato.
+    """
+    state = status_versions.state_of(version)
+    if response_format == 'json':
+        body = (app.json.dumps(unipi_calendar.buildings_status_to_json(state, poli, rooms, fields),
+                               separators=(",", ":")) + "\n").encode('utf-8')
+    elif response_format == 'columns':
+        body = (app.json.dumps(status_to_columns(state, poli, rooms, fields), separators=(",", ":")) + "\n").encode('utf-8')
+    else:
+        body = msgpack.packb(status_to_columns(state, poli, rooms, fields))
+    return compress(body, encoding)
+
+
+@lru_cache(maxsize=64)
+def occupancy_body(matrix, poli, encoding):
+    """
+    Restituisce i bytes JSON (già compressi con 'encoding') della matrice di occupazione 'matrix',
+    eventualmente limitata ad alcuni poli. Come le altre risposte, cambia solo con lo snapshot.
+    """
+    payload = {
+        'day': matrix.day.isoformat(),
+        'start': matrix.start,
+        'slotSeconds': occupancy.SLOT_SECONDS,
+        'slots': matrix.slots,
+        'rooms': matrix.packed(poli),
+    }
+    return compress((app.json.dumps(payload, separators=(",", ":")) + "\n").encode('utf-8'), encoding)
+
+
+def parse_at(value):
+    """
+    Converte il parametro 'at' in epoch (secondi): accetta un timestamp oppure una data e ora ISO 8601.
+    Solleva ValueError se il valore non è valido o è fuori dall'intervallo [0, MAX_TIMESTAMP],
+    in cui datetime.fromtimestamp funziona su ogni piattaforma.
+    """
+    try:
+        at = float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=pisa_timezone)
+        at = parsed.timestamp()
+    if not 0 <= at <= MAX_TIMESTAMP:  # falso anche per nan
+        raise ValueError(f"istante non valido: {value}")
+    return at
+
+
+def collect_request_metrics():
+    # metriche calcolate al momento della lettura di /metrics
+    if published_at is not None:
+        snapshot_age.set(time.time() - published_at)
+        snapshot_lessons.set(len(calendari.get('lessons', ())))
+    stats = response_cache.stats()
+    response_cache_hits.set(stats['hits'])
+    response_cache_misses.set(stats['misses'])
+    response_cache_hit_rate.set(stats['hit_rate'])
+
+
+metrics.request_registry.add_collector(collect_request_metrics)
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    # profilazione su richiesta (vedi profiler.py): disattivata, costa due confronti
+    if profiler.should_profile_request(request.headers):
+        g.request_profiler = profiler.SamplingProfiler().start()
+
+
+def finish_profile():
+    # Ferma il profiler della richiesta, se c'è, e salva il profilo. Restituisce il percorso del file oppure None
+    request_profiler = g.pop('request_profiler', None)
+    if request_profiler is None:
+        return None
+    request_profiler.stop()
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    return profiler.write_profile(request_profiler, "request" + route.replace("/", "_"))
+
+
+@app.after_request
+def record_request(response):
+    # Le risposte in streaming (SSE) vengono misurate fino all'invio degli header e non hanno una dimensione
+    duration = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    profile_path = finish_profile()
+    if profile_path is not None:
+        response.headers[profiler.PROFILE_HEADER] = os.path.basename(profile_path)
+    request_seconds.observe(duration, route=route, status=str(response.status_code))
+    size = None if response.is_streamed else response.calculate_content_length()
+    if size is not None:
+        response_bytes.observe(size, route=route)
+    # con AULEPI_LOG_FORMAT=json questi log sono una traccia riproducibile con benchmarks/loadtest.py
+    log.debug("Richiesta servita", extra={'route': route, 'path': request.full_path.rstrip("?"),
+                                          'status': response.status_code, 'bytes': size,
+                                          'duration_ms': round(duration * 1000, 3)})
+    return response
+
+
+@app.teardown_request
+def finish_failed_profile(error):
+    # le richieste terminate con un'eccezione non passano da after_request
+    finish_profile()
+
 
 @app.get('/')
 def hello_world():
@@ -36,21 +306,221 @@ def test():
 
 @app.route('/api/open-classrooms', methods=['GET'])
 def get_open_classrooms():
-    
-    print("GET method invoked")    
+    snapshot = update_calendars() # non aspetta mai la rete, tranne al primo avvio
+    if snapshot is None:
+        return loading_response()
 
-    update_calendars() # la funzione controlla se i calendari sono già stati aggiornati per la data odierna. Se non lo sono esegue l'aggiornamento
-    buildings_status = unipi_calendar.get_buildings_status()
-    response = jsonify(buildings_status)
-    
-    # payload_size = len(response.get_data()) / (1024) 
-    # print("Dim. della risposta:", payload_size)
-    
+    # ?at=<timestamp> restituisce lo stato in un altro istante delle giornate caricate (epoch in secondi oppure
+    # data e ora ISO 8601, ora di Pisa se senza fuso orario), senza scaricare di nuovo i calendari
+    now = datetime.now(pisa_timezone).timestamp()
+    if request.args.get('at') is not None:
+        try:
+            at = parse_at(request.args['at'])
+        except ValueError:
+            return error_response("Parametro 'at' non valido: usa un timestamp o una data ISO 8601", 400)
+        status = current_status(snapshot, at, fallback=False)
+        if status is None:
+            return error_response("Parametro 'at' fuori dalle giornate disponibili", 400)
+    else:
+        status = current_status(snapshot, now)
+    version, buildings_status, next_change = status
+
+    # ?polo=, ?room= e ?fields= limitano la risposta ad alcuni poli, aule e campi;
+    # ?format= (o l'header Accept) sceglie tra JSON, JSON a colonne e MessagePack
+    try:
+        poli, rooms, fields = parse_view(request.args)
+    except ValueError as e:
+        return error_response(str(e), 400)
+    response_format = request.args.get('format')
+    if response_format is None:
+        mimetype = request.accept_mimetypes.best_match(list(RESPONSE_FORMATS.values()), default='application/json')
+        response_format = MIMETYPE_FORMATS[mimetype]
+    if response_format not in RESPONSE_FORMATS:
+        return error_response(f"Formato non supportato, usa uno tra: {', '.join(RESPONSE_FORMATS)}", 406)
+
+    # ?since=<versione> restituisce solo i poli e le aule cambiati rispetto a quella versione
+    # (la versione dello stato servito è nell'header X-Status-Version e nel campo "version")
+    since = request.args.get('since')
+    full_view = poli is None and rooms is None and fields == STATUS_FIELDS and response_format == 'json'
+    if since is not None and not full_view:
+        return error_response("'since' non si può combinare con 'polo', 'room', 'fields' o 'format'", 400)
+    encoding = 'identity'  # le differenze sono piccole e non vengono compresse
+    if since is None:
+        encoding = request.accept_encodings.best_match(SUPPORTED_ENCODINGS) or 'identity'
+
+    # La risposta resta valida fino al prossimo cambio di stato: ETag forte dalla versione dello stato
+    # (e dalla variante richiesta) e max-age pari ai secondi che mancano al cambio, così browser, proxy e CDN
+    # possono riusarla senza arrivare a Python
+    etag = response_etag(version, poli, rooms, fields, response_format, encoding, since)
+    max_age = AT_MAX_AGE if 'at' in request.args else min(max(math.ceil(next_change - now), 0), MAX_CACHE_AGE)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif since is not None:
+        response = Response(delta_body(since, version), mimetype='application/json')
+    elif 'at' not in request.args and full_view:
+        # La risposta è la stessa per tutte le richieste fino al prossimo cambio di stato: si servono i bytes già codificati
+        response = Response(response_cache.get(buildings_status, encoding), mimetype='application/json')
+    else:
+        response = Response(view_body(version, poli, rooms, fields, response_format, encoding),
+                            mimetype=RESPONSE_FORMATS[response_format])
+    if encoding != 'identity' and response.status_code == 200:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.vary.add('Accept')
+    response.headers['X-Status-Version'] = version
+    if snapshot.get('stale'):
+        # poli serviti con l'ultimo calendario valido perché il loro download non è riuscito
+        response.headers['X-Stale-Poli'] = ",".join(sorted(snapshot['stale']))
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.s_maxage = max_age
     return response
 
 
+@app.route('/api/open-classrooms/stream', methods=['GET'])
+def stream_open_classrooms():
+    # Stream SSE dello stato degli edifici: il primo messaggio è lo stato completo (o le differenze rispetto
+    # a ?since= / Last-Event-ID), poi viene inviato un messaggio con le sole differenze ad ogni cambio di stato
+    # (inizio e fine delle lezioni, apertura e chiusura dei poli, nuovo snapshot). Ogni client connesso occupa
+    # un thread del server finché resta collegato: oltre MAX_SSE_STREAMS stream la risposta è 503, e ogni stream
+    # viene chiuso dopo SSE_MAX_LIFETIME secondi (EventSource si riconnette da solo inviando Last-Event-ID).
+    # Su Vercel (serverless) le connessioni lunghe vengono chiuse: lì conviene interrogare periodicamente ?since=.
+    if update_calendars() is None:
+        return loading_response()
+    last_version = request.headers.get('Last-Event-ID') or request.args.get('since') or ""
+    if not sse_streams.acquire(blocking=False):
+        response = error_response("Troppi stream aperti, riprova tra poco o usa ?since=", 503)
+        response.headers['Retry-After'] = str(SSE_HEARTBEAT)
+        return response
+
+    def events(sent):
+        deadline = time.monotonic() + SSE_MAX_LIFETIME
+        while True:
+            now = datetime.now(pisa_timezone).timestamp()
+            version, _, next_change = current_status(refresher.current(), now)
+            if version != sent:
+                yield f"id: {version}\ndata: {delta_body(sent, version).decode('utf-8').strip()}\n\n"
+                sent = version
+            else:
+                yield ": ping\n\n"
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # Dorme fino al prossimo cambio di stato o alla prossima pubblicazione (al massimo SSE_HEARTBEAT secondi)
+            timeout = next_change - now if next_change > now else SSE_HEARTBEAT
+            status_versions.wait(min(timeout, SSE_HEARTBEAT, remaining))
+
+    response = Response(events(last_version), mimetype='text/event-stream')
+    response.call_on_close(sse_streams.release)  # anche se il client si disconnette prima del primo messaggio
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # niente buffering nei proxy (es. nginx)
+    return response
+
+
+@app.route('/api/free-rooms', methods=['GET'])
+def get_free_rooms():
+    # Aule libere per almeno 'minutes' minuti (default 0) all'istante 'at' (default adesso), ordinate per distanza
+    # dalla posizione 'lat'/'lon' se indicata: il frontend riceve solo una breve lista invece di tutto lo stato
+    snapshot = update_calendars()
+    if snapshot is None:
+        return loading_response()
+
+    try:
+        at = parse_at(request.args['at']) if 'at' in request.args else datetime.now(pisa_timezone).timestamp()
+        minutes = int(request.args.get('minutes', 0))
+        limit = int(request.args.get('limit', unipi_calendar.FREE_ROOMS_LIMIT))
+        position = None
+        if 'lat' in request.args or 'lon' in request.args:
+            position = (float(request.args['lat']), float(request.args['lon']))
+            if not (-90 <= position[0] <= 90 and -180 <= position[1] <= 180):
+                raise ValueError("posizione non valida")
+    except (KeyError, ValueError):
+        return error_response("Parametri non validi: 'lat' e 'lon' vanno indicati insieme, 'minutes' e 'limit' sono interi", 400)
+    if minutes < 0 or not 1 <= limit <= MAX_FREE_ROOMS_LIMIT:
+        return error_response(f"'minutes' deve essere positivo e 'limit' tra 1 e {MAX_FREE_ROOMS_LIMIT}", 400)
+
+    free_rooms = unipi_calendar.find_free_rooms(snapshot, at, minutes, position, limit)
+    if free_rooms is None:
+        return error_response("Parametro 'at' fuori dalle giornate disponibili", 400)
+    return jsonify({'rooms': free_rooms})
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Metriche nel formato testuale di Prometheus. Nel server di produzione ogni worker espone le proprie metriche
+    # delle richieste, mentre quelle dell'aggiornamento arrivano dal file salvato dal processo loader
+    body = metrics.request_registry.render()
+    if isinstance(refresher, SnapshotFollower):
+        try:
+            with open(loader.REFRESH_METRICS_PATH, encoding='utf-8') as f:
+                body += f.read()
+        except FileNotFoundError:
+            pass
+    else:
+        body += metrics.refresh_registry.render()
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/occupancy', methods=['GET'])
+def get_occupancy():
+    # Occupazione delle aule nella giornata ?day=YYYY-MM-DD (default oggi) a slot di 5 minuti: per ogni aula un bitmap
+    # in base64 con un bit per slot (1 = lezione, polo chiuso o aula non usually_open), il primo slot nel bit più
+    # significativo. Il client ricava intervalli liberi e timeline della giornata con operazioni sui bit,
+    # senza scaricare le lezioni. ?polo= limita la risposta ad alcuni poli
+    if occupancy.np is None:
+        return error_response("Occupazione delle aule non disponibile su questo server", 501)
+    snapshot = update_calendars()
+    if snapshot is None:
+        return loading_response()
+
+    day = request.args.get('day') or datetime.now(pisa_timezone).strftime("%Y-%m-%d")
+    matrix = snapshot['occupancy'].get(day)
+    if matrix is None:
+        return error_response("Parametro 'day' fuori dalle giornate disponibili", 400)
+    poli = parse_names(request.args, 'polo')  # gli altri parametri delle viste non si applicano alla matrice
+    encoding = request.accept_encodings.best_match(SUPPORTED_ENCODINGS) or 'identity'
+
+    # La matrice cambia solo con lo snapshot: stesso ETag e max-age delle risposte con ?at=
+    etag = response_etag(f"{snapshot['id']}.{day}", poli, None, (), 'occupancy', encoding, None)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(occupancy_body(matrix, poli, encoding), mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = AT_MAX_AGE
+    response.cache_control.s_maxage = AT_MAX_AGE
+    return response
+
+
+@app.route('/api/occupancy/free', methods=['GET'])
+def get_free_between():
+    # Aule disponibili per tutto l'intervallo [?from=, ?to=) (timestamp o data e ora ISO 8601, nella stessa giornata),
+    # calcolate sulle colonne della matrice di occupazione: es. "quali aule sono libere dalle 14 alle 16"
+    if occupancy.np is None:
+        return error_response("Occupazione delle aule non disponibile su questo server", 501)
+    snapshot = update_calendars()
+    if snapshot is None:
+        return loading_response()
+
+    try:
+        start, end = parse_at(request.args['from']), parse_at(request.args['to'])
+    except (KeyError, ValueError):
+        return error_response("Parametri 'from' e 'to' obbligatori: usa un timestamp o una data ISO 8601", 400)
+    matrix = snapshot['occupancy'].get(datetime.fromtimestamp(start, pisa_timezone).strftime("%Y-%m-%d"))
+    if matrix is None:
+        return error_response("Parametro 'from' fuori dalle giornate disponibili", 400)
+    if not start < end <= matrix.end:
+        return error_response("'to' deve essere successivo a 'from' e nella stessa giornata", 400)
+    return jsonify({'rooms': [{'polo': polo, 'room': room} for polo, room in matrix.free_between(start, end)]})
+
+
 if __name__ == '__main__':
     #app.run(host='0.0.0.0', port=8080, debug=True)
     update_calendars()
-    app.run(port=8080)
+    app.run(port=8080, threaded=True)
     
\ No newline at end of file
@@ -0,0 +1,334 @@
+"""
+Generatore di carico per l'API, senza rete: riproduce una traccia di richieste (registrata o sintetica, con i picchi
+al cambio dell'ora di lezione) contro app.py servita in locale, con Cineca e VercelFS sostituiti dai server di stubs.py.
+
+    cd backend && python -m benchmarks.loadtest [--server werkzeug|gunicorn] [--concurrency 64] [--cold]
+    cd backend && python -m benchmarks.loadtest --trace richieste.jsonl --speed 10
+
+La traccia è un file JSONL con una richiesta per riga: {"t": secondi dall'inizio, "path": "/api/...", "headers": {...}}.
+Si possono usare direttamente anche i log dell'app con AULEPI_LOG_FORMAT=json e AULEPI_LOG_LEVEL=DEBUG
+(righe "Richiesta servita"). Le richieste partono agli istanti della traccia indipendentemente dalle risposte
+(carico a circuito aperto): la latenza è misurata dall'istante previsto, quindi comprende l'attesa
+di una connessione libera quando il server non regge il ritmo.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+from werkzeug.serving import make_server
+
+import loader
+import snapshot_store
+import unipi_calendar
+from sites import SiteRegistry
+from benchmarks.run import percentiles
+from benchmarks.stubs import BlobStub, CinecaStub, offline, registry_data
+from benchmarks.synthetic import generate_aule_csv, generate_ics
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REQUEST_TIMEOUT = 60  # secondi, più dell'attesa del primo caricamento (app.INITIAL_LOAD_TIMEOUT)
+SERVER_START_TIMEOUT = 30
+
+
+def synthetic_trace(poli, duration=60, rate=20, spike_rate=300, spike_every=30, spike_length=5, seed=0):
+    """
+    Restituisce una traccia di 'duration' secondi: in media 'rate' richieste al secondo, che diventano 'spike_rate'
+    nei primi 'spike_length' secondi di ogni periodo di 'spike_every' secondi (il cambio dell'ora, quando centinaia
+    di studenti aprono la mappa insieme). Gli arrivi sono un processo di Poisson; le richieste sono un misto
+    di stato completo, filtri, formato a colonne, istanti futuri e aule libere vicine.
+    """
+    rng = random.Random(seed)
+    today = datetime.now(unipi_calendar.pisa_timezone).date()
+    peak = max(rate, spike_rate)
+    trace = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(peak)
+        if t >= duration:
+            return trace
+        current_rate = spike_rate if t % spike_every < spike_length else rate
+        if rng.random() >= current_rate / peak:
+            continue  # arrivo scartato: il processo con intensità variabile si ottiene sfoltendo quello di picco
+        kind = rng.random()
+        if kind < 0.55:
+            path = "/api/open-classrooms"
+        elif kind < 0.65:
+            path = f"/api/open-classrooms?polo={rng.choice(poli)}"
+        elif kind < 0.75:
+            path = "/api/open-classrooms?fields=status&format=columns"
+        elif kind < 0.80:
+            path = f"/api/open-classrooms?at={today.isoformat()}T{rng.randint(8, 18):02d}:{rng.choice(('00', '30'))}"
+        else:
+            path = f"/api/free-rooms?lat={43.70 + rng.random() / 20:.4f}&lon={10.38 + rng.random() / 20:.4f}&minutes=30"
+        trace.append({'t': round(t, 4), 'path': path, 'headers': {'Accept-Encoding': "gzip, br"}})
+
+
+def load_trace(path):
+    """
+    Legge una traccia JSONL oppure i log JSON dell'app (righe "Richiesta servita", con 'epoch' e 'path').
+    Restituisce le richieste ordinate per istante, con 't' relativo alla prima.
+    """
+    trace = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'message' in entry:
+                if entry['message'] != "Richiesta servita" or 'path' not in entry:
+                    continue
+                entry = {'t': entry['epoch'], 'path': entry['path'], 'headers': {'Accept-Encoding': "gzip, br"}}
+            trace.append(entry)
+    trace.sort(key=lambda entry: entry['t'])
+    start = trace[0]['t'] if trace else 0
+    return [{**entry, 't': entry['t'] - start} for entry in trace]
+
+
+def save_trace(trace, path):
+    with open(path, "w", encoding='utf-8') as f:
+        for entry in trace:
+            f.write(json.dumps(entry) + "\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, process=None, timeout=SERVER_START_TIMEOUT):
+    """
+    Aspetta che il server risponda. Se 'process' (il server avviato come sottoprocesso) termina, fallisce subito.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Il server {url} è terminato all'avvio (codice {process.returncode})")
+        try:
+            requests.get(url + "/api/test", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"Il server {url} non risponde")
+
+
+@contextmanager
+def werkzeug_server(cold):
+    """
+    Serve app.py in questo processo con il server di sviluppo (un thread per richiesta), come con `python app.py`.
+    Con cold=True lo snapshot viene caricato dalla prima richiesta, come la prima richiesta della giornata
+    dopo un avvio; altrimenti viene caricato prima di iniziare.
+    """
+    import app as backend
+
+    saved_refresher = backend.refresher
+    backend.refresher = loader.make_refresher(backend.publish_calendars)
+    try:
+        if not cold:
+            backend.refresher.wait_until_loaded(REQUEST_TIMEOUT)
+        server = make_server("127.0.0.1", 0, backend.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, name="werkzeug", daemon=True)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.server_port}"
+        finally:
+            server.shutdown()
+    finally:
+        backend.refresher = saved_refresher
+
+
+@contextmanager
+def gunicorn_server(day, days, workers, threads, sites):
+    """
+    Serve app.py con gunicorn come in produzione (worker gthread che seguono il file dello snapshot).
+    Lo snapshot viene preparato prima di avviare il server e scritto in un file temporaneo al posto del processo loader.
+    'sites' è il registro dei poli (contenuto di 'sites.json') usato per lo snapshot: i worker lo leggono da un file
+    temporaneo, così orari di apertura e distanze dei poli sono gli stessi del server in questo processo.
+    """
+    snapshot = unipi_calendar.load_calendars_and_parse(day, days)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, snapshot_store.SNAPSHOT_BLOB_NAME)
+        with open(path, "wb") as f:
+            f.write(snapshot_store.serialize_snapshot(snapshot))
+        sites_path = os.path.join(directory, "sites.json")
+        with open(sites_path, "w", encoding='utf-8') as f:
+            json.dump(sites, f)
+        port = free_port()
+        env = {**os.environ, 'AULEPI_ROLE': "worker", 'AULEPI_SNAPSHOT_STORE': "file", 'AULEPI_SNAPSHOT_PATH': path,
+               'AULEPI_SITES_FILE': sites_path, 'AULEPI_LOG_LEVEL': "WARNING"}
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(workers),
+                                   "--threads", str(threads), "-k", "gthread", "app:app"], cwd=BACKEND_DIR, env=env)
+        try:
+            url = f"http://127.0.0.1:{port}"
+            wait_until_up(url, server)
+            yield url
+        finally:
+            server.terminate()
+            server.wait(10)
+
+
+def replay(base_url, trace, concurrency, speed=1.0, conditional=False):
+    """
+    Invia le richieste della traccia agli istanti indicati (divisi per 'speed') usando al massimo 'concurrency'
+    connessioni. Con conditional=True ogni connessione ricorda l'ETag delle risposte e li rimanda con If-None-Match,
+    come un browser con la cache. Restituisce (risultati, durata in secondi): un dizionario per richiesta con
+    'name', 'latency' (dall'istante previsto), 'service' (dall'invio), 'status' e 'bytes'.
+    """
+    local = threading.local()
+    results = []
+
+    def send(entry, scheduled):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+            local.etags = {}
+        headers = dict(entry.get('headers') or {})
+        if conditional and entry['path'] in local.etags:
+            headers['If-None-Match'] = local.etags[entry['path']]
+        sent = time.perf_counter()
+        result = {'name': entry.get('name') or entry['path'].split("?", 1)[0], 't': entry['t']}
+        try:
+            response = session.get(base_url + entry['path'], headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+            body = response.raw.read(decode_content=False)  # bytes trasferiti, ancora compressi
+            result.update(status=response.status_code, bytes=len(body))
+            if response.headers.get('ETag'):
+                local.etags[entry['path']] = response.headers['ETag']
+        except requests.RequestException as e:
+            result.update(status=None, bytes=0, error=str(e))
+        finished = time.perf_counter()
+        result.update(latency=finished - scheduled, service=finished - sent)
+        results.append(result)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="client") as executor:
+        started = time.perf_counter()
+        for entry in trace:
+            scheduled = started + entry['t'] / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, entry, scheduled)
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    """
+    Riassume i risultati: throughput, tasso di errore (5xx ed errori di connessione), risposte per stato,
+    percentili della latenza (complessivi e per endpoint) e latenza della prima richiesta.
+    """
+    errors = [result for result in results if result['status'] is None or result['status'] >= 500]
+    statuses = {}
+    for result in results:
+        statuses[str(result['status'])] = statuses.get(str(result['status']), 0) + 1
+    summary = {
+        'requests': len(results),
+        'seconds': elapsed,
+        'throughput': len(results) / elapsed if elapsed > 0 else 0.0,
+        'error_rate': len(errors) / len(results) if results else 0.0,
+        'statuses': statuses,
+        'megabytes': sum(result['bytes'] for result in results) / 1e6,
+    }
+    if results:
+        first = min(results, key=lambda result: result['t'])
+        summary['first_request_ms'] = first['latency'] * 1000
+    groups = {'all': results}
+    for result in results:
+        groups.setdefault(result['name'], []).append(result)
+    for name, group in groups.items():
+        if len(group) < 2:
+            continue
+        summary[name] = {f"{percentile}_ms": value * 1000
+                         for percentile, value in percentiles([result['latency'] for result in group]).items()}
+        summary[name]['service_p99_ms'] = percentiles([result['service'] for result in group])['p99'] * 1000
+        summary[name]['requests'] = len(group)
+    return summary
+
+
+def report(summary):
+    print(f"richieste {summary['requests']} in {summary['seconds']:.1f}s: {summary['throughput']:.1f} req/s, "
+          f"errori {summary['error_rate']:.2%}, {summary['megabytes']:.2f} MB, stati {summary['statuses']}")
+    if 'first_request_ms' in summary:
+        print(f"prima richiesta: {summary['first_request_ms']:.1f} ms")
+    for name, values in summary.items():
+        if isinstance(values, dict) and 'p50_ms' in values:
+            print(f"{name:45} n={values['requests']:<6} p50 {values['p50_ms']:9.2f} ms  p95 {values['p95_ms']:9.2f} ms  "
+                  f"p99 {values['p99_ms']:9.2f} ms  (servizio p99 {values['service_p99_ms']:.2f} ms)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help="traccia JSONL (o log JSON dell'app) da riprodurre, invece di quella sintetica")
+    parser.add_argument('--save-trace', help="salva la traccia usata in questo file")
+    parser.add_argument('--duration', type=float, default=60, help="secondi della traccia sintetica")
+    parser.add_argument('--rate', type=float, default=20, help="richieste al secondo fuori dai picchi")
+    parser.add_argument('--spike-rate', type=float, default=300, help="richieste al secondo durante i picchi")
+    parser.add_argument('--spike-every', type=float, default=30, help="secondi tra l'inizio di due picchi")
+    parser.add_argument('--spike-length', type=float, default=5, help="durata (secondi) di ogni picco")
+    parser.add_argument('--speed', type=float, default=1.0, help="fattore di accelerazione della traccia")
+    parser.add_argument('--concurrency', type=int, default=64, help="connessioni aperte al massimo dal generatore")
+    parser.add_argument('--conditional', action='store_true', help="i client rimandano gli ETag (If-None-Match)")
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=2, help="worker di gunicorn")
+    parser.add_argument('--threads', type=int, default=4, help="thread per worker di gunicorn")
+    parser.add_argument('--cold', action='store_true',
+                        help="i calendari vengono caricati dalla prima richiesta (solo con --server werkzeug)")
+    parser.add_argument('--poli', type=int, default=17, help="poli del calendario sintetico")
+    parser.add_argument('--events', type=int, default=300, help="lezioni per polo per giornata")
+    parser.add_argument('--days', type=int, default=unipi_calendar.CALENDAR_DAYS, help="giornate di ogni calendario")
+    parser.add_argument('--latency', type=float, default=0.05, help="latenza (secondi) dei server locali")
+    parser.add_argument('--json', help="salva il riepilogo in questo file")
+    args = parser.parse_args(argv)
+    if args.cold and args.server != 'werkzeug':
+        parser.error("--cold è supportato solo con --server werkzeug")
+
+    logging.disable(logging.WARNING)  # i log del backend e del server coprirebbero i risultati
+    day = datetime.now(unipi_calendar.pisa_timezone).date()
+    poli = [f"polo{i:03d}" for i in range(args.poli)]
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(poli, args.duration, args.rate, args.spike_rate, args.spike_every, args.spike_length)
+    if args.save_trace:
+        save_trace(trace, args.save_trace)
+    if not trace:
+        parser.error("la traccia è vuota")
+
+    feeds = {polo: generate_ics(polo, day, args.days, args.events) for polo in poli}
+    cineca = CinecaStub(feeds, latency=args.latency)
+    blob = BlobStub({'aule.csv': generate_aule_csv(poli).encode('utf-8')}, latency=args.latency)
+    try:
+        sites = registry_data(cineca, poli)
+        with offline(cineca, blob, SiteRegistry(sites)):
+            if args.server == 'werkzeug':
+                server = werkzeug_server(args.cold)
+            else:
+                server = gunicorn_server(day, args.days, args.workers, args.threads, sites)
+            with server as url:
+                results, elapsed = replay(url, trace, args.concurrency, args.speed, args.conditional)
+    finally:
+        cineca.close()
+        blob.close()
+
+    summary = summarize(results, elapsed)
+    summary['params'] = {name: value for name, value in vars(args).items() if name not in ('json', 'save_trace')}
+    report(summary)
+    if args.json:
+        with open(args.json, "w", encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['error_rate'] > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
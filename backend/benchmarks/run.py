@@ -0,0 +1,235 @@
+"""
+Benchmark del backend, senza rete: parsing dei .ics, aggiornamento a freddo dei calendari contro i server locali
+di Cineca e VercelFS, costruzione dello stato degli edifici, latenza delle richieste e memoria per lezione.
+
+    cd backend && python -m benchmarks.run [--poli 17] [--events 300] [--latency 0.05]
+
+Ogni esecuzione viene aggiunta a benchmarks/results.jsonl e confrontata con la precedente con gli stessi
+parametri: le variazioni oltre --threshold vengono segnalate come regressioni.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import snapshot_store
+import unipi_calendar
+from benchmarks.stubs import BlobStub, CinecaStub, offline, registry_for
+from benchmarks.synthetic import generate_aule_csv, generate_ics
+
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+# metriche in cui un valore più alto è un miglioramento (per tutte le altre, tempi e memoria, è un peggioramento)
+HIGHER_IS_BETTER = frozenset(['parse_events_per_second'])
+
+
+def quiet(function):
+    """
+    Esegue 'function' senza i log informativi del backend, che falserebbero i tempi e coprirebbero i risultati.
+    """
+    logging.disable(logging.INFO)
+    try:
+        return function()
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def best_of(repeat, function):
+    """
+    Esegue 'function' 'repeat' volte e restituisce il tempo migliore (secondi) e il risultato dell'ultima esecuzione.
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    quantiles = statistics.quantiles(samples, n=100)
+    return {'p50': quantiles[49], 'p95': quantiles[94], 'p99': quantiles[98]}
+
+
+def bench_parse(args, day):
+    feed = generate_ics("poloBench", day, args.days, args.events)
+    seconds, lessons = best_of(args.repeat, lambda: unipi_calendar.parse_ics(feed, day, args.days))
+    return {
+        'parse_seconds': seconds,
+        'parse_events_per_second': len(lessons) / seconds,
+        'parse_megabytes': len(feed.encode('utf-8')) / 1e6,
+    }
+
+
+def bench_memory(args, day):
+    feed = generate_ics("poloBench", day, args.days, args.events)
+    gc.collect()
+    tracemalloc.start()
+    lessons = unipi_calendar.parse_ics(feed, day, args.days)
+    for lesson in lessons:
+        lesson.polo = "poloBench"
+    index = quiet(lambda: unipi_calendar.build_rooms_index(lessons))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del index
+    return {'memory_bytes_per_lesson': current / len(lessons)}
+
+
+def bench_refresh(args, day):
+    poli = [f"polo{i:03d}" for i in range(args.poli)]
+    feeds = {polo: generate_ics(polo, day, args.days, args.events) for polo in poli}
+    cineca = CinecaStub(feeds, latency=args.latency)
+    blob = BlobStub({'aule.csv': generate_aule_csv(poli).encode('utf-8')}, latency=args.latency)
+    try:
+        with offline(cineca, blob, registry_for(cineca, poli)):
+            cold, snapshot = best_of(1, lambda: quiet(lambda: unipi_calendar.load_calendars_and_parse(day, args.days)))
+            # secondo aggiornamento: i calendari non sono cambiati (304), lo snapshot viene riusato
+            warm, _ = best_of(1, lambda: quiet(lambda: unipi_calendar.load_calendars_and_parse(day, args.days)))
+
+            buildings, index = snapshot['buildings'], snapshot['rooms_index']
+            timelines_seconds, _ = best_of(args.repeat, lambda: unipi_calendar.build_timelines(day, args.days, buildings, index))
+
+            upload, _ = best_of(1, lambda: quiet(lambda: unipi_calendar.buildings_to_csv(snapshot['usually_open'])))
+
+            # costo di ogni worker del server di produzione ad ogni nuovo snapshot: tempo e memoria della ricostruzione
+            content = snapshot_store.serialize_snapshot(snapshot)
+            restore, _ = best_of(args.repeat, lambda: snapshot_store.deserialize_snapshot(content))
+            gc.collect()
+            tracemalloc.start()
+            restored = snapshot_store.deserialize_snapshot(content)
+            restore_bytes, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del restored
+
+            # le richieste vanno misurate con lo stesso registro e gli stessi orari con cui è stato costruito lo snapshot
+            request_results = bench_requests(args, snapshot)
+    finally:
+        cineca.close()
+        blob.close()
+    return {
+        'refresh_cold_seconds': cold,
+        'refresh_unchanged_seconds': warm,
+        'build_timelines_seconds': timelines_seconds,
+        'csv_upload_seconds': upload,
+        'snapshot_file_bytes': len(content),
+        'snapshot_restore_seconds': restore,
+        'snapshot_restore_megabytes': restore_bytes / 1e6,
+        'lessons': len(snapshot['lessons']),
+        **request_results,
+    }
+
+
+def bench_requests(args, snapshot):
+    import app as backend
+
+    backend.publish_calendars(snapshot)
+    backend.update_calendars = lambda: snapshot
+    client = backend.app.test_client()
+    at = int(snapshot['timeline'].instants[0]) + 10 * 3600
+    urls = {
+        'open_classrooms': "/api/open-classrooms",
+        'open_classrooms_status_only': "/api/open-classrooms?fields=status",
+        'open_classrooms_at': f"/api/open-classrooms?at={at}",
+        'free_rooms': f"/api/free-rooms?at={at}&lat=43.72&lon=10.40",
+    }
+    results = {}
+    for name, url in urls.items():
+        samples = []
+        sizes = set()
+        for _ in range(args.requests):
+            seconds, response = best_of(1, lambda: quiet(lambda: client.get(url, headers={'Accept-Encoding': "gzip"})))
+            samples.append(seconds)
+            sizes.add(len(response.data))
+        for percentile, value in percentiles(samples).items():
+            results[f"request_{name}_{percentile}_ms"] = value * 1000
+        results[f"request_{name}_bytes"] = max(sizes)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_FILE), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(params):
+    """
+    Restituisce i risultati dell'ultima esecuzione con gli stessi parametri salvata in RESULTS_FILE, oppure None.
+    """
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE, encoding='utf-8') as f:
+        for line in f:
+            run = json.loads(line)
+            if run.get('params') == params:
+                previous = run
+    return previous
+
+
+def report(results, previous, threshold):
+    """
+    Stampa i risultati e la variazione rispetto all'esecuzione precedente. Restituisce le metriche peggiorate.
+    """
+    regressions = []
+    for name, value in results.items():
+        line = f"{name:45} {value:14.4f}"
+        old = previous['results'].get(name) if previous is not None else None
+        if old:
+            change = (value - old) / old
+            worse = -change if name in HIGHER_IS_BETTER else change
+            line += f"  {change:+8.1%}"
+            if name != 'lessons' and not name.endswith('_bytes') and worse > threshold:
+                line += "  REGRESSIONE"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--poli', type=int, default=17, help="poli del calendario sintetico")
+    parser.add_argument('--events', type=int, default=300, help="lezioni per polo per giornata")
+    parser.add_argument('--days', type=int, default=unipi_calendar.CALENDAR_DAYS, help="giornate di ogni calendario")
+    parser.add_argument('--latency', type=float, default=0.05, help="latenza (secondi) dei server locali")
+    parser.add_argument('--requests', type=int, default=500, help="richieste per endpoint")
+    parser.add_argument('--repeat', type=int, default=3, help="ripetizioni dei benchmark di CPU")
+    parser.add_argument('--threshold', type=float, default=0.10, help="peggioramento segnalato come regressione")
+    parser.add_argument('--no-save', action='store_true', help="non salva i risultati in results.jsonl")
+    args = parser.parse_args(argv)
+
+    day = datetime.now(unipi_calendar.pisa_timezone).date()
+    params = {name: getattr(args, name) for name in ('poli', 'events', 'days', 'latency', 'requests')}
+    results = {}
+    results.update(bench_parse(args, day))
+    results.update(bench_memory(args, day))
+    results.update(bench_refresh(args, day))
+
+    regressions = report(results, previous_results(params), args.threshold)
+    if not args.no_save:
+        run = {
+            'timestamp': datetime.now(unipi_calendar.pisa_timezone).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'params': params,
+            'results': results,
+        }
+        with open(RESULTS_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run) + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Server HTTP locali che sostituiscono Cineca (creaFiltroICal/impegniICal) e VercelFS, con una latenza configurabile,
+così aggiornamento dei calendari e upload si possono eseguire senza rete.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import vercel_blob.blob_store
+
+import unipi_calendar
+from geo import PoloLocator
+from opening_hours import load_opening_hours
+from sites import SiteRegistry
+
+
+class StubServer:
+    """
+    Server HTTP in un thread in background su una porta libera di 127.0.0.1. 'latency' (secondi) viene
+    aggiunta ad ogni risposta; 'requests' conta le richieste ricevute per metodo.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # connessioni keep-alive, come con i server veri
+
+            def handle_method(self):
+                stub.requests[self.command] = stub.requests.get(self.command, 0) + 1
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b""
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, headers, content = stub.handle(self.command, urlparse(self.path), self.headers, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = handle_method
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def handle(self, method, url, headers, body):
+        raise NotImplementedError
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def json_response(data, status=200):
+    return status, {'Content-Type': "application/json"}, json.dumps(data).encode('utf-8')
+
+
+class CinecaStub(StubServer):
+    """
+    Sostituisce le API dei calendari di Cineca: 'feeds' è linkCalendarioId -> contenuto del file .ics.
+    La GET risponde 304 se l'If-None-Match coincide con l'ETag del calendario.
+    """
+
+    def __init__(self, feeds, latency=0.0):
+        self.feeds = feeds
+        super().__init__(latency)
+
+    def handle(self, method, url, headers, body):
+        if method == 'POST' and url.path == "/api/FiltriICal/creaFiltroICal":
+            return json_response({'id': json.loads(body)['linkCalendarioId']})
+        if method == 'GET' and url.path == "/api/FiltriICal/impegniICal":
+            feed = self.feeds.get(parse_qs(url.query).get('id', [""])[0])
+            if feed is None:
+                return json_response({'error': "calendario non trovato"}, 404)
+            etag = '"' + hashlib.sha256(feed.encode('utf-8')).hexdigest()[:16] + '"'
+            if headers.get('If-None-Match') == etag:
+                return 304, {'ETag': etag}, b""
+            return 200, {'Content-Type': "text/calendar; charset=utf-8", 'ETag': etag}, feed.encode('utf-8')
+        return json_response({'error': "non trovato"}, 404)
+
+
+class BlobStub(StubServer):
+    """
+    Sostituisce VercelFS: elenco dei blob (GET /), upload (PUT /<pathname>) e download (GET /files/<pathname>).
+    'blobs' è pathname -> contenuto (bytes).
+    """
+
+    def __init__(self, blobs=None, latency=0.0):
+        self.blobs = dict(blobs or {})
+        super().__init__(latency)
+
+    def handle(self, method, url, headers, body):
+        if method == 'GET' and url.path == "/":
+            return json_response({'blobs': [{'pathname': name, 'url': f"{self.url}/files/{name}", 'size': len(content)}
+                                            for name, content in self.blobs.items()], 'hasMore': False})
+        if method == 'PUT':
+            name = unquote(url.path[1:])
+            self.blobs[name] = body
+            return json_response({'pathname': name, 'url': f"{self.url}/files/{name}"})
+        if method == 'GET' and url.path.startswith("/files/"):
+            content = self.blobs.get(unquote(url.path[len("/files/"):]))
+            if content is None:
+                return json_response({'error': "blob non trovato"}, 404)
+            return 200, {'Content-Type': "application/octet-stream"}, content
+        return json_response({'error': "non trovato"}, 404)
+
+
+def registry_data(cineca, poli, concurrency=8, requests_per_second=1000):
+    """
+    Contenuto di 'sites.json' per un solo cliente Cineca che punta a 'cineca' e un polo (linkCalendarioId uguale
+    al nome) per ogni polo, aperto tutti i giorni dalle 7:30 alle 20 (così i risultati non dipendono dal giorno
+    della settimana).
+    """
+    return {
+        'tenants': {'stub': {'host': "cineca.local", 'baseUrl': cineca.url, 'clienteId': "stub",
+                             'concurrency': concurrency, 'requestsPerSecond': requests_per_second}},
+        'sites': {polo: {'tenant': "stub", 'linkCalendarioId': polo, 'hours': {'mon-sun': [["07:30", "20:00"]]},
+                         'coordinates': [10.40 + i / 1000, 43.72 - i / 1000]} for i, polo in enumerate(poli)},
+    }
+
+
+def registry_for(cineca, poli, concurrency=8, requests_per_second=1000):
+    return SiteRegistry(registry_data(cineca, poli, concurrency, requests_per_second))
+
+
+@contextmanager
+def offline(cineca, blob, registry):
+    """
+    Fa usare a unipi_calendar i server locali al posto di Cineca e VercelFS, partendo da cache vuote.
+    All'uscita ripristina registro, orari, indice dei poli, cache e configurazione di VercelFS.
+    """
+    saved = {name: getattr(unipi_calendar, name) for name in (
+        'site_registry', 'poli_calendar_ids', 'poli_coordinates', 'polo_locator', 'opening_hours', 'polo_cache',
+        'last_snapshots', 'last_good', 'blob_urls', 'blob_hashes', '_http_sessions', '_rate_limiters', '_circuit_breakers')}
+    saved_blob_url = vercel_blob.blob_store._VERCEL_BLOB_API_BASE_URL
+    saved_token = os.environ.get('BLOB_READ_WRITE_TOKEN')
+    try:
+        unipi_calendar.site_registry = registry
+        unipi_calendar.poli_calendar_ids = registry.calendar_ids()
+        unipi_calendar.poli_coordinates = registry.coordinates()
+        unipi_calendar.polo_locator = PoloLocator(unipi_calendar.poli_coordinates)
+        unipi_calendar.opening_hours = load_opening_hours(unipi_calendar.pisa_timezone, poli=registry.hours())
+        for name in ('polo_cache', 'last_snapshots', 'last_good', 'blob_urls', 'blob_hashes',
+                     '_http_sessions', '_rate_limiters', '_circuit_breakers'):
+            setattr(unipi_calendar, name, {})
+        # la libreria di VercelFS legge l'url dell'API da una costante del modulo
+        vercel_blob.blob_store._VERCEL_BLOB_API_BASE_URL = blob.url
+        os.environ['BLOB_READ_WRITE_TOKEN'] = "stub"
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(unipi_calendar, name, value)
+        vercel_blob.blob_store._VERCEL_BLOB_API_BASE_URL = saved_blob_url
+        if saved_token is None:
+            os.environ.pop('BLOB_READ_WRITE_TOKEN', None)
+        else:
+            os.environ['BLOB_READ_WRITE_TOKEN'] = saved_token
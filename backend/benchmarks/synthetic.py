@@ -0,0 +1,85 @@
+"""
+Generatore di calendari .ics e di 'aule.csv' sintetici, simili a quelli di Cineca: migliaia di VEVENT per polo,
+righe piegate a 75 caratteri e DESCRIPTION con più docenti e note.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+from unipi_calendar import pisa_timezone
+
+
+SURNAMES = ("ROSSI", "BIANCHI", "VERDI", "ESPOSITO", "RUSSO", "FERRARI", "ROMANO", "COLOMBO", "RICCI", "MARINO",
+            "GRECO", "BRUNO", "GALLO", "CONTI", "DE LUCA", "MANCINI", "COSTA", "GIORDANO", "RIZZO", "LOMBARDI")
+NAMES = ("MARIO", "ANNA", "LUCA", "GIULIA", "MARCO", "FRANCESCA", "PAOLO", "CHIARA", "ANDREA", "SARA")
+COURSES = ("Analisi matematica I", "Fisica generale II", "Fondamenti di informatica", "Economia aziendale",
+           "Chimica organica", "Diritto privato", "Algoritmi e strutture dati", "Geometria e algebra lineare",
+           "Meccanica razionale", "Statistica")
+ICS_LINE_LENGTH = 75  # lunghezza massima di una riga .ics, oltre la quale la riga viene piegata
+
+
+def fold(line):
+    """
+    Piega una riga .ics in righe di al massimo 75 caratteri: le continuazioni iniziano con uno spazio.
+    """
+    parts = [line[:ICS_LINE_LENGTH]]
+    for i in range(ICS_LINE_LENGTH, len(line), ICS_LINE_LENGTH - 1):
+        parts.append(" " + line[i:i + ICS_LINE_LENGTH - 1])
+    return "\r\n".join(parts)
+
+
+def ics_utc(local):
+    return local.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def room_names(polo, rooms):
+    return [f"Aula{polo[4:]}_{i + 1}" for i in range(rooms)]
+
+
+def description(rng):
+    professors = ", ".join(f"{rng.randint(100000, 999999)} {rng.choice(SURNAMES)} {rng.choice(NAMES)}"
+                           for _ in range(rng.choice((1, 1, 1, 2, 3))))
+    if rng.random() < 0.2:
+        return f"Docenti: {professors}\\nNOTE: lezione in presenza e in streaming sulla piattaforma di ateneo"
+    return f"Docenti: {professors}"
+
+
+def generate_ics(polo, day, days=7, events_per_day=300, rooms=40, seed=0):
+    """
+    Restituisce il calendario .ics di un polo con 'events_per_day' lezioni per ognuna delle 'days' giornate
+    a partire da 'day', distribuite su 'rooms' aule tra le 8 e le 19 (ora di Pisa).
+    Lo stesso seme produce sempre lo stesso calendario.
+    """
+    rng = random.Random(f"{polo}-{seed}")
+    names = room_names(polo, rooms)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Cineca//University Planner//IT", "CALSCALE:GREGORIAN"]
+    for d in range(days):
+        current = day + timedelta(days=d)
+        for i in range(events_per_day):
+            start = datetime(current.year, current.month, current.day, rng.randint(8, 17), rng.choice((0, 30)),
+                             tzinfo=pisa_timezone)
+            end = start + timedelta(hours=rng.choice((1, 2, 2, 3)))
+            room = rng.choice(names)
+            lines.extend((
+                "BEGIN:VEVENT",
+                f"UID:{polo}-{current.isoformat()}-{i}@up.cineca.it",
+                f"DTSTAMP:{ics_utc(start - timedelta(days=30))}",
+                f"DTSTART:{ics_utc(start)}",
+                f"DTEND:{ics_utc(end)}",
+                fold(f"SUMMARY:{rng.choice(COURSES)} - Corso di laurea {rng.randint(1, 40)}"),
+                fold(f"DESCRIPTION:{description(rng)}"),
+                fold(f"LOCATION:{room} - {polo} - Largo Lucio Lazzarino {rng.randint(1, 9)}, Pisa"),
+                "END:VEVENT",
+            ))
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def generate_aule_csv(poli, rooms=40):
+    """
+    Restituisce il contenuto di 'aule.csv' con le aule di `generate_ics`, quasi tutte usually_open.
+    """
+    rows = ["polo,aula,usually_open"]
+    for polo in poli:
+        for i, room in enumerate(room_names(polo, rooms)):
+            rows.append(f"{polo},{room},{i % 10 != 9}")
+    return "\n".join(rows) + "\n"
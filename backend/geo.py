@@ -0,0 +1,34 @@
+import math
+
+
+EARTH_RADIUS = 6371000  # metri
+
+
+class PoloLocator:
+    """
+    Indice spaziale dei poli: ordina i poli per distanza da un punto.
+    Le coordinate dei poli sono [longitudine, latitudine] come in `poli_coordinates`, e vengono convertite
+    una volta sola in radianti. Con poche decine di poli, tutti in città, una scansione ordinata delle
+    posizioni precalcolate è più veloce di un albero o di una griglia.
+    """
+    __slots__ = ('names', 'positions')
+
+    def __init__(self, coordinates):
+        self.names = tuple(coordinates)
+        self.positions = tuple((math.radians(lat), math.radians(lon)) for lon, lat in coordinates.values())
+
+    def by_distance(self, lat, lon):
+        """
+        Restituisce la lista delle coppie (distanza in metri, polo) ordinata dalla più vicina.
+        """
+        lat, lon = math.radians(lat), math.radians(lon)
+        return sorted((haversine(lat, lon, polo_lat, polo_lon), name)
+                      for name, (polo_lat, polo_lon) in zip(self.names, self.positions))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Distanza in metri tra due punti (latitudine e longitudine in radianti).
+    """
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
@@ -0,0 +1,84 @@
+# Configurazione del server di produzione: `gunicorn -c gunicorn.conf.py app:app`
+# Un solo processo loader scarica e analizza i calendari e salva lo snapshot su file (snapshot_store.SNAPSHOT_PATH);
+# i worker leggono solo quel file, così traffico verso Cineca e parsing dei .ics non crescono con il numero di worker.
+# La memoria invece cresce: ogni worker ricostruisce dallo snapshot indice, timeline e matrici di occupazione
+# come oggetti Python propri, che non si possono condividere tra processi. Con 17 poli, 300 lezioni per polo
+# e 7 giornate sono circa 23 MB e 1.5 s di CPU per worker ad ogni nuovo snapshot (vedi snapshot_restore_*
+# in `python -m benchmarks.run`): WEB_CONCURRENCY va scelto tenendone conto.
+# Se il loader termina (crash, OOM) il master lo riavvia, altrimenti i worker continuerebbero a servire
+# uno snapshot sempre più vecchio.
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))  # gli snapshot sono in sola lettura: i thread non si bloccano a vicenda
+worker_class = "gthread"
+# Ogni stream SSE aperto occupa un thread: app.py ne accetta al massimo AULEPI_MAX_SSE_STREAMS per worker
+# (di default metà dei thread), oltre risponde 503, così restano sempre thread liberi per le richieste all'API
+
+# Ereditate dai worker (e dal loader): i worker seguono il file dello snapshot invece di scaricare i calendari
+os.environ["AULEPI_ROLE"] = "worker"
+os.environ["AULEPI_SNAPSHOT_STORE"] = "file"
+
+LOADER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loader.py")
+LOADER_CHECK_INTERVAL = 5  # secondi tra due controlli del processo loader
+LOADER_RESTART_DELAY = 5  # attesa prima di riavviare un loader terminato, raddoppiata ad ogni crash ravvicinato
+LOADER_MAX_RESTART_DELAY = 300
+LOADER_STABLE_SECONDS = 600  # un loader rimasto attivo almeno tanto azzera l'attesa prima del riavvio
+
+_loader = None
+_stopping = threading.Event()
+_loader_lock = threading.Lock()  # un riavvio non può sovrapporsi alla chiusura del server
+
+
+def start_loader(log):
+    global _loader
+    with _loader_lock:
+        if _stopping.is_set():
+            return None
+        _loader = subprocess.Popen([sys.executable, LOADER_PATH])
+    log.info("Loader dei calendari avviato (pid %s)", _loader.pid)
+    return time.monotonic()
+
+
+def watch_loader(log):
+    """
+    Eseguita in un thread del master: riavvia il loader quando termina, aspettando sempre di più
+    se continua a terminare subito (es. configurazione non valida), per non riavviarlo in un ciclo stretto.
+    Il master di gunicorn raccoglie tutti i processi figli terminati, quindi anche il loader: in quel caso
+    `poll` restituisce 0 invece del codice di uscita.
+    """
+    started = time.monotonic()
+    delay = LOADER_RESTART_DELAY
+    while not _stopping.wait(LOADER_CHECK_INTERVAL):
+        code = _loader.poll()
+        if code is None:
+            continue
+        if time.monotonic() - started >= LOADER_STABLE_SECONDS:
+            delay = LOADER_RESTART_DELAY
+        log.error("Loader dei calendari terminato (pid %s, codice %s), riavvio tra %s s", _loader.pid, code, delay)
+        if _stopping.wait(delay):
+            return
+        started = start_loader(log)
+        if started is None:
+            return
+        delay = min(delay * 2, LOADER_MAX_RESTART_DELAY)
+
+
+def on_starting(server):
+    start_loader(server.log)
+    threading.Thread(target=watch_loader, args=(server.log,), name="loader-watchdog", daemon=True).start()
+
+
+def on_exit(server):
+    with _loader_lock:
+        _stopping.set()
+    if _loader is not None:
+        _loader.terminate()
+        _loader.wait(10)
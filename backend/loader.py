@@ -0,0 +1,68 @@
+import logging
+import os
+
+import metrics
+import profiler
+import unipi_calendar
+import snapshot_store
+from logs import configure_logging
+from refresher import CalendarRefresher
+
+
+# File in cui il processo loader salva le metriche dell'aggiornamento dei calendari dopo ogni aggiornamento:
+# i worker non scaricano i calendari, quindi /metrics le legge da qui
+REFRESH_METRICS_PATH = os.environ.get("AULEPI_REFRESH_METRICS_PATH", snapshot_store.SNAPSHOT_PATH + ".metrics")
+
+log = logging.getLogger(__name__)
+
+
+def after_publish(snapshot):
+    # eseguita nel thread del refresher: salva lo snapshot (per gli avvii a freddo e per i worker) e aggiorna 'aule.csv'
+    snapshot_store.save_snapshot(snapshot)
+    unipi_calendar.buildings_to_csv(snapshot['usually_open'])
+
+
+def save_refresh_metrics(path=REFRESH_METRICS_PATH):
+    # scrittura atomica, come per lo snapshot: /metrics legge il file vecchio o quello nuovo
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding='utf-8') as f:
+        f.write(metrics.refresh_registry.render())
+    os.replace(temporary_path, path)
+
+
+def make_refresher(publish, save_metrics=False):
+    """
+    Crea il refresher che scarica i calendari da Cineca. All'avvio si riparte dall'ultimo snapshot salvato, se è di oggi.
+    Con save_metrics=True le metriche dell'aggiornamento vengono salvate in REFRESH_METRICS_PATH dopo ogni caricamento
+    e dopo ogni upload di 'aule.csv'. Con la profilazione attiva (vedi profiler.py) ogni caricamento viene profilato.
+    """
+    load, on_publish = unipi_calendar.load_calendars_and_parse, after_publish
+    if save_metrics:
+        def load(day):
+            try:
+                return unipi_calendar.load_calendars_and_parse(day)
+            finally:
+                save_refresh_metrics()
+
+        def on_publish(snapshot):
+            try:
+                after_publish(snapshot)
+            finally:
+                save_refresh_metrics()
+    return CalendarRefresher(profiler.profile_refreshes(load), publish, unipi_calendar.pisa_timezone,
+                             after_publish=on_publish, restore=snapshot_store.load_snapshot)
+
+
+def main():
+    # Processo loader del server di produzione (vedi gunicorn.conf.py): è l'unico che scarica e analizza i calendari,
+    # i worker leggono lo snapshot che viene salvato ad ogni pubblicazione
+    configure_logging()
+    refresher = make_refresher(lambda snapshot: log.info("Snapshot pubblicato", extra={'day': snapshot['date'],
+                                                                                       'id': snapshot['id']}),
+                               save_metrics=True)
+    refresher.start()
+    refresher.thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import sys
+
+
+# Livello dei log (DEBUG, INFO, WARNING, ERROR) e formato: 'text' per leggerli a terminale, 'json' una riga per evento
+LOG_LEVEL = os.environ.get("AULEPI_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("AULEPI_LOG_FORMAT", "text")
+
+# Attributi presenti in ogni LogRecord: tutti gli altri sono i campi passati con extra={...}
+STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {'message', 'asctime'}
+
+
+def record_fields(record):
+    """
+    Restituisce i campi strutturati del messaggio (quelli passati con extra={...}).
+    """
+    return {name: value for name, value in vars(record).items() if name not in STANDARD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Messaggio seguito dai campi strutturati come chiave=valore, es. "Calendario scaricato polo=poloA bytes=1234".
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{name}={value}" for name, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Un oggetto JSON per riga con ora, livello, logger, messaggio e campi strutturati.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            'epoch': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    Configura i log del processo (app, loader): livello e formato da AULEPI_LOG_LEVEL e AULEPI_LOG_FORMAT.
+    Se i log sono già configurati (es. dal server o dai test) viene impostato solo il livello.
+    """
+    root = logging.getLogger()
+    root.setLevel(level)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
@@ -0,0 +1,166 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Limiti dei bucket (secondi) degli istogrammi dei tempi: da un decimo di millisecondo (richieste servite dalla cache)
+# a un paio di minuti (un aggiornamento completo dei calendari)
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 120)
+# Limiti dei bucket (bytes) degli istogrammi delle dimensioni delle risposte
+SIZE_BUCKETS = (128, 1024, 8192, 32768, 131072, 524288, 2097152)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    """
+    Metrica con nome, descrizione e nomi delle etichette: ogni combinazione di valori delle etichette ha il proprio valore.
+    Gli aggiornamenti sono protetti da un lock, perché le richieste e i download arrivano da più thread.
+    """
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # tupla dei valori delle etichette -> valore
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Etichette di {self.name} non valide: {', '.join(sorted(labels))}")
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, (), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{format_labels(self.labels, key, extra)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Istogramma cumulativo come quelli di Prometheus: per ogni combinazione di etichette conta le osservazioni
+    minori o uguali a ciascun limite di 'buckets' e tiene la somma e il numero delle osservazioni.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0, 0]  # conteggi per bucket, somma, numero
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Misura la durata del blocco 'with' (anche se solleva un'eccezione) e la aggiunge all'istogramma.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            entries = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self.values.items())]
+        for key, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key, (('le', format_value(float(bound))),), cumulative))
+            samples.append((f"{self.name}_sum", key, (), total))
+            samples.append((f"{self.name}_count", key, (), count))
+        return samples
+
+
+class Registry:
+    """
+    Insieme di metriche esposte insieme nel formato testuale di Prometheus (vedi /metrics in app.py).
+    Le metriche calcolate al momento della lettura (es. l'età dello snapshot) si aggiungono con `add_collector`.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []  # funzioni eseguite prima di ogni `render`, aggiornano le metriche calcolate
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metrica {metric.name} già registrata")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def add_collector(self, collect):
+        self.collectors.append(collect)
+
+    def render(self):
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+# Metriche dell'aggiornamento dei calendari, raccolte nel processo che scarica i calendari (l'app in sviluppo,
+# loader.py in produzione), e metriche delle richieste, raccolte da ogni processo che serve l'API
+refresh_registry = Registry()
+request_registry = Registry()
@@ -0,0 +1,201 @@
+from datetime import datetime
+from functools import lru_cache
+
+
+# Campi che si possono chiedere nelle risposte: coordinate del polo, stato del polo (free, buildingAvailableSoon,
+# isClosed), stato delle aule (free, roomAvailableSoon) e lezioni rimanenti delle aule
+STATUS_FIELDS = frozenset(['coordinates', 'status', 'rooms', 'lessons'])
+
+
+class Lesson:
+    """
+    Lezione in un'aula. Gli orari sono epoch in secondi, polo e aula sono stringhe internate
+    (le stesse poche centinaia di nomi si ripetono in migliaia di lezioni).
+    Le stringhe con l'orario locale vengono prodotte solo quando la lezione viene serializzata.
+    """
+    __slots__ = ('polo', 'room', 'start', 'end', 'professor')
+
+    def __init__(self, polo, room, start, end, professor):
+        self.polo = polo
+        self.room = room
+        self.start = start
+        self.end = end
+        self.professor = professor
+
+    def to_json(self, tz):
+        return {
+            'professor': self.professor,
+            'start': format_local_time(self.start, tz),
+            'end': format_local_time(self.end, tz),
+        }
+
+
+class Building:
+    """
+    Polo con le sue aule. Le aule sono separate dai metadati del polo: 'rooms' contiene solo
+    nome dell'aula -> usually_open (False se l'aula non compare in 'aule.csv').
+    """
+    __slots__ = ('name', 'coordinates', 'rooms')
+
+    def __init__(self, name, coordinates, rooms=None):
+        self.name = name
+        self.coordinates = coordinates
+        self.rooms = rooms if rooms is not None else {}
+
+
+class RoomStatus:
+    """
+    Stato di un'aula in un intervallo della timeline: lezioni non ancora terminate (tupla di Lesson),
+    aula libera e aula disponibile a breve.
+    """
+    __slots__ = ('name', 'lessons', 'free', 'available_soon')
+
+    def __init__(self, name, lessons, free, available_soon):
+        self.name = name
+        self.lessons = lessons
+        self.free = free
+        self.available_soon = available_soon
+
+    def same_as(self, other):
+        return (other is not None and self.free == other.free and self.available_soon == other.available_soon
+                and self.lessons == other.lessons)
+
+    def to_json(self, tz, fields=STATUS_FIELDS):
+        room = {
+            'free': self.free,
+            'roomAvailableSoon': self.available_soon,
+        }
+        if 'lessons' in fields:
+            room['lessons'] = [lesson.to_json(tz) for lesson in self.lessons]
+        return room
+
+
+class BuildingStatus:
+    """
+    Stato di un polo in un intervallo della timeline. 'rooms' è una tupla di RoomStatus
+    nello stesso ordine di Building.rooms.
+    """
+    __slots__ = ('building', 'free', 'available_soon', 'is_closed', 'rooms')
+
+    def __init__(self, building, free, available_soon, is_closed, rooms):
+        self.building = building
+        self.free = free
+        self.available_soon = available_soon
+        self.is_closed = is_closed
+        self.rooms = rooms
+
+    def same_as(self, other):
+        return (other is not None and self.building is other.building and self.free == other.free
+                and self.available_soon == other.available_soon and self.is_closed == other.is_closed
+                and len(self.rooms) == len(other.rooms)
+                and all(room is other_room for room, other_room in zip(self.rooms, other.rooms)))
+
+    def to_json(self, tz, rooms=None, fields=STATUS_FIELDS):
+        """
+        Restituisce il polo nel formato del frontend, con i soli campi in 'fields'
+        e, se 'rooms' non è None, le sole aule con il nome in 'rooms'.
+        """
+        building = {}
+        if 'coordinates' in fields:
+            building['coordinates'] = self.building.coordinates
+        if 'status' in fields:
+            building['free'] = self.free
+            building['buildingAvailableSoon'] = self.available_soon
+            building['isClosed'] = self.is_closed
+        if 'rooms' in fields or 'lessons' in fields:
+            for room in self.rooms:
+                if rooms is None or room.name in rooms:
+                    building[room.name] = room.to_json(tz, fields)
+        return building
+
+
+def status_to_json(state, tz, poli=None, rooms=None, fields=STATUS_FIELDS):
+    """
+    Converte lo stato degli edifici (tupla di BuildingStatus) nel dizionario restituito al frontend:
+    polo -> metadati del polo e, per ogni aula, lezioni rimanenti, 'free' e 'roomAvailableSoon'.
+    'poli' e 'rooms' (se non None) limitano la risposta ai poli e alle aule indicati, 'fields' ai campi indicati.
+    """
+    return {building.building.name: building.to_json(tz, rooms, fields)
+            for building in state if poli is None or building.building.name in poli}
+
+
+def status_to_columns(state, poli=None, rooms=None, fields=STATUS_FIELDS):
+    """
+    Converte lo stato degli edifici in un formato compatto a colonne: una lista per ogni campo, booleani come
+    0/1, orari in minuti dall'epoch e nomi delle aule e dei docenti sostituiti dall'indice in una tabella.
+    Le righe di 'rooms' puntano al polo ('polo' è l'indice in 'poli'), quelle di 'lessons' all'aula
+    ('room' è l'indice della riga in 'rooms'). Filtri e campi come in `status_to_json`.
+    """
+    buildings = [building for building in state if poli is None or building.building.name in poli]
+    columns = {'format': 'columns-1', 'poli': [building.building.name for building in buildings]}
+    if 'coordinates' in fields:
+        columns['coordinates'] = [building.building.coordinates for building in buildings]
+    if 'status' in fields:
+        columns['free'] = [int(building.free) for building in buildings]
+        columns['availableSoon'] = [int(building.available_soon) for building in buildings]
+        columns['isClosed'] = [int(building.is_closed) for building in buildings]
+    if 'rooms' not in fields and 'lessons' not in fields:
+        return columns
+
+    names = {}  # tabella dei nomi delle aule: nome -> indice
+    professors = {}  # tabella dei docenti: descrizione -> indice
+    room_columns = {'polo': [], 'name': [], 'free': [], 'availableSoon': []}
+    lesson_columns = {'room': [], 'start': [], 'end': [], 'professor': []}
+    for i, building in enumerate(buildings):
+        for room in building.rooms:
+            if rooms is not None and room.name not in rooms:
+                continue
+            row = len(room_columns['polo'])
+            room_columns['polo'].append(i)
+            room_columns['name'].append(names.setdefault(room.name, len(names)))
+            room_columns['free'].append(int(room.free))
+            room_columns['availableSoon'].append(int(room.available_soon))
+            if 'lessons' in fields:
+                for lesson in room.lessons:
+                    lesson_columns['room'].append(row)
+                    lesson_columns['start'].append(lesson.start // 60)
+                    lesson_columns['end'].append(lesson.end // 60)
+                    lesson_columns['professor'].append(professors.setdefault(lesson.professor, len(professors)))
+    columns['names'] = list(names)
+    columns['rooms'] = room_columns
+    if 'lessons' in fields:
+        columns['professors'] = list(professors)
+        columns['lessons'] = lesson_columns
+    return columns
+
+
+def status_delta(old, new, tz):
+    """
+    Restituisce le differenze tra due stati degli edifici nello stesso formato di `status_to_json`,
+    ma solo con i poli cambiati e, per ognuno, i metadati del polo e le sole aule cambiate.
+    Il client aggiorna lo stato sostituendo i campi ricevuti. Restituisce None se i due stati non hanno
+    gli stessi poli e le stesse aule (es. dopo un aggiornamento di 'aule.csv'): serve lo stato completo.
+    """
+    if len(old) != len(new):
+        return None
+    delta = {}
+    for old_building, building in zip(old, new):
+        if old_building is building:
+            continue  # stati consecutivi della stessa timeline condividono i poli non cambiati
+        if (old_building.building.name != building.building.name
+                or [room.name for room in old_building.rooms] != [room.name for room in building.rooms]):
+            return None
+        rooms = [room for old_room, room in zip(old_building.rooms, building.rooms)
+                 if old_room is not room and not room.same_as(old_room)]
+        metadata_changed = ((building.free, building.available_soon, building.is_closed, building.building.coordinates)
+                            != (old_building.free, old_building.available_soon, old_building.is_closed,
+                                old_building.building.coordinates))
+        if rooms or metadata_changed:
+            changed = BuildingStatus(building.building, building.free, building.available_soon, building.is_closed,
+                                     tuple(rooms))
+            delta[building.building.name] = changed.to_json(tz)
+    return delta
+
+
+@lru_cache(maxsize=4096)
+def format_local_time(timestamp, tz):
+    """
+    Converte un epoch nell'ora locale ('YYYY-MM-DD HH:MM:SS'). Gli orari si ripetono molto tra le lezioni,
+    quindi le conversioni vengono memorizzate.
+    """
+    return datetime.fromtimestamp(timestamp, tz).strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,126 @@
+import base64
+from itertools import chain
+
+try:
+    import numpy as np  # opzionale: senza, le matrici di occupazione e /api/occupancy non sono disponibili
+except ImportError:
+    np = None
+
+
+SLOT_SECONDS = 5 * 60  # durata di uno slot della matrice di occupazione
+
+
+class OccupancyMatrix:
+    """
+    Occupazione delle aule in una giornata, a slot di SLOT_SECONDS: matrice booleana NumPy aule × slot,
+    True se nello slot l'aula non è disponibile perché c'è una lezione (anche solo per una parte dello slot),
+    il polo è chiuso oppure l'aula non è usually_open.
+    Lo slot i copre l'intervallo [start + i * SLOT_SECONDS, start + (i + 1) * SLOT_SECONDS).
+    Le domande su tutte le aule (es. "quali aule sono libere dalle 14 alle 16") diventano operazioni sulle colonne.
+    La matrice è in sola lettura, come il resto dello snapshot.
+    """
+    __slots__ = ('day', 'start', 'end', 'rooms', 'positions', 'occupied')
+
+    def __init__(self, day, start, end, rooms, occupied):
+        self.day = day
+        self.start = start  # inizio della giornata (epoch)
+        self.end = end  # fine della giornata (epoch)
+        self.rooms = tuple(rooms)  # (polo, aula) di ogni riga
+        self.positions = {room: i for i, room in enumerate(self.rooms)}
+        occupied.flags.writeable = False
+        self.occupied = occupied
+
+    @property
+    def slots(self):
+        return self.occupied.shape[1]
+
+    def slot_range(self, start, end):
+        """
+        Restituisce gli slot [primo, ultimo) che si sovrappongono all'intervallo [start, end) (epoch).
+        """
+        first = max(int((start - self.start) // SLOT_SECONDS), 0)
+        last = min(int(-((self.start - end) // SLOT_SECONDS)), self.slots)
+        return first, max(first, last)
+
+    def free_between(self, start, end):
+        """
+        Restituisce le aule (polo, aula) disponibili per tutto l'intervallo [start, end), nell'ordine delle righe.
+        """
+        first, last = self.slot_range(start, end)
+        free = ~self.occupied[:, first:last].any(axis=1)
+        return [self.rooms[i] for i in np.flatnonzero(free)]
+
+    def packed(self, poli=None):
+        """
+        Restituisce polo -> aula -> bit dell'occupazione dell'aula in base64: un bit per slot, il primo slot
+        nel bit più significativo del primo byte (numpy.packbits), con gli ultimi bit del byte finale a zero.
+        'poli' limita il risultato ad alcuni poli.
+        """
+        rows = [i for i, (polo, _) in enumerate(self.rooms) if poli is None or polo in poli]
+        packed = np.packbits(self.occupied[rows], axis=1)
+        result = {}
+        for i, bits in zip(rows, packed):
+            polo, room = self.rooms[i]
+            result.setdefault(polo, {})[room] = base64.b64encode(bits.tobytes()).decode('ascii')
+        return result
+
+
+def slot_bounds(start, end, day_start, slots):
+    """
+    Converte gli intervalli [start, end) (array di epoch) negli slot [primo, ultimo) che toccano,
+    limitati alla giornata.
+    """
+    first = np.clip((start - day_start) // SLOT_SECONDS, 0, slots)
+    last = np.clip(-((day_start - end) // SLOT_SECONDS), 0, slots)
+    return first, last
+
+
+def fill_intervals(rows, first, last, shape):
+    """
+    Restituisce una matrice booleana 'shape' con True negli slot [first, last) delle righe 'rows', in un solo passaggio:
+    +1 all'inizio e -1 alla fine di ogni intervallo, poi somma cumulativa lungo gli slot.
+    """
+    keep = first < last
+    rows, first, last = rows[keep], first[keep], last[keep]
+    counts = np.zeros((shape[0], shape[1] + 1), dtype=np.int32)
+    np.add.at(counts, (rows, first), 1)
+    np.add.at(counts, (rows, last), -1)
+    return np.cumsum(counts[:, :-1], axis=1) > 0
+
+
+def build_occupancy(day_hours, buildings, rooms_index):
+    """
+    Costruisce la matrice di occupazione della giornata di 'day_hours' (opening_hours.DayOpeningHours)
+    per tutte le aule di 'buildings' (polo -> Building), a partire dall'indice delle lezioni.
+    """
+    rooms = [(polo, room) for polo, building in buildings.items() for room in building.rooms]
+    positions = {room: i for i, room in enumerate(rooms)}
+    slots = -((day_hours.start - day_hours.end) // SLOT_SECONDS)
+    shape = (len(rooms), slots)
+
+    # Lezioni di tutte le aule come tre array (riga, inizio, fine)
+    indexes = [(positions[room], index) for room, index in rooms_index.items() if room in positions]
+    counts = [len(index.starts) for _, index in indexes]
+    rows = np.repeat(np.array([row for row, _ in indexes], dtype=np.intp), counts)
+    starts = np.fromiter(chain.from_iterable(index.starts for _, index in indexes), dtype=np.int64, count=sum(counts))
+    ends = np.fromiter(chain.from_iterable(index.ends for _, index in indexes), dtype=np.int64, count=sum(counts))
+    occupied = fill_intervals(rows, *slot_bounds(starts, ends, day_hours.start, slots), shape)
+
+    # Orari di apertura: un polo è disponibile solo negli slot interamente compresi negli intervalli di apertura
+    poli = list(buildings)
+    polo_rows, openings, closings = [], [], []
+    for i, polo in enumerate(poli):
+        bounds = day_hours.bounds_of(polo)
+        for opening, closing in zip(bounds[::2], bounds[1::2]):
+            polo_rows.append(i)
+            openings.append(-((day_hours.start - opening) // SLOT_SECONDS))
+            closings.append((closing - day_hours.start) // SLOT_SECONDS)
+    is_open = fill_intervals(np.array(polo_rows, dtype=np.intp), np.clip(np.array(openings, dtype=np.int64), 0, slots),
+                             np.clip(np.array(closings, dtype=np.int64), 0, slots), (len(poli), slots))
+    polo_positions = {polo: i for i, polo in enumerate(poli)}
+    polo_of_room = np.array([polo_positions[polo] for polo, _ in rooms], dtype=np.intp)
+    usually_open = np.array([buildings[polo].rooms[room] for polo, room in rooms], dtype=bool)
+
+    occupied |= ~is_open[polo_of_room]
+    occupied |= ~usually_open[:, None]
+    return OccupancyMatrix(day_hours.day, day_hours.start, day_hours.end, rooms, occupied)
@@ -0,0 +1,191 @@
+import json
+import os
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+
+
+OPENING_HOURS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_hours.json")
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+COMPILED_DAYS = 64  # giornate compilate tenute in memoria
+
+
+class DayOpeningHours:
+    """
+    Orari di apertura di tutti i poli in una giornata, compilati in epoch (secondi).
+    Per ogni polo 'bounds' contiene gli estremi degli intervalli di apertura ordinati
+    (apertura, chiusura, apertura, ...): il polo è aperto se il numero di estremi non successivi
+    all'istante è dispari. Le ricerche lavorano su poche voci, quindi costano praticamente come un accesso diretto.
+    """
+    __slots__ = ('day', 'start', 'end', 'bounds', 'default')
+
+    def __init__(self, day, start, end, bounds, default):
+        self.day = day
+        self.start = start  # inizio della giornata (epoch)
+        self.end = end  # fine della giornata (epoch)
+        self.bounds = bounds  # polo -> tupla degli estremi degli intervalli di apertura
+        self.default = default  # estremi per i poli senza orari propri
+
+    def bounds_of(self, polo):
+        return self.bounds.get(polo, self.default)
+
+    def is_open(self, polo, t):
+        return bisect_right(self.bounds_of(polo), t) % 2 == 1
+
+    def next_change(self, polo, t):
+        """
+        Restituisce l'istante successivo a 't' in cui il polo apre o chiude, oppure la fine della giornata.
+        """
+        bounds = self.bounds_of(polo)
+        i = bisect_right(bounds, t)
+        return bounds[i] if i < len(bounds) else self.end
+
+    def transitions(self, polo):
+        """
+        Restituisce gli istanti della giornata in cui il polo apre o chiude.
+        """
+        return self.bounds_of(polo)
+
+
+class OpeningHours:
+    """
+    Orari di apertura dei poli, letti da 'opening_hours.json' e dal registro dei poli ('sites.json')
+    invece di essere scritti nel codice:
+    - "default": orari settimanali dei poli che non ne hanno di propri;
+    - "poli": orari settimanali di ogni polo (i giorni non indicati usano quelli di "default"), dal registro dei poli;
+    - "exceptions": lista di eccezioni per date o periodi (festività, sessioni d'esame),
+      {"from": "YYYY-MM-DD", "to": "YYYY-MM-DD", "poli": [...], "hours": [["HH:MM", "HH:MM"], ...]}.
+      Senza "to" l'eccezione vale solo per "from", senza "poli" vale per tutti i poli, "hours" vuoto vuol dire chiuso.
+      Se più eccezioni valgono per lo stesso giorno vale l'ultima.
+    Gli orari settimanali sono dizionari giorno ("mon".."sun", oppure un intervallo come "mon-fri")
+    -> lista di intervalli [apertura, chiusura) in ora locale; "24:00" è la mezzanotte successiva.
+    Ogni giornata viene compilata una volta sola negli intervalli di apertura in epoch (vedi DayOpeningHours).
+    """
+
+    def __init__(self, data, tz):
+        self.tz = tz
+        self.default = parse_week(data.get('default', {}))
+        self.poli = {polo: parse_week(week) for polo, week in data.get('poli', {}).items()}
+        self.exceptions = [parse_exception(exception) for exception in data.get('exceptions', [])]
+        self.days = {}  # date -> DayOpeningHours
+
+    def day(self, day):
+        """
+        Restituisce gli orari compilati della giornata 'day' (date).
+        """
+        compiled = self.days.get(day)
+        if compiled is None:
+            compiled = self.compile(day)
+            if len(self.days) >= COMPILED_DAYS:
+                self.days = {}
+            self.days[day] = compiled
+        return compiled
+
+    def at(self, t):
+        """
+        Restituisce gli orari compilati della giornata che contiene l'istante 't' (epoch in secondi).
+        """
+        return self.day(datetime.fromtimestamp(t, self.tz).date())
+
+    def is_open(self, polo, t):
+        return self.at(t).is_open(polo, t)
+
+    def next_change(self, polo, t):
+        return self.at(t).next_change(polo, t)
+
+    def hours_of(self, polo, day):
+        """
+        Restituisce gli intervalli di apertura (in minuti dalla mezzanotte) del polo nella giornata 'day'.
+        """
+        hours = None
+        for exception in self.exceptions:
+            first, last, poli, exception_hours = exception
+            if first <= day <= last and (poli is None or polo in poli):
+                hours = exception_hours
+        if hours is not None:
+            return hours
+        week = self.poli.get(polo, self.default)
+        return week.get(day.weekday(), self.default.get(day.weekday(), ()))
+
+    def compile(self, day):
+        start = self.epoch(day, 0)
+        end = self.epoch(day + timedelta(days=1), 0)
+        bounds = {polo: self.compile_hours(day, self.hours_of(polo, day)) for polo in self.poli}
+        # i poli senza orari propri possono comunque avere delle eccezioni: vengono compilati a parte
+        for _, _, poli, _ in self.exceptions:
+            for polo in poli or ():
+                if polo not in bounds:
+                    bounds[polo] = self.compile_hours(day, self.hours_of(polo, day))
+        default = self.compile_hours(day, self.hours_of(None, day))
+        return DayOpeningHours(day, start, end, bounds, default)
+
+    def compile_hours(self, day, hours):
+        bounds = []
+        for opening, closing in sorted(hours):
+            opening, closing = self.epoch(day, opening), self.epoch(day, closing)
+            if bounds and opening <= bounds[-1]:
+                bounds[-1] = max(bounds[-1], closing)  # intervalli sovrapposti o contigui
+            else:
+                bounds.extend((opening, closing))
+        return tuple(bounds)
+
+    def epoch(self, day, minutes):
+        day = day + timedelta(days=minutes // (24 * 60))
+        minutes %= 24 * 60
+        return int(datetime.combine(day, time(minutes // 60, minutes % 60), tzinfo=self.tz).timestamp())
+
+
+def parse_time(value):
+    """
+    Converte "HH:MM" nei minuti dalla mezzanotte (fino a "24:00").
+    """
+    try:
+        hours, minutes = value.split(":")
+        hours, minutes = int(hours), int(minutes)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Orario non valido: {value!r}") from None
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or (hours == 24 and minutes != 0):
+        raise ValueError(f"Orario non valido: {value!r}")
+    return hours * 60 + minutes
+
+
+def parse_hours(intervals):
+    hours = []
+    for opening, closing in intervals:
+        opening, closing = parse_time(opening), parse_time(closing)
+        if opening >= closing:
+            raise ValueError(f"Intervallo di apertura vuoto: {opening} - {closing}")
+        hours.append((opening, closing))
+    return tuple(hours)
+
+
+def parse_week(week):
+    """
+    Converte gli orari settimanali in un dizionario giorno (0 = lunedì) -> intervalli in minuti.
+    """
+    days = {}
+    for key, intervals in week.items():
+        first, _, last = key.partition("-")
+        if first not in WEEKDAYS or (last and last not in WEEKDAYS):
+            raise ValueError(f"Giorno della settimana non valido: {key!r}")
+        hours = parse_hours(intervals)
+        for weekday in range(WEEKDAYS.index(first), WEEKDAYS.index(last or first) + 1):
+            days[weekday] = hours
+    return days
+
+
+def parse_exception(exception):
+    first = date.fromisoformat(exception['from'])
+    last = date.fromisoformat(exception.get('to', exception['from']))
+    poli = exception.get('poli')
+    return first, last, frozenset(poli) if poli is not None else None, parse_hours(exception.get('hours', []))
+
+
+def load_opening_hours(tz, path=OPENING_HOURS_FILE, poli=None):
+    """
+    Legge orari di default ed eccezioni da 'path'; 'poli' (polo -> orari settimanali) sono gli orari dei singoli poli.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if poli is not None:
+        data['poli'] = poli
+    return OpeningHours(data, tz)
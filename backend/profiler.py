@@ -0,0 +1,138 @@
+import collections
+import hmac
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+
+# Profilazione su richiesta, disattivata di default. Con AULEPI_PROFILE=1 vengono profilati ogni aggiornamento
+# dei calendari e una frazione AULEPI_PROFILE_RATE delle richieste; se è impostato AULEPI_PROFILE_TOKEN le richieste
+# con l'header X-Profile uguale al token vengono sempre profilate (anche con AULEPI_PROFILE spento).
+# I profili vengono scritti in AULEPI_PROFILE_DIR come stack compressi ("a;b;c <campioni>" per riga),
+# il formato letto da flamegraph.pl, speedscope e inferno
+PROFILE_ENABLED = os.environ.get("AULEPI_PROFILE", "") in ("1", "true")
+PROFILE_RATE = float(os.environ.get("AULEPI_PROFILE_RATE", "0.01"))
+PROFILE_TOKEN = os.environ.get("AULEPI_PROFILE_TOKEN") or None
+PROFILE_DIR = os.environ.get("AULEPI_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_HEADER = "X-Profile"
+SAMPLE_INTERVAL = 0.005  # secondi tra due campioni dello stack
+
+log = logging.getLogger(__name__)
+_profile_numbers = itertools.count(1)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+class SamplingProfiler:
+    """
+    Profiler a campionamento: un thread separato legge lo stack dei thread profilati ogni 'interval' secondi
+    (sys._current_frames) e conta quante volte compare ogni stack. Il codice profilato non viene strumentato,
+    quindi il costo è quello del campionamento e non dipende da quante funzioni vengono chiamate.
+    Vengono profilati il thread che chiama `start` e, con follow_new_threads=True, i thread avviati dopo
+    (es. i download in parallelo di un aggiornamento): i loro stack iniziano con il nome del thread.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, follow_new_threads=False):
+        self.interval = interval
+        self.follow_new_threads = follow_new_threads
+        self.stacks = collections.Counter()  # "frame;frame;..." (dall'esterno verso l'interno) -> campioni
+        self.samples = 0
+        self.target = None
+        self.existing = frozenset()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.target = threading.get_ident()
+        self.existing = frozenset(sys._current_frames())
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Ferma il campionamento e restituisce gli stack raccolti.
+        """
+        self.stopped.set()
+        self.thread.join()
+        return self.stacks
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            self.sample(own)
+
+    def sample(self, own):
+        names = {thread.ident: thread.name for thread in threading.enumerate()} if self.follow_new_threads else {}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if ident != self.target and not (self.follow_new_threads and ident not in self.existing):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if self.follow_new_threads:
+                stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+def should_profile_request(headers):
+    """
+    Decide se profilare una richiesta: sempre con l'header X-Profile uguale a PROFILE_TOKEN, altrimenti
+    con probabilità PROFILE_RATE se la profilazione è attiva. Con la profilazione spenta e senza token
+    costa due confronti. Il token è confrontato in tempo costante, per non rivelarlo un carattere alla volta.
+    """
+    if PROFILE_TOKEN is not None:
+        token = headers.get(PROFILE_HEADER)
+        if token is not None and hmac.compare_digest(token.encode('utf-8'), PROFILE_TOKEN.encode('utf-8')):
+            return True
+    return PROFILE_ENABLED and random.random() < PROFILE_RATE
+
+
+def write_profile(profiler, name, directory=None):
+    """
+    Salva gli stack di 'profiler' in '<directory>/<name>-<data e ora>-<pid>-<n>.folded' e restituisce il percorso,
+    oppure None se non è stato raccolto nessun campione (blocco più breve dell'intervallo di campionamento).
+    """
+    if not profiler.stacks:
+        return None
+    directory = directory if directory is not None else PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_numbers)}.folded"
+    path = os.path.join(directory, file_name)
+    with open(path, "w", encoding='utf-8') as f:
+        f.write(profiler.collapsed())
+    log.info("Profilo salvato", extra={'path': path, 'samples': profiler.samples})
+    return path
+
+
+def profile_refreshes(load):
+    """
+    Restituisce 'load' (la funzione che carica i calendari di una giornata) profilata ad ogni chiamata
+    se la profilazione è attiva, altrimenti 'load' stessa.
+    """
+    if not PROFILE_ENABLED:
+        return load
+
+    def profiled_load(day):
+        profiler = SamplingProfiler(follow_new_threads=True).start()
+        try:
+            return load(day)
+        finally:
+            profiler.stop()
+            write_profile(profiler, "refresh")
+
+    return profiled_load
@@ -0,0 +1,164 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+
+PRELOAD_BEFORE_MIDNIGHT = timedelta(hours=1)  # quanto prima della mezzanotte vengono scaricati i calendari del giorno dopo
+RETRY_AFTER_ERROR = timedelta(minutes=5)  # attesa prima di riprovare un aggiornamento fallito
+REFRESH_INTERVAL = timedelta(hours=2)  # ogni quanto si ricontrollano i calendari della giornata per modifiche all'orario
+
+log = logging.getLogger(__name__)
+
+
+class CalendarRefresher:
+    """
+    Aggiorna i calendari in un thread in background, così le richieste non aspettano mai il download.
+    I calendari del giorno successivo vengono preparati un'ora prima della mezzanotte e pubblicati
+    allo scoccare della nuova giornata; se un aggiornamento fallisce si continua a servire l'ultimo snapshot valido.
+    Durante la giornata i calendari vengono ricontrollati ogni REFRESH_INTERVAL: se `load` restituisce
+    lo stesso snapshot già servito (nessuna modifica) non viene ripubblicato nulla.
+    Lo snapshot è il dizionario restituito da `load`, con almeno la chiave 'date' ('YYYY-MM-DD').
+    `load` deve costruire lo snapshot senza toccare quello servito, perché il giorno dopo viene preparato
+    mentre quello attuale è ancora in uso.
+    """
+
+    def __init__(self, load, publish, tz, after_publish=None, clock=None, restore=None):
+        self.load = load  # load(day) -> snapshot dei calendari della giornata 'day'
+        self.publish = publish  # publish(snapshot) rende lo snapshot visibile alle richieste, senza accedere alla rete
+        self.after_publish = after_publish  # after_publish(snapshot) viene eseguita dal thread dopo ogni pubblicazione (es. upload)
+        self.restore = restore  # restore() -> ultimo snapshot salvato (una sola lettura, senza Cineca) oppure None
+        self.tz = tz
+        self.clock = clock if clock is not None else (lambda: datetime.now(tz))  # ora attuale, sostituibile nei test
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()  # sveglia il thread in anticipo (es. la richiesta ha visto un nuovo giorno)
+        self.loaded = threading.Event()  # impostato dopo la pubblicazione del primo snapshot
+        self.thread = None
+        self.snapshot = None  # snapshot attualmente servito
+        self.preloaded = None  # snapshot del giorno successivo, pronto per la mezzanotte
+        self.announced = None  # ultimo snapshot per cui è già stata eseguita after_publish
+        self.refreshed_at = None  # ora dell'ultimo caricamento (o scambio) dello snapshot servito
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="calendar-refresher", daemon=True)
+                self.thread.start()
+
+    def wait_until_loaded(self, timeout=None):
+        """
+        Avvia il thread se necessario e aspetta il primo snapshot. È l'unico caso in cui una richiesta aspetta:
+        all'avvio non c'è ancora nulla da servire.
+        """
+        self.start()
+        return self.loaded.wait(timeout)
+
+    def current(self):
+        """
+        Restituisce lo snapshot da servire. Se è iniziata una nuova giornata e il thread non ha ancora
+        fatto lo scambio (es. processo sospeso a mezzanotte), pubblica lo snapshot precaricato senza
+        accedere alla rete; altrimenti continua a servire quello precedente e sveglia il thread.
+        """
+        snapshot = self.snapshot
+        today = self.clock().strftime("%Y-%m-%d")
+        if snapshot is not None and snapshot['date'] != today:
+            with self.lock:
+                if self.preloaded is not None and self.preloaded['date'] == today:
+                    self.swap(self.preloaded)
+                    self.preloaded = None
+            self.wakeup.set()
+        return self.snapshot
+
+    def swap(self, snapshot):
+        self.refreshed_at = self.clock()
+        self.snapshot = snapshot
+        self.publish(snapshot)
+        self.loaded.set()
+
+    def run_after_publish(self):
+        snapshot = self.snapshot
+        if snapshot is None or snapshot is self.announced:
+            return
+        self.announced = snapshot
+        if self.after_publish is not None:
+            try:
+                self.after_publish(snapshot)
+            except Exception as e:
+                log.exception("Errore dopo la pubblicazione dei calendari", extra={'error': str(e)})
+
+    def load_day(self, day):
+        snapshot = self.load(day)
+        if snapshot is None:
+            raise RuntimeError(f"Caricamento dei calendari del {day} non riuscito")
+        return snapshot
+
+    def restore_snapshot(self):
+        """
+        All'avvio prova a servire subito l'ultimo snapshot salvato, se è della giornata attuale.
+        Lo snapshot ripristinato non viene ripubblicato (after_publish non viene eseguita).
+        """
+        if self.restore is None:
+            return
+        try:
+            snapshot = self.restore()
+        except Exception as e:
+            log.exception("Errore nel ripristino dello snapshot", extra={'error': str(e)})
+            return
+        if snapshot is not None and snapshot['date'] == self.clock().strftime("%Y-%m-%d"):
+            log.info("Snapshot dei calendari ripristinato", extra={'day': snapshot['date']})
+            with self.lock:
+                if self.snapshot is None:
+                    self.swap(snapshot)
+                    self.announced = snapshot
+
+    def run(self):
+        self.restore_snapshot()
+        while True:
+            now = self.clock()
+            today = now.date()
+            tomorrow = today + timedelta(days=1)
+            midnight = datetime.combine(tomorrow, datetime.min.time(), tzinfo=self.tz)
+            try:
+                if self.snapshot is None or self.snapshot['date'] != today.strftime("%Y-%m-%d"):
+                    with self.lock:
+                        preloaded = self.preloaded if self.preloaded is not None and self.preloaded['date'] == today.strftime("%Y-%m-%d") else None
+                        self.preloaded = None
+                    if preloaded is None:
+                        log.info("Calendari non presenti o non aggiornati", extra={'day': today.strftime("%Y-%m-%d")})
+                        preloaded = self.load_day(today)
+                    with self.lock:
+                        self.swap(preloaded)
+                    self.run_after_publish()
+                elif now >= midnight - PRELOAD_BEFORE_MIDNIGHT and self.preloaded is None:
+                    log.info("Precaricamento dei calendari di domani", extra={'day': tomorrow.strftime("%Y-%m-%d")})
+                    snapshot = self.load_day(tomorrow)
+                    with self.lock:
+                        self.preloaded = snapshot
+                elif now >= self.refreshed_at + REFRESH_INTERVAL:
+                    # Ricontrolla i calendari di oggi: i poli non modificati non vengono rianalizzati
+                    snapshot = self.load_day(today)
+                    with self.lock:
+                        if snapshot is not self.snapshot:
+                            log.info("Calendari di oggi modificati, pubblico il nuovo snapshot", extra={'day': snapshot['date']})
+                            self.swap(snapshot)
+                        else:
+                            self.refreshed_at = self.clock()
+                    self.run_after_publish()
+            except Exception as e:
+                log.exception("Errore nell'aggiornamento dei calendari", extra={'error': str(e)})
+                self.wakeup.wait(RETRY_AFTER_ERROR.total_seconds())
+                self.wakeup.clear()
+                continue
+
+            # Lo scambio potrebbe essere stato fatto da una richiesta con current()
+            self.run_after_publish()
+
+            # Dorme fino al prossimo evento: il precaricamento, il ricontrollo dei calendari oppure la mezzanotte
+            if self.preloaded is None and now >= midnight - PRELOAD_BEFORE_MIDNIGHT:
+                continue  # è già ora di precaricare il giorno dopo (es. primo caricamento dopo le 23)
+            next_wakeup = min(midnight, self.refreshed_at + REFRESH_INTERVAL)
+            if self.preloaded is None:
+                next_wakeup = min(next_wakeup, midnight - PRELOAD_BEFORE_MIDNIGHT)
+            timeout = (next_wakeup - self.clock()).total_seconds()
+            if timeout > 0:
+                self.wakeup.wait(timeout)
+            self.wakeup.clear()
@@ -0,0 +1,73 @@
+import gzip
+
+try:
+    import brotli  # opzionale: se non è installato le risposte vengono servite solo in gzip o non compresse
+except ImportError:
+    brotli = None
+
+
+# Codifiche supportate in ordine di preferenza
+SUPPORTED_ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+# Livelli di compressione moderati: la compressione avviene sulla prima richiesta di ogni intervallo della timeline
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+class ResponseCache:
+    """
+    Cache della risposta già serializzata in JSON (e delle sue versioni compresse) per lo stato attuale degli edifici.
+    Lo stato restituito dalla timeline cambia oggetto solo quando finisce l'intervallo corrente o quando
+    vengono ricaricati i calendari, quindi basta confrontare l'identità dello stato per sapere se la cache è valida.
+    Le letture non usano lock: la cache è una coppia (stato, codifiche) che non viene mai modificata ma solo
+    sostituita. Due thread che mancano la cache insieme possono serializzare lo stesso stato due volte,
+    ma nessuno vede mai una cache a metà.
+    """
+
+    def __init__(self, serialize):
+        self.serialize = serialize  # funzione che trasforma lo stato in bytes JSON
+        self.entry = (None, {})  # (stato a cui si riferisce la cache, codifica ('identity', 'gzip', 'br') -> bytes)
+        self.hits = 0  # contatori indicativi: gli incrementi concorrenti non sono protetti da lock
+        self.misses = 0
+
+    def get(self, state, encoding='identity'):
+        """
+        Restituisce i bytes della risposta per 'state' nella codifica richiesta, serializzandoli e comprimendoli
+        solo la prima volta.
+        """
+        cached_state, bodies = self.entry
+        if cached_state is state:
+            body = bodies.get(encoding)
+            if body is not None:
+                self.hits += 1
+                return body
+        else:
+            bodies = {}
+        self.misses += 1
+        identity = bodies.get('identity')
+        if identity is None:
+            identity = self.serialize(state)
+        # Nuova coppia con la codifica aggiunta: lo stato viene tenuto in vita per non riutilizzarne l'id
+        bodies = {**bodies, 'identity': identity, encoding: compress(identity, encoding)}
+        self.entry = (state, bodies)
+        return bodies[encoding]
+
+    def invalidate(self):
+        self.entry = (None, {})
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0.0,
+        }
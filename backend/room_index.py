@@ -0,0 +1,98 @@
+from bisect import bisect_left, bisect_right
+
+
+AVAILABLE_SOON_SECONDS = 30 * 60  # un'aula è "disponibile a breve" se la lezione in corso finisce entro 30 minuti
+NEXT_LESSON_GAPS = (0, 15 * 60)  # una lezione che inizia alla fine della precedente (o 15 minuti dopo) la prosegue
+
+
+class RoomIndex:
+    """
+    Indice delle lezioni di una singola aula, costruito una volta per ogni aggiornamento dei calendari.
+    Le lezioni sono ordinate per inizio e tutti gli orari sono epoch in secondi, così lo stato dell'aula
+    in un qualsiasi istante si ottiene con una ricerca binaria, senza parsing di stringhe.
+    L'indice è condiviso tra snapshot e thread, quindi è fatto solo di tuple e non viene mai modificato.
+    """
+    __slots__ = ('lessons', 'starts', 'ends', 'max_ends', 'next_lesson', 'free_starts', 'free_ends')
+
+    def __init__(self, lessons):
+        """
+        'lessons' è una lista di lezioni (model.Lesson) con inizio e fine in epoch (secondi).
+        """
+        self.lessons = tuple(sorted(lessons, key=lambda lesson: (lesson.start, lesson.end)))
+        self.starts = tuple(lesson.start for lesson in self.lessons)
+        self.ends = tuple(lesson.end for lesson in self.lessons)
+
+        # max_ends[i] è la fine più lontana tra le lezioni 0..i: è monotona, quindi si può usare con bisect
+        max_ends = []
+        max_end = float('-inf')
+        for end in self.ends:
+            max_end = max(max_end, end)
+            max_ends.append(max_end)
+        self.max_ends = tuple(max_ends)
+
+        # next_lesson[i] è l'indice della lezione che prosegue la i-esima senza pause, -1 se non esiste
+        first_lesson_at = {}
+        for i, start in enumerate(self.starts):
+            first_lesson_at.setdefault(start, i)
+        next_lesson = []
+        for end in self.ends:
+            next_index = -1
+            for gap in NEXT_LESSON_GAPS:
+                if end + gap in first_lesson_at:
+                    next_index = first_lesson_at[end + gap]
+                    break
+            next_lesson.append(next_index)
+        self.next_lesson = tuple(next_lesson)
+
+        # Intervalli [free_starts[i], free_ends[i]) in cui l'aula è libera: il complemento delle lezioni unite
+        # (due lezioni consecutive senza pausa formano un unico intervallo occupato)
+        free_starts = [float('-inf')]
+        free_ends = []
+        for start, end in zip(self.starts, self.ends):
+            if start <= free_starts[-1]:
+                free_starts[-1] = max(free_starts[-1], end)
+            else:
+                free_ends.append(start)
+                free_starts.append(end)
+        free_ends.append(float('inf'))
+        self.free_starts = tuple(free_starts)
+        self.free_ends = tuple(free_ends)
+
+    def status(self, now):
+        """
+        Restituisce la coppia (occupata, disponibile_a_breve) dell'aula all'istante 'now' (epoch in secondi).
+        Una lezione è in corso se inizio <= now < fine: l'intervallo è semiaperto (prima era inizio <= now <= fine),
+        così nell'istante esatto in cui una lezione termina l'aula risulta già libera, coerentemente con la lista
+        delle lezioni rimanenti da cui la lezione è già stata rimossa.
+        """
+        occupied = False
+        available_soon = False
+        # Scorre all'indietro solo le lezioni già iniziate che potrebbero essere ancora in corso
+        i = bisect_right(self.starts, now) - 1
+        while i >= 0 and self.max_ends[i] > now:
+            end = self.ends[i]
+            if end > now:
+                occupied = True
+                # La lezione finisce entro 30 minuti e non ce n'è un'altra subito dopo
+                if end - now <= AVAILABLE_SOON_SECONDS and self.next_lesson[i] < 0:
+                    available_soon = True
+            i -= 1
+        return occupied, available_soon
+
+    def free_until(self, now):
+        """
+        Restituisce l'istante in cui finisce l'intervallo libero che contiene 'now' (l'inizio della prossima lezione,
+        infinito se non ce ne sono), oppure 'now' stesso se l'aula è occupata.
+        """
+        i = bisect_right(self.free_starts, now) - 1
+        return self.free_ends[i] if now < self.free_ends[i] else now
+
+    def remaining_lessons(self, now, until=None):
+        """
+        Restituisce la tupla delle lezioni non ancora terminate all'istante 'now'
+        (e, se 'until' è indicato, che iniziano prima di 'until').
+        """
+        # Tutte le lezioni prima di 'first' sono sicuramente terminate, quelle da 'last' in poi iniziano dopo 'until'
+        first = bisect_right(self.max_ends, now)
+        last = bisect_left(self.starts, until) if until is not None else len(self.starts)
+        return tuple(lesson for lesson, end in zip(self.lessons[first:last], self.ends[first:last]) if end > now)
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+
+
+# AULEPI_SITES_FILE permette di usare un altro registro (es. quello dei server locali dei benchmark)
+SITES_FILE = os.environ.get("AULEPI_SITES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sites.json"))
+
+
+class Tenant:
+    """
+    Cliente Cineca (un'università o un ente) da cui si scaricano i calendari di uno o più poli.
+    'concurrency' è il numero massimo di download in parallelo verso l'host, 'requests_per_second'
+    il numero massimo di richieste al secondo (POST e GET contano entrambe).
+    'base_url' è di default https://<host>, ma può puntare altrove (es. a un server locale nei benchmark).
+    """
+    __slots__ = ('name', 'host', 'cliente_id', 'concurrency', 'requests_per_second', 'base_url')
+
+    def __init__(self, name, host, cliente_id, concurrency, requests_per_second, base_url=None):
+        self.name = name
+        self.host = host
+        self.cliente_id = cliente_id
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.base_url = base_url if base_url is not None else f"https://{host}"
+
+
+class Site:
+    """
+    Polo con il suo calendario: cliente Cineca, 'linkCalendarioId', coordinate ([longitudine, latitudine]),
+    orari di apertura settimanali (come in 'opening_hours.json', None per usare quelli di default)
+    e priorità nell'ordine dei download (più alta prima).
+    """
+    __slots__ = ('name', 'tenant', 'calendar_id', 'coordinates', 'hours', 'priority')
+
+    def __init__(self, name, tenant, calendar_id, coordinates, hours=None, priority=0):
+        self.name = name
+        self.tenant = tenant
+        self.calendar_id = calendar_id
+        self.coordinates = coordinates
+        self.hours = hours
+        self.priority = priority
+
+
+class SiteRegistry:
+    """
+    Registro dei poli letto da 'sites.json': "tenants" (nome -> host, clienteId, concurrency, requestsPerSecond, baseUrl)
+    e "sites" (polo -> tenant, linkCalendarioId, coordinates e, facoltativi, hours e priority).
+    Aggiungere un polo o un'altra università è una modifica al file, non al codice.
+    """
+
+    def __init__(self, data):
+        self.tenants = {}
+        for name, tenant in data['tenants'].items():
+            self.tenants[name] = Tenant(name, tenant['host'], tenant['clienteId'],
+                                        int(tenant.get('concurrency', 4)), float(tenant.get('requestsPerSecond', 10)),
+                                        tenant.get('baseUrl'))
+            if self.tenants[name].concurrency < 1 or self.tenants[name].requests_per_second <= 0:
+                raise ValueError(f"Limiti non validi per il cliente {name!r}")
+        self.sites = {}
+        for name, site in data['sites'].items():
+            tenant = self.tenants.get(site['tenant'])
+            if tenant is None:
+                raise ValueError(f"Cliente {site['tenant']!r} del polo {name!r} non definito")
+            self.sites[name] = Site(name, tenant, site['linkCalendarioId'], site['coordinates'],
+                                    site.get('hours'), int(site.get('priority', 0)))
+
+    def calendar_ids(self):
+        return {name: site.calendar_id for name, site in self.sites.items()}
+
+    def coordinates(self):
+        return {name: site.coordinates for name, site in self.sites.items()}
+
+    def hours(self):
+        return {name: site.hours for name, site in self.sites.items() if site.hours is not None}
+
+
+def load_sites(path=SITES_FILE):
+    with open(path, encoding='utf-8') as f:
+        return SiteRegistry(json.load(f))
+
+
+class RateLimiter:
+    """
+    Limita le richieste verso un host a 'rate' al secondo (token bucket con capacità 'burst').
+    È condiviso dai thread che scaricano dallo stesso host.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.tokens = burst
+        self.updated = clock()
+
+    def acquire(self):
+        """
+        Aspetta finché non è disponibile un token e lo consuma.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        # il token è già prenotato: l'attesa avviene fuori dal lock, le richieste successive aspettano di più
+        if wait > 0:
+            self.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Interruttore per host: dopo 'failures' errori consecutivi le chiamate vengono saltate per 'cooldown' secondi,
+    così un host fuori servizio non fa aspettare ogni polo fino ai timeout. Passato il cooldown si riprova:
+    un successo richiude l'interruttore, un altro errore lo riapre.
+    """
+
+    def __init__(self, failures=5, cooldown=60, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = None  # istante (clock) fino al quale l'interruttore è aperto
+
+    def allow(self):
+        with self.lock:
+            return self.open_until is None or self.clock() >= self.open_until
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.open_until = None
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failures:
+                self.open_until = self.clock() + self.cooldown
@@ -0,0 +1,72 @@
+import logging
+import os
+import threading
+
+
+FOLLOW_INTERVAL = 5  # secondi tra due controlli del file dello snapshot
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotFollower:
+    """
+    Segue il file dello snapshot scritto dal processo loader (vedi loader.py) e lo pubblica nel processo corrente.
+    È usato dai worker del server di produzione al posto di CalendarRefresher: i worker non contattano mai
+    Cineca, così le richieste verso l'esterno restano le stesse qualunque sia il numero di worker.
+    Il controllo è un semplice os.stat: il file viene riletto solo quando il loader lo sostituisce.
+    Ogni worker ricostruisce però lo snapshot per conto proprio (CPU e memoria per worker, vedi gunicorn.conf.py).
+    """
+
+    def __init__(self, path, read, publish, interval=FOLLOW_INTERVAL):
+        self.path = path
+        self.read = read  # read(path) -> snapshot contenuto nel file, oppure None
+        self.publish = publish  # publish(snapshot) rende lo snapshot visibile alle richieste
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.loaded = threading.Event()
+        self.thread = None
+        self.snapshot = None
+        self.version = None  # (mtime, dimensione) del file già pubblicato
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="snapshot-follower", daemon=True)
+                self.thread.start()
+
+    def wait_until_loaded(self, timeout=None):
+        self.start()
+        return self.loaded.wait(timeout)
+
+    def current(self):
+        return self.snapshot
+
+    def check(self):
+        """
+        Pubblica lo snapshot se il file è cambiato dall'ultimo controllo. Restituisce True se è stato pubblicato.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self.version:
+            return False
+        snapshot = self.read(self.path)
+        if snapshot is None:
+            return False
+        self.version = version
+        self.snapshot = snapshot
+        self.publish(snapshot)
+        self.loaded.set()
+        log.info("Snapshot caricato", extra={'day': snapshot['date'], 'path': self.path})
+        return True
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                log.exception("Errore nella lettura dello snapshot", extra={'error': str(e)})
+            self.stop.wait(self.interval)
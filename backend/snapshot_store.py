@@ -0,0 +1,132 @@
+import gzip
+import json
+import logging
+import os
+import sys
+from datetime import date, datetime
+
+import requests
+from dotenv import load_dotenv
+
+import unipi_calendar
+from model import Building, Lesson
+from room_index import RoomIndex
+
+
+SNAPSHOT_FORMAT = 4  # da incrementare ad ogni modifica incompatibile del formato
+SNAPSHOT_BLOB_NAME = "snapshot.json.gz"
+# File locale usato quando non è configurato VercelFS (BLOB_READ_WRITE_TOKEN), es. in sviluppo o con Docker
+SNAPSHOT_PATH = os.environ.get("AULEPI_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), SNAPSHOT_BLOB_NAME))
+
+log = logging.getLogger(__name__)
+
+
+def serialize_snapshot(snapshot):
+    """
+    Converte lo snapshot dei calendari in un JSON compresso con gzip. Contiene solo ciò che serve a ricostruirlo
+    senza accedere alla rete: poli con le loro aule, lezioni già analizzate e aule usually_open.
+    Le timeline e le matrici di occupazione non vengono salvate perché si ricostruiscono dall'indice.
+    """
+    rooms = []
+    for (polo, location), index in snapshot['rooms_index'].items():
+        rooms.append([polo, location, [[lesson.start, lesson.end, lesson.professor] for lesson in index.lessons]])
+    data = {
+        'format': SNAPSHOT_FORMAT,
+        'id': snapshot['id'],
+        'date': snapshot['date'],
+        'days': len(snapshot['timelines']),
+        'generated_at': datetime.now(unipi_calendar.pisa_timezone).isoformat(),
+        'buildings': {polo: {'coordinates': building.coordinates, 'rooms': dict(building.rooms)}
+                      for polo, building in snapshot['buildings'].items()},
+        'usually_open': snapshot['usually_open'],
+        'stale': snapshot['stale'],
+        'rooms': rooms,
+    }
+    # default=dict converte le viste in sola lettura dello snapshot (MappingProxyType) in dizionari
+    return gzip.compress(json.dumps(data, separators=(",", ":"), default=dict).encode('utf-8'))
+
+
+def deserialize_snapshot(content):
+    """
+    Ricostruisce lo snapshot dei calendari (indice delle aule e timeline di ogni giornata) dal contenuto di `serialize_snapshot`.
+    Restituisce None se il formato non è quello attuale.
+    """
+    data = json.loads(gzip.decompress(content))
+    if data.get('format') != SNAPSHOT_FORMAT:
+        log.warning("Snapshot in un formato non supportato", extra={'format': data.get('format')})
+        return None
+
+    buildings = {}
+    for polo, building in data['buildings'].items():
+        polo = sys.intern(polo)
+        buildings[polo] = Building(polo, building['coordinates'],
+                                   {sys.intern(location): usually_open for location, usually_open in building['rooms'].items()})
+
+    rooms_index = {}
+    all_lessons = []
+    for polo, location, lessons in data['rooms']:
+        polo, location = sys.intern(polo), sys.intern(location)
+        room_lessons = [Lesson(polo, location, start, end, professor) for start, end, professor in lessons]
+        all_lessons.extend(room_lessons)
+        rooms_index[(polo, location)] = RoomIndex(room_lessons)
+
+    day = date.fromisoformat(data['date'])
+    return unipi_calendar.make_snapshot(data['id'], data['date'], all_lessons, buildings, rooms_index, data['usually_open'],
+                                        unipi_calendar.build_timelines(day, data['days'], buildings, rooms_index),
+                                        data.get('stale'),
+                                        unipi_calendar.build_occupancies(day, data['days'], buildings, rooms_index))
+
+
+def use_vercel_blob():
+    # AULEPI_SNAPSHOT_STORE=file forza il file locale, che è quello letto dai worker del server di produzione
+    if os.environ.get("AULEPI_SNAPSHOT_STORE") == "file":
+        return False
+    load_dotenv()
+    return bool(os.environ.get("BLOB_READ_WRITE_TOKEN"))
+
+
+def save_snapshot(snapshot):
+    """
+    Pubblica lo snapshot su VercelFS, oppure nel file locale SNAPSHOT_PATH se VercelFS non è configurato.
+    """
+    content = serialize_snapshot(snapshot)
+    if use_vercel_blob():
+        unipi_calendar.upload_a_blob(SNAPSHOT_BLOB_NAME, content)
+    else:
+        # scrittura atomica: un processo che legge nello stesso momento vede il file vecchio o quello nuovo
+        temporary_path = SNAPSHOT_PATH + ".tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, SNAPSHOT_PATH)
+    log.info("Snapshot salvato", extra={'day': snapshot['date'], 'bytes': len(content)})
+
+
+def load_snapshot():
+    """
+    Legge l'ultimo snapshot pubblicato con una sola lettura. Restituisce None se non esiste o non è leggibile.
+    """
+    if not use_vercel_blob():
+        return load_snapshot_file(SNAPSHOT_PATH)
+    try:
+        content = unipi_calendar.download_blob_from_vercelFS(SNAPSHOT_BLOB_NAME)
+        if not content:
+            return None
+        return deserialize_snapshot(content)
+    except (ValueError, KeyError, TypeError, requests.RequestException) as e:
+        log.warning("Snapshot non disponibile", extra={'error': str(e)})
+        return None
+
+
+def load_snapshot_file(path):
+    """
+    Legge lo snapshot dal file locale 'path'. Restituisce None se non esiste o non è leggibile.
+    """
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        if not content:
+            return None
+        return deserialize_snapshot(content)
+    except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+        log.warning("Snapshot non disponibile", extra={'error': str(e)})
+        return None
@@ -0,0 +1,62 @@
+import threading
+
+
+KEEP_SNAPSHOTS = 3  # snapshot pubblicati di cui si possono ancora calcolare le differenze
+
+
+class StatusVersions:
+    """
+    Versioni dello stato degli edifici. La versione di uno stato è '<id dello snapshot>.<giornata>.<intervallo>':
+    identifica l'intervallo della timeline da cui lo stato è letto, è la stessa in tutti i processi che servono
+    lo stesso snapshot e cambia solo quando cambia lo stato (inizio o fine di una lezione, apertura o chiusura
+    di un polo, nuovo snapshot). Vengono tenuti gli ultimi KEEP_SNAPSHOTS snapshot, così un client può
+    ricevere solo le differenze anche se nel frattempo i calendari sono stati aggiornati.
+    """
+
+    def __init__(self, keep=KEEP_SNAPSHOTS):
+        self.keep = keep
+        self.snapshots = {}  # id -> snapshot, dal più vecchio (sostituito in blocco ad ogni pubblicazione)
+        self.published = threading.Condition()  # notificata ad ogni pubblicazione (es. per gli stream SSE)
+
+    def publish(self, snapshot):
+        snapshots = {key: value for key, value in self.snapshots.items() if key != snapshot['id']}
+        snapshots[snapshot['id']] = snapshot
+        self.snapshots = dict(list(snapshots.items())[-self.keep:])
+        with self.published:
+            self.published.notify_all()
+
+    def wait(self, timeout):
+        """
+        Aspetta la prossima pubblicazione per al massimo 'timeout' secondi.
+        """
+        with self.published:
+            return self.published.wait(timeout)
+
+    @staticmethod
+    def status_at(snapshot, timeline, day, at):
+        """
+        Restituisce la tripla (versione, stato, istante del prossimo cambio) dello stato all'istante 'at'
+        nella timeline della giornata 'day' ('YYYY-MM-DD') dello snapshot.
+        """
+        interval = timeline.interval_at(at)
+        return f"{snapshot['id']}.{day}.{interval}", timeline.states[interval], timeline.next_change(at)
+
+    def state_of(self, version):
+        """
+        Restituisce lo stato corrispondente a 'version', oppure None se la versione non è valida
+        o si riferisce a uno snapshot non più disponibile.
+        """
+        try:
+            snapshot_id, day, interval = version.split(".")
+            snapshot = self.snapshots.get(snapshot_id)
+            if snapshot is None:
+                return None
+            timeline = snapshot['timelines'].get(day)
+            if timeline is None and day == snapshot['date']:
+                timeline = snapshot['timeline']
+            interval = int(interval)
+            if timeline is None or not 0 <= interval < len(timeline.states):
+                return None
+            return timeline.states[interval]
+        except ValueError:
+            return None
@@ -0,0 +1,36 @@
+import os
+import sys
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+# I moduli del backend si importano direttamente (es. `import unipi_calendar`), come in app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unipi_calendar import build_occupancies, build_timelines, make_snapshot  # noqa: E402
+
+
+pisa_timezone = ZoneInfo("Europe/Rome")
+DAY = date(2024, 10, 15)  # martedì: il polo A è aperto dalle 7:30 alle 20, il polo C dalle 7:30 alle 19:30
+
+
+def at(hour, minute=0, day=DAY):
+    """
+    Restituisce l'epoch (secondi) dell'ora indicata di 'day' (di default DAY), ora di Pisa.
+    """
+    return int(datetime(day.year, day.month, day.day, hour, minute, tzinfo=pisa_timezone).timestamp())
+
+
+@pytest.fixture
+def build_snapshot():
+    """
+    Costruisce uno snapshot delle 'days' giornate a partire da DAY con make_snapshot, come load_calendars_and_parse:
+    timeline e matrici di occupazione vengono calcolate da 'buildings' e 'rooms_index'.
+    """
+    def build(buildings, rooms_index, snapshot_id="test", days=1, usually_open=None, stale=None):
+        return make_snapshot(snapshot_id, DAY.strftime("%Y-%m-%d"), [], buildings, rooms_index, usually_open or {},
+                             build_timelines(DAY, days, buildings, rooms_index), stale,
+                             build_occupancies(DAY, days, buildings, rooms_index))
+
+    return build
@@ -0,0 +1,238 @@
+import threading
+import time
+
+import pytest
+
+import app as backend
+from model import Building, BuildingStatus
+from refresher import CalendarRefresher
+from timeline import DayTimeline
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(backend, 'INITIAL_LOAD_TIMEOUT', 0.2)
+    return backend.app.test_client()
+
+
+def use_loader(monkeypatch, load):
+    refresher = CalendarRefresher(load, backend.publish_calendars, backend.pisa_timezone)
+    monkeypatch.setattr(backend, 'refresher', refresher)
+    return refresher
+
+
+def test_open_classrooms_is_503_while_no_snapshot_is_loaded(client, monkeypatch):
+    use_loader(monkeypatch, lambda day: None)
+    response = client.get('/api/open-classrooms')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '30'
+
+
+def test_open_classrooms_serves_the_published_snapshot(client, monkeypatch):
+    state = (BuildingStatus(Building('poloA', [10.38, 43.72]), True, False, False, ()),)
+
+    def load(day):
+        return {
+            'id': "served", 'date': day.strftime("%Y-%m-%d"),
+            'buildings': {}, 'rooms_index': {}, 'usually_open': {},
+            'timeline': DayTimeline([0], [state], 2 ** 40), 'timelines': {},
+        }
+
+    use_loader(monkeypatch, load)
+    response = client.get('/api/open-classrooms', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'poloA': {'coordinates': [10.38, 43.72], 'free': True, 'buildingAvailableSoon': False, 'isClosed': False}}
+
+
+def test_concurrent_requests_see_whole_snapshots(client, monkeypatch):
+    def snapshot(free):
+        state = (BuildingStatus(Building('poloA', [10.38, 43.72]), free, False, False, ()),)
+        return {'id': f"free-{free}", 'date': "2024-10-15", 'timeline': DayTimeline([0], [state], 2 ** 40), 'timelines': {}}
+
+    snapshots = [snapshot(True), snapshot(False)]
+    backend.publish_calendars(snapshots[0])
+    monkeypatch.setattr(backend, 'update_calendars', lambda: backend.calendari)
+
+    bodies = []
+    errors = []
+
+    def serve():
+        try:
+            for _ in range(50):
+                response = client.get('/api/open-classrooms', headers={'Accept-Encoding': 'identity'})
+                bodies.append(response.get_json()['poloA']['free'])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=serve) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # Il thread principale pubblica snapshot alternati mentre le richieste vengono servite
+    for i in range(200):
+        backend.publish_calendars(snapshots[i % 2])
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(bodies) == 200
+    assert set(bodies) <= {True, False}
+
+
+def test_open_classrooms_at_another_instant(client, monkeypatch):
+    def state(free):
+        return (BuildingStatus(Building('poloA', [10.38, 43.72]), free, False, False, ()),)
+
+    # due giornate: 2024-10-15 (libero fino alle 9, poi occupato) e 2024-10-16 (libero)
+    day_15, day_16 = 1728943200, 1729029600
+    timelines = {
+        "2024-10-15": DayTimeline([day_15, day_15 + 9 * 3600], [state(True), state(False)], day_16),
+        "2024-10-16": DayTimeline([day_16], [state(True)], day_16 + 24 * 3600),
+    }
+    backend.publish_calendars({'id': "at", 'date': "2024-10-15", 'timeline': timelines["2024-10-15"], 'timelines': timelines})
+    monkeypatch.setattr(backend, 'update_calendars', lambda: backend.calendari)
+
+    def free_at(at):
+        response = client.get('/api/open-classrooms', query_string={'at': at})
+        assert response.status_code == 200
+        return response.get_json()['poloA']['free']
+
+    assert free_at(day_15 + 8 * 3600) is True
+    assert free_at(day_15 + 10 * 3600) is False
+    assert free_at("2024-10-15T10:00:00") is False
+    assert free_at("2024-10-15T07:00:00+00:00") is False  # 9:00 a Pisa
+    assert free_at("2024-10-16T10:00:00") is True
+
+    assert client.get('/api/open-classrooms', query_string={'at': "domani"}).status_code == 400
+    assert client.get('/api/open-classrooms', query_string={'at': "nan"}).status_code == 400
+    assert client.get('/api/open-classrooms', query_string={'at': "1e20"}).status_code == 400
+    assert client.get('/api/open-classrooms', query_string={'at': "-1e20"}).status_code == 400
+    assert client.get('/api/open-classrooms', query_string={'at': "0001-01-01T00:00"}).status_code == 400
+    assert client.get('/api/open-classrooms', query_string={'at': day_16 + 48 * 3600}).status_code == 400
+
+
+def test_free_rooms_validates_the_parameters(client, monkeypatch):
+    backend.publish_calendars({'id': "empty", 'date': "2024-10-15", 'timeline': DayTimeline([0], [()], 2 ** 40), 'timelines': {}})
+    monkeypatch.setattr(backend, 'update_calendars', lambda: backend.calendari)
+    assert client.get('/api/free-rooms', query_string={'lat': 43.7}).status_code == 400
+    assert client.get('/api/free-rooms', query_string={'minutes': "tanti"}).status_code == 400
+    assert client.get('/api/free-rooms', query_string={'minutes': -5}).status_code == 400
+    assert client.get('/api/free-rooms', query_string={'limit': 1000}).status_code == 400
+    assert client.get('/api/free-rooms', query_string={'at': "1e20"}).status_code == 400
+    assert client.get('/api/free-rooms', query_string={'at': "-1e20"}).status_code == 400
+    # la giornata attuale non è nello snapshot
+    assert client.get('/api/free-rooms').status_code == 400
+
+
+def test_since_returns_only_the_changes(client, monkeypatch):
+    def state(free):
+        return (BuildingStatus(Building('poloA', [10.38, 43.72]), free, False, False, ()),)
+
+    # lo stato cambia dopo 10 secondi dall'epoch 0: l'intervallo attuale è il secondo
+    backend.publish_calendars({'id': "since", 'date': "2024-10-15", 'timelines': {},
+                               'timeline': DayTimeline([0, 10], [state(True), state(False)], 2 ** 40)})
+    monkeypatch.setattr(backend, 'update_calendars', lambda: backend.calendari)
+
+    response = client.get('/api/open-classrooms')
+    version = response.headers['X-Status-Version']
+    assert version == "since.2024-10-15.1"
+
+    assert client.get('/api/open-classrooms', query_string={'since': version}).get_json() == {
+        'version': version, 'full': False, 'buildings': {}}
+    delta = client.get('/api/open-classrooms', query_string={'since': "since.2024-10-15.0"}).get_json()
+    assert delta['full'] is False
+    assert delta['buildings']['poloA']['free'] is False
+    full = client.get('/api/open-classrooms', query_string={'since': "sconosciuta"}).get_json()
+    assert full['full'] is True
+    assert full['buildings'] == response.get_json()
+
+
+def test_open_classrooms_is_cacheable_until_the_next_change(client, monkeypatch):
+    state = (BuildingStatus(Building('poloA', [10.38, 43.72]), True, False, False, ()),)
+    next_change = time.time() + 120
+    backend.publish_calendars({'id': "etag", 'date': "2024-10-15", 'timelines': {},
+                               'timeline': DayTimeline([0, next_change], [state, state], 2 ** 40)})
+    monkeypatch.setattr(backend, 'update_calendars', lambda: backend.calendari)
+
+    response = client.get('/api/open-classrooms', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    etag, weak = response.get_etag()
+    assert not weak and etag.startswith("etag.2024-10-15.0-")
+    assert response.cache_control.public
+    assert 110 <= response.cache_control.max_age <= 121
+    assert response.cache_control.s_maxage == response.cache_control.max_age
+
+    # la stessa variante risponde 304 senza corpo, una variante diversa ha un altro ETag
+    cached = client.get('/api/open-classrooms', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{etag}"'})
+    assert cached.status_code == 304
+    assert cached.data == b""
+    assert cached.get_etag() == (etag, False)
+    assert 'Content-Encoding' not in cached.headers
+    identity = client.get('/api/open-classrooms', headers={'Accept-Encoding': 'identity', 'If-None-Match': f'"{etag}"'})
+    assert identity.status_code == 200
+    assert identity.get_etag()[0] != etag
+    filtered = client.get('/api/open-classrooms', query_string={'fields': "status"},
+                          headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{etag}"'})
+    assert filtered.status_code == 200
+
+
+def test_stream_sends_the_state_as_server_sent_events(client, monkeypatch):
+    state = (BuildingStatus(Building('poloA', [10.38, 43.72]), True, False, False, ()),)
+    snapshot = {'id': "stream", 'date': "2024-10-15", 'timelines': {}, 'timeline': DayTimeline([0], [state], 2 ** 40)}
+    backend.publish_calendars(snapshot)
+    monkeypatch.setattr(backend, 'update_calendars', lambda: snapshot)
+    monkeypatch.setattr(backend.refresher, 'current', lambda: snapshot)
+
+    response = client.get('/api/open-classrooms/stream', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    first = next(response.iter_encoded()).decode('utf-8')
+    response.close()
+    assert first.startswith("id: stream.2024-10-15.0\ndata: ")
+    assert '"full":true' in first
+
+
+def test_streams_are_capped_and_expire(client, monkeypatch):
+    state = (BuildingStatus(Building('poloA', [10.38, 43.72]), True, False, False, ()),)
+    snapshot = {'id': "capped", 'date': "2024-10-15", 'timelines': {}, 'timeline': DayTimeline([0], [state], 2 ** 40)}
+    backend.publish_calendars(snapshot)
+    monkeypatch.setattr(backend, 'update_calendars', lambda: snapshot)
+    monkeypatch.setattr(backend.refresher, 'current', lambda: snapshot)
+    monkeypatch.setattr(backend, 'sse_streams', threading.BoundedSemaphore(1))
+
+    first = client.get('/api/open-classrooms/stream', buffered=False)
+    rejected = client.get('/api/open-classrooms/stream', buffered=False)
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == str(backend.SSE_HEARTBEAT)
+    first.close()  # il client si disconnette senza leggere: il posto si libera comunque
+
+    # dopo SSE_MAX_LIFETIME lo stream termina e il client si riconnette con l'ultima versione ricevuta
+    monkeypatch.setattr(backend, 'SSE_MAX_LIFETIME', 0)
+    expiring = client.get('/api/open-classrooms/stream', buffered=False)
+    assert expiring.status_code == 200
+    events = b"".join(expiring.iter_encoded()).decode('utf-8')
+    expiring.close()
+    assert events.count("id: ") == 1
+    resumed = client.get('/api/open-classrooms/stream', buffered=False, headers={'Last-Event-ID': "capped.2024-10-15.0"})
+    assert next(resumed.iter_encoded()) == b": ping\n\n"
+    resumed.close()
+
+
+def test_metrics_expose_requests_refreshes_and_the_response_cache(client, monkeypatch):
+    state = (BuildingStatus(Building('poloA', [10.38, 43.72]), True, False, False, ()),)
+    snapshot = {'id': "metrics", 'date': "2024-10-15", 'lessons': (), 'timeline': DayTimeline([0], [state], 2 ** 40),
+                'timelines': {}}
+    backend.publish_calendars(snapshot)
+    monkeypatch.setattr(backend, 'update_calendars', lambda: snapshot)
+    for _ in range(3):
+        client.get('/api/open-classrooms', headers={'Accept-Encoding': 'identity'})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'aulepi_request_duration_seconds_count{route="/api/open-classrooms",status="200"}' in body
+    assert 'aulepi_response_size_bytes_bucket{route="/api/open-classrooms",le="+Inf"}' in body
+    assert 'aulepi_snapshot_age_seconds ' in body
+    assert 'aulepi_response_cache_hits ' in body
+    # le metriche dell'aggiornamento sono dichiarate anche prima del primo aggiornamento
+    assert '# TYPE aulepi_refresh_phase_seconds histogram' in body
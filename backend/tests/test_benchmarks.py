@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import unipi_calendar
+from benchmarks.loadtest import (BACKEND_DIR, load_trace, replay, summarize, synthetic_trace, wait_until_up,
+                                 werkzeug_server)
+from benchmarks.stubs import BlobStub, CinecaStub, offline, registry_data, registry_for
+from benchmarks.synthetic import generate_aule_csv, generate_ics
+from conftest import DAY
+
+
+def test_synthetic_feed_is_parsed_completely():
+    feed = generate_ics("poloBench", DAY, days=2, events_per_day=50, rooms=5)
+    assert "\r\n " in feed  # contiene righe piegate
+    lessons = unipi_calendar.parse_ics(feed, DAY, 2)
+    assert len(lessons) == 100
+    assert {lesson.room for lesson in lessons} <= {f"AulaBench_{i}" for i in range(1, 6)}
+    assert any("," in lesson.professor for lesson in lessons)
+    # lo stesso seme produce lo stesso calendario
+    assert generate_ics("poloBench", DAY, days=2, events_per_day=50, rooms=5) == feed
+
+
+def test_refresh_runs_offline_against_the_stubs():
+    poli = ["polo000", "polo001"]
+    cineca = CinecaStub({polo: generate_ics(polo, DAY, days=1, events_per_day=20, rooms=4) for polo in poli})
+    blob = BlobStub({'aule.csv': generate_aule_csv(poli, rooms=4).encode('utf-8')})
+    try:
+        with offline(cineca, blob, registry_for(cineca, poli)):
+            snapshot = unipi_calendar.load_calendars_and_parse(DAY, 1)
+            assert len(snapshot['lessons']) == 40
+            assert set(snapshot['buildings']) == set(poli)
+            assert unipi_calendar.load_calendars_and_parse(DAY, 1) is snapshot
+
+            blob.blobs.clear()
+            unipi_calendar.buildings_to_csv(snapshot['usually_open'])
+            assert blob.blobs['aule.csv'].startswith(b"polo,aula,usually_open")
+        assert cineca.requests == {'POST': 4, 'GET': 4}
+    finally:
+        cineca.close()
+        blob.close()
+    # all'uscita il registro vero è di nuovo in uso
+    assert 'polo000' not in unipi_calendar.site_registry.sites
+
+
+def test_synthetic_trace_has_spikes_at_the_class_change():
+    trace = synthetic_trace(["polo000"], duration=60, rate=5, spike_rate=100, spike_every=30, spike_length=5)
+    in_spikes = sum(1 for entry in trace if entry['t'] % 30 < 5)
+    assert in_spikes > 3 * (len(trace) - in_spikes)
+    assert all(entry['path'].startswith("/api/") for entry in trace)
+
+
+def test_app_json_logs_can_be_replayed(tmp_path):
+    log = tmp_path / "app.log"
+    log.write_text("\n".join(json.dumps(entry) for entry in (
+        {'epoch': 1000.5, 'message': "Richiesta servita", 'path': "/api/free-rooms?minutes=30"},
+        {'epoch': 1000.0, 'message': "Calendari caricati"},
+        {'epoch': 1000.25, 'message': "Richiesta servita", 'path': "/api/open-classrooms"},
+    )), encoding='utf-8')
+    assert [(entry['t'], entry['path']) for entry in load_trace(log)] == [
+        (0.0, "/api/open-classrooms"), (0.25, "/api/free-rooms?minutes=30")]
+
+
+def test_trace_is_replayed_against_the_app_from_a_cold_start():
+    poli = ["polo000", "polo001"]
+    today = datetime.now(unipi_calendar.pisa_timezone).date()
+    cineca = CinecaStub({polo: generate_ics(polo, today, days=1, events_per_day=10, rooms=4) for polo in poli})
+    blob = BlobStub({'aule.csv': generate_aule_csv(poli, rooms=4).encode('utf-8')})
+    trace = [{'t': i / 100, 'path': "/api/open-classrooms", 'headers': {'Accept-Encoding': "gzip"}} for i in range(20)]
+    try:
+        with offline(cineca, blob, registry_for(cineca, poli)):
+            with werkzeug_server(cold=True) as url:
+                results, elapsed = replay(url, trace, concurrency=4, conditional=True)
+    finally:
+        cineca.close()
+        blob.close()
+    summary = summarize(results, elapsed)
+    assert summary['requests'] == 20
+    assert summary['error_rate'] == 0
+    # con gli ETag le richieste successive alla prima di ogni connessione sono 304
+    assert set(summary['statuses']) == {'200', '304'}
+    assert summary['/api/open-classrooms']['p99_ms'] >= summary['/api/open-classrooms']['p50_ms']
+
+
+def test_worker_processes_use_the_benchmark_registry(tmp_path):
+    # i worker di gunicorn leggono il registro dei server locali da AULEPI_SITES_FILE: stessi orari e distanze dei poli
+    sites_path = tmp_path / "sites.json"
+    sites_path.write_text(json.dumps(registry_data(SimpleNamespace(url="http://127.0.0.1:1"), ["polo000", "polo001"])))
+    script = ("import unipi_calendar;"
+              " print(sorted(name for _, name in unipi_calendar.polo_locator.by_distance(43.72, 10.40)),"
+              " unipi_calendar.opening_hours.is_open('polo000', 1729414800))")  # domenica 20/10/2024 alle 11
+    output = subprocess.run([sys.executable, "-c", script], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+                            env={**os.environ, 'AULEPI_SITES_FILE': str(sites_path)}).stdout
+    assert output.strip() == "['polo000', 'polo001'] True"
+
+
+def test_waiting_for_a_server_that_exits_fails_immediately():
+    process = subprocess.Popen([sys.executable, "-c", "raise SystemExit(3)"])
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="codice 3"):
+        wait_until_up("http://127.0.0.1:1", process, timeout=30)
+    assert time.monotonic() - started < 10
@@ -0,0 +1,61 @@
+import pytest
+
+from conftest import at
+from geo import PoloLocator
+from model import Building, Lesson
+from room_index import RoomIndex
+from unipi_calendar import find_free_rooms, poli_coordinates
+
+
+@pytest.fixture
+def snapshot(build_snapshot):
+    buildings = {
+        'poloA': Building('poloA', poli_coordinates['poloA'], {'A1': True, 'A2': True, 'A3': False}),
+        'poloC': Building('poloC', poli_coordinates['poloC'], {'C1': True}),
+    }
+    rooms_index = {
+        ('poloA', 'A1'): RoomIndex([Lesson('poloA', 'A1', at(9), at(11), 'ROSSI')]),
+        ('poloA', 'A2'): RoomIndex([Lesson('poloA', 'A2', at(14), at(16), 'VERDI')]),
+    }
+    return build_snapshot(buildings, rooms_index)
+
+
+def rooms(free_rooms):
+    return [(room['polo'], room['room']) for room in free_rooms]
+
+
+def test_free_rooms_are_ranked_by_free_time_without_position(snapshot):
+    free_rooms = find_free_rooms(snapshot, at(10))
+    assert rooms(free_rooms) == [('poloC', 'C1'), ('poloA', 'A2')]
+    assert free_rooms[0]['freeUntil'] == "2024-10-15 19:30:00"  # chiusura del polo
+    assert free_rooms[1]['freeUntil'] == "2024-10-15 14:00:00"  # prossima lezione
+    assert free_rooms[1]['freeMinutes'] == 240
+
+
+def test_free_rooms_are_ranked_by_distance(snapshot):
+    lon, lat = poli_coordinates['poloA']
+    free_rooms = find_free_rooms(snapshot, at(10), position=(lat, lon))
+    assert rooms(free_rooms) == [('poloA', 'A2'), ('poloC', 'C1')]
+    assert free_rooms[0]['distance'] == 0
+    assert 50 < free_rooms[1]['distance'] < 200
+
+
+def test_minutes_and_limit_filter_the_rooms(snapshot):
+    assert rooms(find_free_rooms(snapshot, at(10), minutes=300)) == [('poloC', 'C1')]
+    assert rooms(find_free_rooms(snapshot, at(10), limit=1)) == [('poloC', 'C1')]
+
+
+def test_closed_buildings_are_skipped(snapshot):
+    assert find_free_rooms(snapshot, at(7)) == []
+    assert rooms(find_free_rooms(snapshot, at(19, 45))) == [('poloA', 'A1'), ('poloA', 'A2')]
+
+
+def test_instants_outside_the_window_return_none(snapshot):
+    assert find_free_rooms(snapshot, at(10) + 24 * 3600) is None
+
+
+def test_locator_orders_poli_by_distance():
+    lon, lat = poli_coordinates['poloFibonacci']
+    ranked = PoloLocator(poli_coordinates).by_distance(lat, lon)
+    assert ranked[0] == (0, 'poloFibonacci')
+    assert [distance for distance, _ in ranked] == sorted(distance for distance, _ in ranked)
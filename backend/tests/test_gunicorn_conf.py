@@ -0,0 +1,42 @@
+import importlib.util
+import logging
+import os
+import threading
+import time
+
+
+def load_config(monkeypatch):
+    # gunicorn.conf.py imposta le variabili d'ambiente dei worker: vengono ripristinate alla fine del test
+    monkeypatch.setenv("AULEPI_ROLE", os.environ.get("AULEPI_ROLE", ""))
+    monkeypatch.setenv("AULEPI_SNAPSHOT_STORE", os.environ.get("AULEPI_SNAPSHOT_STORE", ""))
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py")
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", path)
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    return config
+
+
+def test_loader_is_restarted_when_it_exits(monkeypatch, tmp_path):
+    config = load_config(monkeypatch)
+    starts = tmp_path / "starts"
+    script = tmp_path / "loader.py"
+    script.write_text(f"open({str(starts)!r}, 'a').write('x')\n")  # un loader che termina subito
+    config.LOADER_PATH = str(script)
+    config.LOADER_CHECK_INTERVAL = config.LOADER_RESTART_DELAY = 0.01
+
+    class Server:
+        log = logging.getLogger("gunicorn.test")
+
+    config.on_starting(Server)
+    try:
+        deadline = time.monotonic() + 10
+        while (not starts.exists() or len(starts.read_text()) < 3) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        config.on_exit(Server)
+    assert len(starts.read_text()) >= 3
+    # dopo la chiusura del server il loader non viene più riavviato
+    for thread in threading.enumerate():
+        if thread.name == "loader-watchdog":
+            thread.join(1)
+            assert not thread.is_alive()
@@ -0,0 +1,175 @@
+import time
+from datetime import date
+
+import pytest
+
+import unipi_calendar
+from conftest import DAY
+from sites import CircuitBreaker, RateLimiter
+
+
+def feed(location):
+    return ("BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nDTSTART:20241015T070000Z\r\nDTEND:20241015T090000Z\r\n"
+            f"LOCATION:{location} - Polo\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n")
+
+
+class FakeResponse:
+    def __init__(self, status_code, json_data=None, text="", headers=None):
+        self.status_code = status_code
+        self._json = json_data
+        self.text = text
+        self.headers = headers or {}
+
+    def json(self):
+        return self._json
+
+
+class FakeCineca:
+    """Sostituisce le sessioni HTTP verso Cineca: un calendario per polo, con ETag pari al contenuto."""
+
+    def __init__(self):
+        self.feeds = {polo: feed(f"A{i}") for i, polo in enumerate(unipi_calendar.poli_calendar_ids)}
+        self.honour_etag = False
+        self.conditional_requests = []
+        self.failing = set()  # poli per cui Cineca risponde 503
+        self.slow = set()  # poli per cui Cineca risponde dopo un secondo
+
+    def post(self, url, headers, json, timeout):
+        return FakeResponse(200, {'id': json['linkCalendarioId']})
+
+    def get(self, url, headers, timeout):
+        link_id = url.rsplit("=", 1)[1]
+        polo = next(p for p, i in unipi_calendar.poli_calendar_ids.items() if i == link_id)
+        if polo in self.failing:
+            return FakeResponse(503)
+        if polo in self.slow:
+            time.sleep(1)
+        etag = f'"{hash(self.feeds[polo])}"'
+        if 'If-None-Match' in headers:
+            self.conditional_requests.append(polo)
+            if self.honour_etag and headers['If-None-Match'] == etag:
+                return FakeResponse(304)
+        return FakeResponse(200, text=self.feeds[polo], headers={'ETag': etag})
+
+
+@pytest.fixture
+def cineca(monkeypatch):
+    fake = FakeCineca()
+    monkeypatch.setattr(unipi_calendar, 'get_http_session', lambda host: fake)
+    monkeypatch.setattr(unipi_calendar, 'get_rate_limiter', lambda tenant: RateLimiter(1000, burst=100))
+    monkeypatch.setattr(unipi_calendar, 'get_circuit_breaker', lambda tenant: CircuitBreaker(failures=1000))
+    monkeypatch.setattr(unipi_calendar, 'CALENDAR_RETRY_BACKOFF', 0)
+    monkeypatch.setattr(unipi_calendar, 'last_good', {})
+    monkeypatch.setattr(unipi_calendar, 'download_file_from_vercelFS', lambda filename: "polo,aula,usually_open\n")
+    monkeypatch.setattr(unipi_calendar, 'polo_cache', {})
+    monkeypatch.setattr(unipi_calendar, 'last_snapshots', {})
+    return fake
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    calls = []
+    parse_ics = unipi_calendar.parse_ics
+
+    def counting_parse_ics(content, day, days):
+        calls.append(content)
+        return parse_ics(content, day, days)
+
+    monkeypatch.setattr(unipi_calendar, 'parse_ics', counting_parse_ics)
+    return calls
+
+
+def test_unchanged_calendars_reuse_the_previous_snapshot(cineca, parsed):
+    first = unipi_calendar.load_calendars_and_parse(DAY)
+    assert len(parsed) == len(unipi_calendar.poli_calendar_ids)
+
+    second = unipi_calendar.load_calendars_and_parse(DAY)
+    assert second is first
+    assert len(parsed) == len(unipi_calendar.poli_calendar_ids)
+
+
+def test_only_the_changed_polo_is_parsed_again(cineca, parsed):
+    first = unipi_calendar.load_calendars_and_parse(DAY)
+    parsed.clear()
+    cineca.feeds['poloB'] = feed("B99")
+
+    second = unipi_calendar.load_calendars_and_parse(DAY)
+    assert second is not first
+    assert parsed == [feed("B99")]
+    assert ('poloB', 'B99') in second['rooms_index']
+    assert ('poloB', 'A1') not in second['rooms_index']
+    # Gli indici dei poli non modificati sono gli stessi oggetti
+    assert second['rooms_index'][('poloA', 'A0')] is first['rooms_index'][('poloA', 'A0')]
+
+
+def test_not_modified_responses_skip_the_download(cineca, parsed):
+    unipi_calendar.load_calendars_and_parse(DAY)
+    cineca.honour_etag = True
+    parsed.clear()
+
+    snapshot = unipi_calendar.load_calendars_and_parse(DAY)
+    assert sorted(cineca.conditional_requests) == sorted(unipi_calendar.poli_calendar_ids)
+    assert parsed == []
+    assert len(snapshot['rooms_index']) == len(unipi_calendar.poli_calendar_ids)
+
+
+def test_previous_days_are_evicted(cineca):
+    unipi_calendar.load_calendars_and_parse(DAY)
+    unipi_calendar.load_calendars_and_parse(date(2024, 10, 16))
+    assert all(day == "2024-10-16" for _, day in unipi_calendar.polo_cache)
+    assert list(unipi_calendar.last_snapshots) == ["2024-10-16"]
+
+
+def test_published_snapshot_is_read_only(cineca):
+    snapshot = unipi_calendar.load_calendars_and_parse(DAY)
+    with pytest.raises(TypeError):
+        snapshot['date'] = "2024-10-16"
+    with pytest.raises(TypeError):
+        snapshot['buildings']['poloA'].rooms['A0'] = True
+    with pytest.raises(TypeError):
+        snapshot['usually_open']['poloA'] = {}
+
+
+def test_snapshot_covers_the_following_days(cineca):
+    snapshot = unipi_calendar.load_calendars_and_parse(DAY)
+    assert len(snapshot['timelines']) == unipi_calendar.CALENDAR_DAYS
+    assert snapshot['timeline'] is snapshot['timelines']["2024-10-15"]
+    assert "2024-10-21" in snapshot['timelines']
+
+
+def test_failed_polo_keeps_its_last_good_calendar(cineca):
+    first = unipi_calendar.load_calendars_and_parse(DAY)
+    assert first['stale'] == {}
+
+    # il giorno dopo il polo B non risponde: si usano le lezioni scaricate ieri, segnalate come non aggiornate
+    cineca.failing.add('poloB')
+    second = unipi_calendar.load_calendars_and_parse(date(2024, 10, 16))
+    assert list(second['stale']) == ['poloB']
+    assert ('poloB', 'A1') in second['rooms_index']
+
+    cineca.failing.clear()
+    third = unipi_calendar.load_calendars_and_parse(date(2024, 10, 16))
+    assert third['stale'] == {}
+
+
+def test_refresh_does_not_wait_past_the_deadline(cineca, monkeypatch):
+    unipi_calendar.load_calendars_and_parse(DAY)
+    monkeypatch.setattr(unipi_calendar, 'CALENDAR_REFRESH_DEADLINE', 0.3)
+    cineca.slow.add('poloC')
+
+    started = time.monotonic()
+    snapshot = unipi_calendar.load_calendars_and_parse(date(2024, 10, 16))
+    assert time.monotonic() - started < 1
+    assert list(snapshot['stale']) == ['poloC']
+
+
+def test_refresh_records_the_time_of_each_phase(cineca):
+    unipi_calendar.load_calendars_and_parse(DAY)
+    unipi_calendar.load_calendars_and_parse(DAY)
+    body = unipi_calendar.metrics.refresh_registry.render()
+    for phase in ('filter_post', 'ics_get', 'parse', 'index'):
+        assert f'aulepi_refresh_polo_phase_seconds_count{{polo="poloA",phase="{phase}"}}' in body
+    for phase in ('aule_csv_download', 'timelines', 'total'):
+        assert f'aulepi_refresh_phase_seconds_count{{phase="{phase}"}}' in body
+    assert 'aulepi_refreshes_total{result="unchanged"}' in body
+    assert 'aulepi_calendar_downloaded_bytes_total{polo="poloA"}' in body
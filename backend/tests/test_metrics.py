@@ -0,0 +1,43 @@
+import pytest
+
+from metrics import Registry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('duration_seconds', "Durata", ['phase'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, phase='parse')
+    lines = registry.render().splitlines()
+    assert 'duration_seconds_bucket{phase="parse",le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{phase="parse",le="1"} 3' in lines
+    assert 'duration_seconds_bucket{phase="parse",le="+Inf"} 4' in lines
+    assert 'duration_seconds_sum{phase="parse"} 4.25' in lines
+    assert 'duration_seconds_count{phase="parse"} 4' in lines
+
+
+def test_histogram_times_blocks_that_raise():
+    registry = Registry()
+    histogram = registry.histogram('duration_seconds', "Durata", ['phase'])
+    with pytest.raises(RuntimeError):
+        with histogram.time(phase='ics_get'):
+            raise RuntimeError("download fallito")
+    assert 'duration_seconds_count{phase="ics_get"} 1' in registry.render()
+
+
+def test_counters_gauges_and_collectors():
+    registry = Registry()
+    downloaded = registry.counter('downloaded_bytes_total', "Bytes", ['polo'])
+    age = registry.gauge('age_seconds', "Età")
+    registry.add_collector(lambda: age.set(12.5))
+    downloaded.inc(100, polo='poloA')
+    downloaded.inc(20, polo='poloA')
+    downloaded.inc(5, polo='polo "B"')
+    lines = registry.render().splitlines()
+    assert 'downloaded_bytes_total{polo="poloA"} 120' in lines
+    assert 'downloaded_bytes_total{polo="polo \\"B\\""} 5' in lines
+    assert 'age_seconds 12.5' in lines
+    with pytest.raises(ValueError):
+        downloaded.inc(host='unipi')
+    with pytest.raises(ValueError):
+        registry.gauge('age_seconds', "Di nuovo")
@@ -0,0 +1,98 @@
+import base64
+from datetime import date
+
+import numpy as np
+
+import app as backend
+from conftest import DAY, at
+from model import Building, Lesson
+from occupancy import SLOT_SECONDS
+from room_index import RoomIndex
+from unipi_calendar import build_occupancies, build_timelines, opening_hours, poli_coordinates
+
+
+def slot(hour, minute=0):
+    return (hour * 60 + minute) * 60 // SLOT_SECONDS
+
+
+BUILDINGS = {
+    'poloA': Building('poloA', poli_coordinates['poloA'], {'A1': True, 'A2': True, 'A3': False}),
+    'poloC': Building('poloC', poli_coordinates['poloC'], {'C1': True}),
+}
+ROOMS_INDEX = {
+    ('poloA', 'A1'): RoomIndex([Lesson('poloA', 'A1', at(9), at(11), 'ROSSI'),
+                                Lesson('poloA', 'A1', at(14, 10), at(15, 50), 'ROSSI')]),
+    ('poloA', 'A2'): RoomIndex([Lesson('poloA', 'A2', at(14), at(16), 'VERDI')]),
+}
+
+
+def matrix():
+    return build_occupancies(DAY, 1, BUILDINGS, ROOMS_INDEX)["2024-10-15"]
+
+
+def row(matrix, polo, room):
+    return matrix.occupied[matrix.positions[(polo, room)]]
+
+
+def test_lessons_and_closed_hours_occupy_their_slots():
+    occupied = matrix()
+    assert occupied.slots == 24 * 60 * 60 // SLOT_SECONDS
+    a1 = row(occupied, 'poloA', 'A1')
+    assert a1[slot(9):slot(11)].all() and not a1[slot(11):slot(14, 10)].any()
+    assert a1[slot(14, 10):slot(15, 50)].all() and not a1[slot(15, 50):slot(20)].any()
+    # fuori dall'orario di apertura del polo le aule non sono disponibili
+    assert a1[:slot(7, 30)].all() and a1[slot(20):].all()
+    assert row(occupied, 'poloC', 'C1')[slot(19, 30):].all()
+    # un'aula non usually_open non è mai disponibile
+    assert row(occupied, 'poloA', 'A3').all()
+    assert not occupied.occupied.flags.writeable
+
+
+def test_matrix_matches_the_timeline_at_every_slot():
+    occupied = matrix()
+    timeline = build_timelines(DAY, 1, BUILDINGS, ROOMS_INDEX)["2024-10-15"]
+    for i in range(occupied.slots):
+        t = occupied.start + i * SLOT_SECONDS
+        for building in timeline.status_at(t):
+            for room in building.rooms:
+                available = room.free and not building.is_closed
+                assert available == (not row(occupied, building.building.name, room.name)[i])
+
+
+def test_free_rooms_between_two_instants():
+    assert matrix().free_between(at(14), at(16)) == [('poloC', 'C1')]
+    assert matrix().free_between(at(11), at(14)) == [('poloA', 'A1'), ('poloA', 'A2'), ('poloC', 'C1')]
+    assert matrix().free_between(at(19, 30), at(20)) == [('poloA', 'A1'), ('poloA', 'A2')]
+
+
+def test_daylight_saving_days_have_more_slots():
+    day = date(2024, 10, 27)  # ritorno all'ora solare: 25 ore
+    day_hours = opening_hours.day(day)
+    slots = build_occupancies(day, 1, BUILDINGS, {})["2024-10-27"].slots
+    assert slots == (day_hours.end - day_hours.start) // SLOT_SECONDS == 300
+
+
+def test_occupancy_endpoint_returns_packed_bits(monkeypatch, build_snapshot):
+    snapshot = build_snapshot(BUILDINGS, ROOMS_INDEX, "occupancy")
+    backend.publish_calendars(snapshot)
+    monkeypatch.setattr(backend, 'update_calendars', lambda: snapshot)
+    client = backend.app.test_client()
+
+    response = client.get('/api/occupancy?day=2024-10-15&polo=poloA', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['slotSeconds'] == SLOT_SECONDS and body['start'] == at(0)
+    assert set(body['rooms']) == {'poloA'}
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(body['rooms']['poloA']['A1']), dtype=np.uint8))[:body['slots']]
+    assert (bits.astype(bool) == row(snapshot['occupancy']["2024-10-15"], 'poloA', 'A1')).all()
+    revalidated = client.get('/api/occupancy?day=2024-10-15&polo=poloA',
+                             headers={'Accept-Encoding': 'identity', 'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert client.get('/api/occupancy?day=2024-10-20').status_code == 400
+    assert client.get('/api/occupancy?day=2024-10-15&fields=bogus').status_code == 200
+
+    free = client.get(f'/api/occupancy/free?from={at(14)}&to=2024-10-15T16:00')
+    assert free.get_json() == {'rooms': [{'polo': 'poloC', 'room': 'C1'}]}
+    assert client.get(f'/api/occupancy/free?from={at(16)}&to={at(14)}').status_code == 400
+    assert client.get(f'/api/occupancy/free?from=1e20&to={at(14)}').status_code == 400
+    assert client.get(f'/api/occupancy/free?from={at(14)}&to=-1e20').status_code == 400
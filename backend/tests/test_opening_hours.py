@@ -0,0 +1,84 @@
+from datetime import date
+
+import pytest
+
+from conftest import at, pisa_timezone
+from opening_hours import OpeningHours, load_opening_hours
+from sites import load_sites
+
+
+HOURS = {
+    'default': {'mon-sat': [["00:00", "24:00"]], 'sun': []},
+    'poli': {
+        'poloA': {'mon-fri': [["07:30", "13:00"], ["14:00", "20:00"]], 'sun': []},
+    },
+    'exceptions': [
+        {'from': "2024-12-24", 'to': "2024-12-26", 'hours': []},
+        {'from': "2024-12-24", 'poli': ["poloA"], 'hours': [["08:00", "12:00"]]},
+        {'from': "2025-01-07", 'poli': ["poloX"], 'hours': [["09:00", "10:00"]]},
+    ],
+}
+
+
+def test_weekly_rules_and_default():
+    hours = OpeningHours(HOURS, pisa_timezone)
+    tuesday = date(2024, 10, 15)
+    assert not hours.is_open('poloA', at(7, 29, tuesday))
+    assert hours.is_open('poloA', at(7, 30, tuesday))
+    assert not hours.is_open('poloA', at(13, 30, tuesday))
+    assert not hours.is_open('poloA', at(20, day=tuesday))
+    # il sabato il polo A non ha orari propri e usa quelli di default
+    assert hours.is_open('poloA', at(22, day=date(2024, 10, 19)))
+    assert hours.is_open('poloZ', at(3, day=tuesday))
+    assert not hours.is_open('poloZ', at(12, day=date(2024, 10, 20)))
+
+
+def test_next_change_and_transitions():
+    hours = OpeningHours(HOURS, pisa_timezone)
+    tuesday = date(2024, 10, 15)
+    day = hours.day(tuesday)
+    assert day.transitions('poloA') == (at(7, 30, tuesday), at(13, day=tuesday), at(14, day=tuesday), at(20, day=tuesday))
+    assert hours.next_change('poloA', at(9, day=tuesday)) == at(13, day=tuesday)
+    assert hours.next_change('poloA', at(13, day=tuesday)) == at(14, day=tuesday)
+    assert hours.next_change('poloA', at(21, day=tuesday)) == day.end
+    # aperto fino alle 24: la chiusura coincide con la fine della giornata
+    assert hours.next_change('poloZ', at(9, day=tuesday)) == day.end
+
+
+def test_exceptions_override_the_weekly_rules():
+    hours = OpeningHours(HOURS, pisa_timezone)
+    christmas_eve, christmas = date(2024, 12, 24), date(2024, 12, 25)
+    assert hours.is_open('poloA', at(9, day=christmas_eve))
+    assert not hours.is_open('poloA', at(13, day=christmas_eve))
+    assert not hours.is_open('poloZ', at(9, day=christmas_eve))
+    assert not hours.is_open('poloA', at(9, day=christmas))
+    assert hours.is_open('poloA', at(9, day=date(2024, 12, 27)))
+    # un'eccezione può riguardare un polo senza orari propri
+    assert hours.is_open('poloX', at(9, 30, date(2025, 1, 7)))
+    assert not hours.is_open('poloX', at(11, day=date(2025, 1, 7)))
+
+
+def test_daylight_saving_days_are_compiled_in_local_time():
+    hours = OpeningHours(HOURS, pisa_timezone)
+    day = date(2024, 10, 28)  # lunedì dopo il cambio dell'ora
+    assert hours.day(day).transitions('poloA')[0] == at(7, 30, day)
+    sunday = hours.day(date(2024, 10, 27))
+    assert sunday.end - sunday.start == 25 * 3600
+
+
+@pytest.mark.parametrize('data', [
+    {'poli': {'poloA': {'mon': [["08:00", "25:00"]]}}},
+    {'poli': {'poloA': {'mon': [["10:00", "08:00"]]}}},
+    {'poli': {'poloA': {'lunedì': [["08:00", "10:00"]]}}},
+    {'exceptions': [{'from': "24/12/2024", 'hours': []}]},
+])
+def test_invalid_opening_hours_are_rejected(data):
+    with pytest.raises(ValueError):
+        OpeningHours(data, pisa_timezone)
+
+
+def test_shipped_opening_hours_load():
+    hours = load_opening_hours(pisa_timezone, poli=load_sites().hours())
+    tuesday = date(2024, 10, 15)
+    assert hours.day(tuesday).transitions('poloA') == (at(7, 30, tuesday), at(20, day=tuesday))
+    assert not hours.is_open('poloA', at(12, day=date(2024, 10, 20)))
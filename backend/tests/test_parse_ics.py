@@ -0,0 +1,106 @@
+from conftest import DAY, pisa_timezone  # DAY è un martedì, in ora legale: Pisa è UTC+2
+from unipi_calendar import parse_ics
+
+
+def vevent(*lines):
+    return ["BEGIN:VEVENT", *lines, "END:VEVENT"]
+
+
+def calendar(*events, newline="\r\n"):
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0"]
+    for event in events:
+        lines.extend(event)
+    lines.append("END:VCALENDAR")
+    return newline.join(lines) + newline
+
+
+def test_parses_event_of_the_day_in_local_time():
+    ics = calendar(vevent(
+        "DTSTART:20241015T070000Z",
+        "DTEND:20241015T090000Z",
+        "SUMMARY:Analisi I",
+        "DESCRIPTION:Docenti: 123 ROSSI MARIO",
+        "LOCATION:Aula A1 - Polo A - via Diotisalvi",
+    ))
+    [event] = parse_ics(ics, DAY)
+    assert (event.room, event.start, event.end, event.professor) == (
+        "AulaA1", 1728975600, 1728982800, "Docenti: 123 ROSSI MARIO")
+    assert event.to_json(pisa_timezone) == {
+        'professor': "Docenti: 123 ROSSI MARIO",
+        'start': "2024-10-15 09:00:00",
+        'end': "2024-10-15 11:00:00",
+    }
+
+
+def test_skips_events_outside_the_local_day():
+    ics = calendar(
+        # 21:30Z del giorno prima sono le 23:30 a Pisa: è ancora il 14
+        vevent("DTSTART:20241014T213000Z", "DTEND:20241014T223000Z", "LOCATION:A1 - Polo A"),
+        # 22:30Z del giorno prima sono le 00:30 del 15
+        vevent("DTSTART:20241014T223000Z", "DTEND:20241014T233000Z", "LOCATION:A2 - Polo A"),
+        # 22:00Z del 15 è la mezzanotte del 16
+        vevent("DTSTART:20241015T220000Z", "DTEND:20241015T230000Z", "LOCATION:A3 - Polo A"),
+    )
+    assert [event.room for event in parse_ics(ics, DAY)] == ["A2"]
+
+
+def test_unfolds_continuation_lines():
+    ics = calendar(vevent(
+        "DTSTART:20241015T070000Z",
+        "DTEND:20241015T090000Z",
+        "DESCRIPTION:Docenti: 123 ROSSI MA",
+        " RIO, 456 VERDI",
+        "\t ANNA",
+        "LOCATION:Aula",
+        "  B2 - Polo B",
+    ), newline="\n")
+    [event] = parse_ics(ics, DAY)
+    assert event.professor == "Docenti: 123 ROSSI MARIO, 456 VERDI ANNA"
+    assert event.room == "AulaB2"
+
+
+def test_accepts_an_iterable_of_lines():
+    lines = calendar(vevent(
+        "DTSTART:20241015T070000Z", "DTEND:20241015T090000Z", "LOCATION:A1 - Polo A",
+    )).splitlines(keepends=True)
+    assert len(parse_ics(iter(lines), DAY)) == 1
+
+
+def test_ignores_property_parameters_and_fixes_mojibake():
+    ics = calendar(vevent(
+        "DTSTART:20241015T070000Z",
+        "DTEND:20241015T090000Z",
+        "DESCRIPTION;LANGUAGE=it:UniversitÃ ",
+        "LOCATION:A1 - Polo A",
+    ))
+    [event] = parse_ics(ics, DAY)
+    assert event.professor == "Università"
+
+
+def test_short_summary_replaces_missing_description():
+    short = calendar(vevent(
+        "DTSTART:20241015T070000Z", "DTEND:20241015T090000Z", "SUMMARY:Ricevimento", "LOCATION:A1 - Polo A",
+    ))
+    long = calendar(vevent(
+        "DTSTART:20241015T070000Z", "DTEND:20241015T090000Z",
+        "SUMMARY:Un titolo decisamente troppo lungo", "LOCATION:A1 - Polo A",
+    ))
+    assert parse_ics(short, DAY)[0].professor == "Ricevimento"
+    assert parse_ics(long, DAY)[0].professor == "No description"
+
+
+def test_skips_events_without_location_or_time():
+    ics = calendar(
+        vevent("DTSTART:20241015T070000Z", "DTEND:20241015T090000Z", "SUMMARY:Senza aula"),
+        vevent("DTSTART;VALUE=DATE:20241015", "DTEND;VALUE=DATE:20241016", "LOCATION:A1 - Polo A"),
+    )
+    assert parse_ics(ics, DAY) == []
+
+
+def test_multi_day_window_keeps_the_following_days():
+    ics = calendar(
+        vevent("DTSTART:20241015T070000Z", "DTEND:20241015T090000Z", "LOCATION:A1 - Polo A"),
+        vevent("DTSTART:20241016T070000Z", "DTEND:20241016T090000Z", "LOCATION:A2 - Polo A"),
+        vevent("DTSTART:20241017T070000Z", "DTEND:20241017T090000Z", "LOCATION:A3 - Polo A"),
+    )
+    assert [event.room for event in parse_ics(ics, DAY, 2)] == ["A1", "A2"]
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import app as backend
+import profiler
+from model import Building, BuildingStatus
+from timeline import DayTimeline
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampling_profiler_collects_collapsed_stacks(tmp_path):
+    sampler = profiler.SamplingProfiler(interval=0.001).start()
+    busy(0.1)
+    sampler.stop()
+    assert sampler.samples > 0
+    assert any(stack.endswith("busy (test_profiler.py)") for stack in sampler.stacks)
+
+    path = profiler.write_profile(sampler, "test", tmp_path)
+    for line in open(path, encoding='utf-8'):
+        stack, count = line.rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+
+def test_new_threads_are_followed_only_when_requested():
+    for follow in (False, True):
+        sampler = profiler.SamplingProfiler(interval=0.001, follow_new_threads=follow).start()
+        worker = threading.Thread(target=busy, args=(0.1,), name="download")
+        worker.start()
+        worker.join()
+        sampler.stop()
+        assert any(stack.startswith("download;") for stack in sampler.stacks) == follow
+
+
+def test_requests_are_profiled_only_when_enabled_or_with_the_token(monkeypatch):
+    monkeypatch.setattr(profiler, 'PROFILE_ENABLED', False)
+    monkeypatch.setattr(profiler, 'PROFILE_TOKEN', None)
+    assert not profiler.should_profile_request({'X-Profile': "segreto"})
+    monkeypatch.setattr(profiler, 'PROFILE_TOKEN', "segreto")
+    assert profiler.should_profile_request({'X-Profile': "segreto"})
+    assert not profiler.should_profile_request({'X-Profile': "altro"})
+    assert not profiler.should_profile_request({'X-Profile': "segret"})
+    monkeypatch.setattr(profiler, 'PROFILE_ENABLED', True)
+    monkeypatch.setattr(profiler, 'PROFILE_RATE', 1.0)
+    assert profiler.should_profile_request({})
+
+
+def test_profiled_request_writes_its_profile(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, 'PROFILE_TOKEN', "segreto")
+    monkeypatch.setattr(profiler, 'PROFILE_DIR', str(tmp_path))
+    state = (BuildingStatus(Building('poloA', [10.38, 43.72]), True, False, False, ()),)
+    snapshot = {'id': "profiled", 'date': "2024-10-15", 'timeline': DayTimeline([0], [state], 2 ** 40), 'timelines': {}}
+    backend.publish_calendars(snapshot)
+
+    def slow_snapshot():
+        busy(0.05)
+        return snapshot
+
+    monkeypatch.setattr(backend, 'update_calendars', slow_snapshot)
+    client = backend.app.test_client()
+    assert 'X-Profile' not in client.get('/api/open-classrooms').headers
+
+    response = client.get('/api/open-classrooms', headers={'X-Profile': "segreto"})
+    assert response.status_code == 200
+    path = tmp_path / response.headers['X-Profile']
+    assert path.name.startswith("request_api_open-classrooms-")
+    assert "slow_snapshot (test_profiler.py)" in path.read_text(encoding='utf-8')
+
+
+def test_refreshes_are_profiled_when_enabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, 'PROFILE_DIR', str(tmp_path))
+    load = lambda day: busy(0.05) or day
+    monkeypatch.setattr(profiler, 'PROFILE_ENABLED', False)
+    assert profiler.profile_refreshes(load) is load
+
+    monkeypatch.setattr(profiler, 'PROFILE_ENABLED', True)
+    assert profiler.profile_refreshes(load)("2024-10-15") == "2024-10-15"
+    assert [path.name.split("-")[0] for path in tmp_path.iterdir()] == ["refresh"]
@@ -0,0 +1,150 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from conftest import DAY, pisa_timezone
+from refresher import CalendarRefresher
+
+
+TODAY = DAY
+TOMORROW = TODAY + timedelta(days=1)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.days = []
+
+    def __call__(self, day):
+        self.days.append(day)
+        if self.fail:
+            return None
+        return {'date': day.strftime("%Y-%m-%d")}
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condizione non raggiunta"
+        time.sleep(0.01)
+
+
+def make_refresher(now, loader):
+    published = []
+    announced = []
+    clock = FakeClock(now)
+    refresher = CalendarRefresher(loader, published.append, pisa_timezone,
+                                  after_publish=announced.append, clock=clock)
+    return refresher, clock, published, announced
+
+
+def test_current_swaps_the_preloaded_snapshot_at_midnight_without_loading():
+    loader = Loader()
+    refresher, clock, published, _ = make_refresher(
+        datetime(2024, 10, 16, 0, 0, 5, tzinfo=pisa_timezone), loader)
+    refresher.snapshot = {'date': "2024-10-15"}
+    refresher.preloaded = {'date': "2024-10-16"}
+
+    assert refresher.current() == {'date': "2024-10-16"}
+    assert published == [{'date': "2024-10-16"}]
+    assert refresher.preloaded is None
+    assert loader.days == []
+
+
+def test_current_keeps_serving_the_old_snapshot_when_nothing_is_preloaded():
+    refresher, clock, published, _ = make_refresher(
+        datetime(2024, 10, 16, 0, 0, 5, tzinfo=pisa_timezone), Loader())
+    refresher.snapshot = {'date': "2024-10-15"}
+
+    assert refresher.current() == {'date': "2024-10-15"}
+    assert published == []
+    assert refresher.wakeup.is_set()
+
+
+def test_thread_loads_today_preloads_tomorrow_and_swaps_at_midnight():
+    loader = Loader()
+    refresher, clock, published, announced = make_refresher(
+        datetime(2024, 10, 15, 23, 30, tzinfo=pisa_timezone), loader)
+
+    assert refresher.wait_until_loaded(2)
+    wait_for(lambda: refresher.preloaded is not None)
+    assert loader.days == [TODAY, TOMORROW]
+    # Il precaricamento non viene pubblicato prima della mezzanotte
+    assert published == [{'date': "2024-10-15"}]
+
+    clock.now = datetime(2024, 10, 16, 0, 0, 5, tzinfo=pisa_timezone)
+    refresher.wakeup.set()
+    wait_for(lambda: len(announced) == 2)
+    assert published == [{'date': "2024-10-15"}, {'date': "2024-10-16"}]
+    assert announced == published
+    assert loader.days == [TODAY, TOMORROW]
+
+
+def test_wait_until_loaded_gives_up_when_the_first_load_fails():
+    loader = Loader(fail=True)
+    refresher, _, published, _ = make_refresher(
+        datetime(2024, 10, 15, 12, 0, tzinfo=pisa_timezone), loader)
+
+    assert refresher.wait_until_loaded(0.2) is False
+    assert published == []
+    assert loader.days == [TODAY]
+
+
+def test_periodic_refresh_publishes_only_changed_snapshots():
+    snapshots = {'value': {'date': "2024-10-15"}}
+    calls = []
+
+    def load(day):
+        calls.append(day)
+        return snapshots['value']
+
+    refresher, clock, published, _ = make_refresher(datetime(2024, 10, 15, 9, 0, tzinfo=pisa_timezone), load)
+    assert refresher.wait_until_loaded(2)
+
+    # Dopo l'intervallo di aggiornamento lo snapshot è lo stesso: non viene ripubblicato
+    clock.now = datetime(2024, 10, 15, 11, 0, tzinfo=pisa_timezone)
+    refresher.wakeup.set()
+    wait_for(lambda: len(calls) == 2)
+    assert len(published) == 1
+
+    snapshots['value'] = {'date': "2024-10-15", 'changed': True}
+    clock.now = datetime(2024, 10, 15, 13, 0, tzinfo=pisa_timezone)
+    refresher.wakeup.set()
+    wait_for(lambda: len(published) == 2)
+    assert published[-1] == {'date': "2024-10-15", 'changed': True}
+
+
+def test_todays_saved_snapshot_is_served_before_loading():
+    loader = Loader()
+    published = []
+    announced = []
+    release = threading.Event()
+
+    def slow_load(day):
+        release.wait(2)
+        return loader(day)
+
+    refresher = CalendarRefresher(slow_load, published.append, pisa_timezone, after_publish=announced.append,
+                                  clock=FakeClock(datetime(2024, 10, 15, 9, 0, tzinfo=pisa_timezone)),
+                                  restore=lambda: {'date': "2024-10-15", 'restored': True})
+    assert refresher.wait_until_loaded(0.5)
+    assert published == [{'date': "2024-10-15", 'restored': True}]
+    assert announced == []
+    assert loader.days == []
+    release.set()
+
+
+def test_saved_snapshot_of_another_day_is_ignored():
+    loader = Loader()
+    refresher, _, published, _ = make_refresher(datetime(2024, 10, 15, 9, 0, tzinfo=pisa_timezone), loader)
+    refresher.restore = lambda: {'date': "2024-10-14"}
+    assert refresher.wait_until_loaded(2)
+    assert published == [{'date': "2024-10-15"}]
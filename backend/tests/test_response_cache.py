@@ -0,0 +1,49 @@
+import gzip
+import json
+
+from response_cache import ResponseCache
+
+
+def make_cache():
+    calls = []
+
+    def serialize(state):
+        calls.append(state)
+        return json.dumps(state).encode('utf-8')
+
+    return ResponseCache(serialize), calls
+
+
+def test_same_state_is_served_from_cache():
+    cache, calls = make_cache()
+    state = {'poloA': {'free': True}}
+    first = cache.get(state)
+    assert cache.get(state) is first
+    assert len(calls) == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_new_state_object_invalidates_the_cache():
+    cache, calls = make_cache()
+    cache.get({'poloA': {'free': True}})
+    body = cache.get({'poloA': {'free': False}})
+    assert json.loads(body) == {'poloA': {'free': False}}
+    assert len(calls) == 2
+
+
+def test_compressed_variants_reuse_the_serialized_body():
+    cache, calls = make_cache()
+    state = {'poloA': {'free': True}}
+    body = cache.get(state, 'gzip')
+    assert gzip.decompress(body) == cache.get(state)
+    assert cache.get(state, 'gzip') is body
+    assert len(calls) == 1
+
+
+def test_invalidate_forces_a_new_serialization():
+    cache, calls = make_cache()
+    state = {'poloA': {'free': True}}
+    cache.get(state)
+    cache.invalidate()
+    cache.get(state)
+    assert len(calls) == 2
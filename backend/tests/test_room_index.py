@@ -0,0 +1,78 @@
+from model import Lesson
+from room_index import RoomIndex
+
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+
+
+def room(*intervals):
+    return RoomIndex([Lesson('poloA', 'A1', start, end, 'ROSSI') for start, end in intervals])
+
+
+def test_empty_room_is_free():
+    index = room()
+    assert index.status(10 * HOUR) == (False, False)
+    assert index.remaining_lessons(10 * HOUR) == ()
+
+
+def test_occupancy_is_half_open():
+    index = room((9 * HOUR, 11 * HOUR))
+    assert index.status(9 * HOUR - 1) == (False, False)
+    assert index.status(9 * HOUR)[0] is True
+    assert index.status(11 * HOUR - 1)[0] is True
+    assert index.status(11 * HOUR) == (False, False)
+
+
+def test_available_soon_starts_thirty_minutes_before_the_end():
+    index = room((9 * HOUR, 11 * HOUR))
+    assert index.status(10 * HOUR + 30 * MINUTE - 1) == (True, False)
+    assert index.status(10 * HOUR + 30 * MINUTE) == (True, True)
+    assert index.status(11 * HOUR - 1) == (True, True)
+
+
+def test_lesson_right_after_is_not_available_soon():
+    index = room((9 * HOUR, 11 * HOUR), (11 * HOUR, 13 * HOUR))
+    assert index.status(10 * HOUR + 45 * MINUTE) == (True, False)
+
+
+def test_lesson_fifteen_minutes_after_is_not_available_soon():
+    index = room((9 * HOUR, 11 * HOUR), (11 * HOUR + 15 * MINUTE, 13 * HOUR))
+    assert index.status(10 * HOUR + 45 * MINUTE) == (True, False)
+    # Nella pausa di 15 minuti l'aula è libera
+    assert index.status(11 * HOUR + 5 * MINUTE) == (False, False)
+
+
+def test_lesson_thirty_minutes_after_does_not_extend_the_previous_one():
+    index = room((9 * HOUR, 11 * HOUR), (11 * HOUR + 30 * MINUTE, 13 * HOUR))
+    assert index.status(10 * HOUR + 45 * MINUTE) == (True, True)
+
+
+def test_overlapping_lessons_keep_the_room_occupied():
+    index = room((9 * HOUR, 13 * HOUR), (10 * HOUR, 11 * HOUR))
+    # La lezione breve finisce entro 30 minuti ma quella lunga è ancora in corso
+    assert index.status(10 * HOUR + 45 * MINUTE) == (True, True)
+    assert index.status(12 * HOUR) == (True, False)
+
+
+def test_remaining_lessons_drop_the_finished_ones():
+    index = room((11 * HOUR, 12 * HOUR), (9 * HOUR, 10 * HOUR), (9 * HOUR, 13 * HOUR))
+    assert [(l.start, l.end) for l in index.remaining_lessons(10 * HOUR)] == [
+        (9 * HOUR, 13 * HOUR), (11 * HOUR, 12 * HOUR),
+    ]
+    assert index.remaining_lessons(13 * HOUR) == ()
+
+
+def test_remaining_lessons_stop_at_until():
+    index = room((9 * HOUR, 11 * HOUR), (33 * HOUR, 35 * HOUR))
+    assert [(l.start, l.end) for l in index.remaining_lessons(10 * HOUR)] == [(9 * HOUR, 11 * HOUR), (33 * HOUR, 35 * HOUR)]
+    assert [(l.start, l.end) for l in index.remaining_lessons(10 * HOUR, 24 * HOUR)] == [(9 * HOUR, 11 * HOUR)]
+
+
+def test_free_until_is_the_start_of_the_next_busy_interval():
+    index = room((9 * HOUR, 11 * HOUR), (11 * HOUR, 12 * HOUR), (14 * HOUR, 15 * HOUR))
+    assert index.free_until(8 * HOUR) == 9 * HOUR
+    assert index.free_until(10 * HOUR) == 10 * HOUR  # occupata
+    assert index.free_until(11 * HOUR) == 11 * HOUR  # lezione consecutiva
+    assert index.free_until(12 * HOUR) == 14 * HOUR
+    assert index.free_until(15 * HOUR) == float('inf')
@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pytest
+
+import unipi_calendar
+from sites import CircuitBreaker, RateLimiter, Site, SiteRegistry, load_sites
+
+
+REGISTRY = {
+    'tenants': {
+        'unipi': {'host': "unipi.example", 'clienteId': "c1", 'concurrency': 2, 'requestsPerSecond': 5},
+        'unich': {'host': "unich.example", 'clienteId': "c2"},
+    },
+    'sites': {
+        'poloA': {'tenant': "unipi", 'linkCalendarioId': "a", 'coordinates': [10.38, 43.72],
+                  'hours': {'mon-fri': [["08:00", "19:00"]]}},
+        'poloB': {'tenant': "unipi", 'linkCalendarioId': "b", 'coordinates': [10.39, 43.72], 'priority': 1},
+        'poloFarmacia': {'tenant': "unich", 'linkCalendarioId': "f", 'coordinates': [10.38, 43.71]},
+    },
+}
+
+
+def test_registry_links_sites_to_their_tenant():
+    registry = SiteRegistry(REGISTRY)
+    assert registry.sites['poloFarmacia'].tenant.host == "unich.example"
+    assert registry.tenants['unich'].concurrency == 4
+    assert registry.calendar_ids() == {'poloA': "a", 'poloB': "b", 'poloFarmacia': "f"}
+    assert registry.hours() == {'poloA': {'mon-fri': [["08:00", "19:00"]]}}
+
+
+def test_registry_rejects_unknown_tenants():
+    data = {'tenants': {}, 'sites': {'poloA': {'tenant': "unipi", 'linkCalendarioId': "a", 'coordinates': [0, 0]}}}
+    with pytest.raises(ValueError):
+        SiteRegistry(data)
+
+
+def test_shipped_registry_keeps_farmacia_on_unich():
+    registry = load_sites()
+    assert registry.sites['poloFarmacia'].tenant.host == "unich.prod.up.cineca.it"
+    assert registry.sites['poloA'].tenant.host == "unipi.prod.up.cineca.it"
+
+
+def test_rate_limiter_spaces_out_the_requests():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(2, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        limiter.acquire()
+    # le prime due richieste usano la capacità iniziale, le altre aspettano mezzo secondo ciascuna
+    assert sleeps == [0.5, 0.5]
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    now = [0.0]
+    breaker = CircuitBreaker(failures=2, cooldown=60, clock=lambda: now[0])
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    now[0] = 61
+    assert breaker.allow()
+    # il primo tentativo dopo il cooldown fallisce: l'interruttore si riapre subito
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+class FlakySession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def get(self, url, timeout, **kwargs):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        if status is None:
+            raise unipi_calendar.requests.ConnectionError("connessione rifiutata")
+        return type('Response', (), {'status_code': status})()
+
+
+def use_session(monkeypatch, session, breaker=None):
+    monkeypatch.setattr(unipi_calendar, 'get_http_session', lambda host: session)
+    monkeypatch.setattr(unipi_calendar, 'get_rate_limiter', lambda tenant: RateLimiter(1000, burst=100))
+    monkeypatch.setattr(unipi_calendar, 'get_circuit_breaker', lambda tenant: breaker or CircuitBreaker())
+    monkeypatch.setattr(unipi_calendar, 'CALENDAR_RETRY_BACKOFF', 0)
+
+
+def test_cineca_request_retries_errors_and_server_failures(monkeypatch):
+    session = FlakySession([None, 503, 200])
+    use_session(monkeypatch, session)
+    tenant = SiteRegistry(REGISTRY).tenants['unipi']
+    response = unipi_calendar.cineca_request(tenant, 'get', "https://unipi.example/", time.monotonic() + 10)
+    assert response.status_code == 200
+    assert session.calls == 3
+
+    # gli errori del client non vengono ritentati
+    session = FlakySession([404])
+    use_session(monkeypatch, session)
+    assert unipi_calendar.cineca_request(tenant, 'get', "https://unipi.example/", time.monotonic() + 10).status_code == 404
+    assert session.calls == 1
+
+
+def test_cineca_request_skips_hosts_with_an_open_circuit(monkeypatch):
+    session = FlakySession([503, 503, 503, 200])
+    breaker = CircuitBreaker(failures=3)
+    use_session(monkeypatch, session, breaker)
+    tenant = SiteRegistry(REGISTRY).tenants['unipi']
+    assert unipi_calendar.cineca_request(tenant, 'get', "https://unipi.example/", time.monotonic() + 10).status_code == 503
+    assert unipi_calendar.cineca_request(tenant, 'get', "https://unipi.example/", time.monotonic() + 10) is None
+    assert session.calls == 3
+
+
+def test_busiest_and_prioritised_poli_are_fetched_first(monkeypatch):
+    monkeypatch.setattr(unipi_calendar, 'site_registry', SiteRegistry(REGISTRY))
+    monkeypatch.setattr(unipi_calendar, 'polo_cache', {
+        ('poloA', "2024-10-15"): {'lessons': [None] * 50},
+        ('poloFarmacia', "2024-10-15"): {'lessons': [None] * 10},
+    })
+    assert [site.name for site in unipi_calendar.fetch_order()] == ['poloB', 'poloA', 'poloFarmacia']
+
+
+def test_downloads_respect_the_concurrency_of_each_host(monkeypatch):
+    monkeypatch.setattr(unipi_calendar, 'site_registry', SiteRegistry(REGISTRY))
+    monkeypatch.setattr(unipi_calendar, 'polo_cache', {})
+    monkeypatch.setattr(unipi_calendar, 'get_rate_limiter', lambda tenant: RateLimiter(1000, burst=100))
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+
+    def download(polo, today, cached, days, deadline):
+        host = unipi_calendar.site_registry.sites[polo].tenant.host
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), running[host])
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+        return {'content': "", 'etag': None, 'last_modified': None}
+
+    monkeypatch.setattr(unipi_calendar, 'download_polo_calendar', download)
+    registry = unipi_calendar.site_registry
+    for i in range(6):
+        registry.sites[f"polo{i}"] = Site(f"polo{i}", registry.tenants['unipi'], str(i), [0, 0])
+
+    downloaded = [polo for polo, _ in unipi_calendar.get_unipi_calendars()]
+    assert sorted(downloaded) == sorted(registry.sites)
+    assert peak["unipi.example"] == 2
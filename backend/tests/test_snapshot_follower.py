@@ -0,0 +1,59 @@
+import json
+import os
+
+from snapshot_follower import SnapshotFollower
+
+
+def read(path):
+    with open(path) as f:
+        content = f.read()
+    return json.loads(content) if content else None
+
+
+def write(path, snapshot, mtime):
+    path.write_text(json.dumps(snapshot))
+    os.utime(path, ns=(mtime, mtime))
+
+
+def make_follower(path):
+    published = []
+    return SnapshotFollower(str(path), read, published.append, interval=0.01), published
+
+
+def test_missing_file_is_not_published(tmp_path):
+    follower, published = make_follower(tmp_path / "snapshot.json")
+    assert follower.check() is False
+    assert follower.current() is None
+    assert published == []
+
+
+def test_file_is_read_again_only_when_replaced(tmp_path):
+    path = tmp_path / "snapshot.json"
+    follower, published = make_follower(path)
+    write(path, {'date': "2024-10-15"}, 10 ** 18)
+    assert follower.check() is True
+    assert follower.check() is False
+    assert published == [{'date': "2024-10-15"}]
+
+    write(path, {'date': "2024-10-16"}, 2 * 10 ** 18)
+    assert follower.check() is True
+    assert follower.current() == {'date': "2024-10-16"}
+
+
+def test_unreadable_file_keeps_the_previous_snapshot(tmp_path):
+    path = tmp_path / "snapshot.json"
+    follower, published = make_follower(path)
+    write(path, {'date': "2024-10-15"}, 10 ** 18)
+    follower.check()
+    path.write_text("")
+    assert follower.check() is False
+    assert follower.current() == {'date': "2024-10-15"}
+
+
+def test_wait_until_loaded_follows_the_file_in_background(tmp_path):
+    path = tmp_path / "snapshot.json"
+    follower, published = make_follower(path)
+    assert follower.wait_until_loaded(0.05) is False
+    write(path, {'date': "2024-10-15"}, 10 ** 18)
+    assert follower.wait_until_loaded(2) is True
+    follower.stop.set()
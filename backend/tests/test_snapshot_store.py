@@ -0,0 +1,41 @@
+import pytest
+
+import snapshot_store
+from conftest import at
+from model import Building, Lesson
+from room_index import RoomIndex
+from unipi_calendar import buildings_status_to_json
+
+
+@pytest.fixture
+def snapshot(build_snapshot):
+    buildings = {'poloA': Building('poloA', [10.38, 43.72], {'A1': True, 'A2': True})}
+    rooms_index = {('poloA', 'A1'): RoomIndex([Lesson('poloA', 'A1', at(9), at(11), 'ROSSI')])}
+    usually_open = {'poloA': {'A1': {'usually_open': True}, 'A2': {'usually_open': True}}}
+    return build_snapshot(buildings, rooms_index, days=2, usually_open=usually_open, stale={'poloA': at(6)})
+
+
+def test_round_trip_rebuilds_the_same_timeline(snapshot):
+    restored = snapshot_store.deserialize_snapshot(snapshot_store.serialize_snapshot(snapshot))
+    assert restored['date'] == snapshot['date']
+    assert restored['stale'] == {'poloA': at(6)}
+    assert restored['timeline'].instants == snapshot['timeline'].instants
+    assert ([buildings_status_to_json(state) for state in restored['timeline'].states]
+            == [buildings_status_to_json(state) for state in snapshot['timeline'].states])
+
+
+def test_other_formats_are_ignored(snapshot, monkeypatch):
+    content = snapshot_store.serialize_snapshot(snapshot)
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_FORMAT', snapshot_store.SNAPSHOT_FORMAT + 1)
+    assert snapshot_store.deserialize_snapshot(content) is None
+
+
+def test_local_file_is_used_without_vercel_blob(snapshot, monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot_store, 'use_vercel_blob', lambda: False)
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_PATH', str(tmp_path / "snapshot.json.gz"))
+    assert snapshot_store.load_snapshot() is None
+
+    snapshot_store.save_snapshot(snapshot)
+    restored = snapshot_store.load_snapshot()
+    assert ([buildings_status_to_json(state) for state in restored['timeline'].states]
+            == [buildings_status_to_json(state) for state in snapshot['timeline'].states])
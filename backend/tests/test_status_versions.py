@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import at, pisa_timezone
+from model import Building, Lesson, status_delta
+from room_index import RoomIndex
+from status_versions import StatusVersions
+
+
+@pytest.fixture
+def snapshot(build_snapshot):
+    def build(snapshot_id="s1", rooms=('A1', 'A2')):
+        buildings = {'poloA': Building('poloA', [10.38, 43.72], {room: True for room in rooms})}
+        rooms_index = {('poloA', 'A1'): RoomIndex([Lesson('poloA', 'A1', at(9), at(11), 'ROSSI')])}
+        return build_snapshot(buildings, rooms_index, snapshot_id)
+
+    return build
+
+
+def status(snapshot, hour, minute=0):
+    return StatusVersions.status_at(snapshot, snapshot['timeline'], "2024-10-15", at(hour, minute))
+
+
+def test_version_changes_only_with_the_state(snapshot):
+    s = snapshot()
+    assert status(s, 9, 10)[0] == status(s, 9, 20)[0]
+    assert status(s, 9, 10)[0] != status(s, 10, 40)[0]
+    assert status(s, 9, 10)[0].startswith("s1.2024-10-15.")
+    assert status(s, 9, 10)[2] == at(10, 30)
+
+
+def test_delta_contains_only_the_changed_rooms(snapshot):
+    s = snapshot()
+    delta = status_delta(status(s, 8)[1], status(s, 9)[1], pisa_timezone)
+    assert list(delta) == ['poloA']
+    assert 'A1' in delta['poloA'] and 'A2' not in delta['poloA']
+    assert delta['poloA']['A1']['free'] is False
+    assert status_delta(status(s, 9)[1], status(s, 9, 20)[1], pisa_timezone) == {}
+
+
+def test_delta_across_snapshots_compares_values(snapshot):
+    old, new = snapshot("s1"), snapshot("s2")
+    assert status_delta(status(old, 8)[1], status(new, 8)[1], pisa_timezone) == {'poloA': {
+        'coordinates': [10.38, 43.72], 'free': True, 'buildingAvailableSoon': False, 'isClosed': False,
+        'A1': {'lessons': [{'professor': 'ROSSI', 'start': "2024-10-15 09:00:00", 'end': "2024-10-15 11:00:00"}],
+               'free': True, 'roomAvailableSoon': False}}}
+
+
+def test_different_rooms_need_the_full_state(snapshot):
+    old, new = snapshot("s1"), snapshot("s2", rooms=('A1', 'A2', 'A3'))
+    assert status_delta(status(old, 8)[1], status(new, 8)[1], pisa_timezone) is None
+
+
+def test_state_of_resolves_recent_versions_only(snapshot):
+    versions = StatusVersions(keep=2)
+    first = snapshot("s1")
+    versions.publish(first)
+    version, state, _ = status(first, 9)
+    assert versions.state_of(version) is state
+    assert versions.state_of("s1.2024-10-15.999") is None
+    assert versions.state_of("non valida") is None
+
+    versions.publish(snapshot("s2"))
+    versions.publish(snapshot("s3"))
+    assert versions.state_of(version) is None
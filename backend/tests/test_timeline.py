@@ -0,0 +1,83 @@
+from conftest import DAY, at
+from model import Building, Lesson
+from room_index import RoomIndex
+from unipi_calendar import build_day_timeline, buildings_status_to_json
+
+
+def lesson(start, end):
+    return Lesson('poloA', 'A1', start, end, 'ROSSI')
+
+
+def build(lessons_a1, lessons_a2=()):
+    buildings = {'poloA': Building('poloA', [10.38, 43.72], {'A1': True, 'A2': True, 'A3': False})}
+    rooms_index = {('poloA', 'A1'): RoomIndex(list(lessons_a1)), ('poloA', 'A2'): RoomIndex(list(lessons_a2))}
+    return build_day_timeline(DAY, buildings, rooms_index)
+
+
+def status_at(timeline, now):
+    return buildings_status_to_json(timeline.status_at(now))
+
+
+def test_transitions_include_lessons_and_opening_hours():
+    timeline = build([lesson(at(9), at(11))])
+    assert timeline.instants == (at(0), at(7, 30), at(9), at(10, 30), at(11), at(20))
+    assert timeline.end == at(0) + 24 * 3600
+
+
+def test_room_and_polo_status_follow_the_lessons():
+    timeline = build([lesson(at(9), at(11))], [lesson(at(8), at(12))])
+
+    state = status_at(timeline, at(9, 15))
+    assert state['poloA']['A1']['free'] is False
+    assert state['poloA']['A1']['roomAvailableSoon'] is False
+    assert state['poloA']['free'] is False
+    assert state['poloA']['isClosed'] is False
+
+    state = status_at(timeline, at(10, 30))
+    assert state['poloA']['A1']['roomAvailableSoon'] is True
+    assert state['poloA']['buildingAvailableSoon'] is True
+
+    state = status_at(timeline, at(11))
+    assert state['poloA']['A1'] == {'lessons': [], 'free': True, 'roomAvailableSoon': False}
+    assert state['poloA']['free'] is True
+
+
+def test_contiguous_lesson_is_not_available_soon():
+    timeline = build([lesson(at(9), at(11)), lesson(at(11, 15), at(13))])
+    state = status_at(timeline, at(10, 45))
+    assert state['poloA']['A1']['roomAvailableSoon'] is False
+    assert len(state['poloA']['A1']['lessons']) == 2
+
+
+def test_rooms_not_usually_open_are_never_free():
+    state = status_at(build([]), at(12))
+    assert state['poloA']['A3'] == {'lessons': [], 'free': False, 'roomAvailableSoon': False}
+
+
+def test_polo_is_closed_outside_opening_hours():
+    timeline = build([])
+    assert status_at(timeline, at(7, 29))['poloA']['isClosed'] is True
+    assert status_at(timeline, at(7, 30))['poloA']['isClosed'] is False
+    assert status_at(timeline, at(20))['poloA']['isClosed'] is True
+
+
+def test_next_change_is_the_start_of_the_next_interval():
+    timeline = build([lesson(at(9), at(11))])
+    assert timeline.next_change(at(8)) == at(9)
+    assert timeline.next_change(at(10, 45)) == at(11)
+    assert timeline.next_change(at(21)) == timeline.end
+
+
+def test_unchanged_rooms_are_shared_between_intervals():
+    timeline = build([lesson(at(9), at(11))], [lesson(at(14), at(16))])
+    before, during = timeline.status_at(at(8)), timeline.status_at(at(9, 30))
+    assert before is not during
+    assert before[0].rooms[0] is not during[0].rooms[0]
+    assert before[0].rooms[1] is during[0].rooms[1]
+    assert before[0].rooms[2] is during[0].rooms[2]
+
+
+def test_lessons_are_serialized_in_local_time():
+    state = status_at(build([lesson(at(9), at(11))]), at(8))
+    assert state['poloA']['A1']['lessons'] == [
+        {'professor': 'ROSSI', 'start': "2024-10-15 09:00:00", 'end': "2024-10-15 11:00:00"}]
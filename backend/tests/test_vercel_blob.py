@@ -0,0 +1,86 @@
+import pytest
+
+import unipi_calendar
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+
+
+class FakeVercelBlob:
+    """Sostituisce VercelFS: i blob sono elencati due per pagina, come con molti file."""
+
+    def __init__(self, blobs):
+        self.blobs = dict(blobs)  # pathname -> contenuto
+        self.list_calls = 0
+        self.puts = []
+
+    def url(self, pathname):
+        return f"https://blob.test/{pathname}"
+
+    def list(self, options):
+        self.list_calls += 1
+        names = sorted(self.blobs)
+        start = int(options.get('cursor', 0))
+        page = names[start:start + 2]
+        has_more = start + 2 < len(names)
+        return {'blobs': [{'pathname': name, 'url': self.url(name)} for name in page],
+                'hasMore': has_more, 'cursor': str(start + 2) if has_more else None}
+
+    def put(self, pathname, content, options):
+        self.puts.append(pathname)
+        self.blobs[pathname] = content
+        return {'pathname': pathname, 'url': self.url(pathname)}
+
+    def get(self, url, timeout):
+        pathname = url.rsplit("/", 1)[1]
+        if pathname not in self.blobs:
+            return FakeResponse(404)
+        return FakeResponse(200, self.blobs[pathname])
+
+
+@pytest.fixture
+def blob(monkeypatch):
+    fake = FakeVercelBlob({f"file{i}.txt": f"contenuto {i}".encode() for i in range(5)})
+    monkeypatch.setattr(unipi_calendar.vercel_blob, 'list', fake.list)
+    monkeypatch.setattr(unipi_calendar.vercel_blob, 'put', fake.put)
+    monkeypatch.setattr(unipi_calendar.requests, 'get', fake.get)
+    monkeypatch.setattr(unipi_calendar, 'blob_urls', {})
+    monkeypatch.setattr(unipi_calendar, 'blob_hashes', {})
+    return fake
+
+
+def test_list_all_blobs_follows_pagination(blob):
+    assert len(unipi_calendar.list_all_blobs()['blobs']) == 5
+
+
+def test_download_lists_blobs_only_once(blob):
+    assert unipi_calendar.download_blob_from_vercelFS("file4.txt") == b"contenuto 4"
+    assert unipi_calendar.download_blob_from_vercelFS("file0.txt") == b"contenuto 0"
+    assert blob.list_calls == 3  # una sola scansione completa (3 pagine)
+
+
+def test_download_of_missing_file_returns_none(blob):
+    assert unipi_calendar.download_blob_from_vercelFS("assente.txt") is None
+
+
+def test_stale_url_is_refreshed(blob):
+    unipi_calendar.download_blob_from_vercelFS("file1.txt")
+    del blob.blobs["file1.txt"]
+    assert unipi_calendar.download_blob_from_vercelFS("file1.txt") is None
+
+
+def test_upload_uses_the_returned_url(blob):
+    unipi_calendar.upload_a_blob("nuovo.txt", "ciao")
+    assert unipi_calendar.download_blob_from_vercelFS("nuovo.txt") == b"ciao"
+    assert blob.list_calls == 0
+
+
+def test_unchanged_content_is_not_uploaded(blob):
+    unipi_calendar.download_blob_from_vercelFS("file2.txt")
+    assert not unipi_calendar.upload_a_blob_if_changed("file2.txt", "contenuto 2")
+    assert unipi_calendar.upload_a_blob_if_changed("file2.txt", "contenuto modificato")
+    assert not unipi_calendar.upload_a_blob_if_changed("file2.txt", "contenuto modificato")
+    assert blob.puts == ["file2.txt"]
@@ -0,0 +1,91 @@
+import pytest
+
+import app as backend
+from conftest import at, pisa_timezone
+from model import Building, Lesson, status_to_columns, status_to_json
+from room_index import RoomIndex
+from unipi_calendar import poli_coordinates
+
+
+@pytest.fixture
+def snapshot(build_snapshot):
+    buildings = {
+        'poloA': Building('poloA', poli_coordinates['poloA'], {'A1': True, 'A2': True}),
+        'poloC': Building('poloC', poli_coordinates['poloC'], {'C1': True}),
+    }
+    rooms_index = {('poloA', 'A1'): RoomIndex([Lesson('poloA', 'A1', at(9), at(11), 'ROSSI'),
+                                               Lesson('poloA', 'A1', at(14), at(16), 'ROSSI')])}
+    return build_snapshot(buildings, rooms_index, "views")
+
+
+@pytest.fixture
+def state(snapshot):
+    return snapshot['timeline'].status_at(at(10))
+
+
+def test_projection_without_lessons(state):
+    status = status_to_json(state, pisa_timezone, fields={'status', 'rooms'})
+    assert status['poloA'] == {'free': True, 'buildingAvailableSoon': False, 'isClosed': False,
+                               'A1': {'free': False, 'roomAvailableSoon': False},
+                               'A2': {'free': True, 'roomAvailableSoon': False}}
+
+
+def test_filters_by_polo_and_room(state):
+    status = status_to_json(state, pisa_timezone, poli={'poloA'}, rooms={'A2'})
+    assert list(status) == ['poloA']
+    assert 'A2' in status['poloA'] and 'A1' not in status['poloA']
+
+
+def test_columns_use_tables_and_epoch_minutes(state):
+    columns = status_to_columns(state)
+    assert columns['poli'] == ['poloA', 'poloC']
+    assert columns['free'] == [1, 1]
+    assert [columns['names'][name] for name in columns['rooms']['name']] == ['A1', 'A2', 'C1']
+    assert columns['rooms']['free'] == [0, 1, 1]
+    assert columns['lessons']['room'] == [0, 0]
+    assert columns['lessons']['start'] == [at(9) // 60, at(14) // 60]
+    assert columns['professors'] == ['ROSSI']
+
+
+def test_columns_with_status_only(state):
+    assert status_to_columns(state, fields={'status'}) == {
+        'format': 'columns-1', 'poli': ['poloA', 'poloC'], 'free': [1, 1], 'availableSoon': [0, 0], 'isClosed': [0, 0]}
+
+
+@pytest.fixture
+def client(monkeypatch, snapshot):
+    published = snapshot
+    backend.publish_calendars(published)
+    monkeypatch.setattr(backend, 'update_calendars', lambda: published)
+    return backend.app.test_client()
+
+
+def get(client, **query):
+    return client.get('/api/open-classrooms', query_string={'at': at(10), **query},
+                      headers={'Accept-Encoding': 'identity'})
+
+
+def test_status_only_response_is_small(client):
+    response = get(client, fields="status")
+    assert response.get_json() == {
+        'poloA': {'free': True, 'buildingAvailableSoon': False, 'isClosed': False},
+        'poloC': {'free': True, 'buildingAvailableSoon': False, 'isClosed': False}}
+    assert len(response.data) < 300
+
+
+def test_formats_are_negotiated(client):
+    response = client.get('/api/open-classrooms', query_string={'at': at(10)},
+                          headers={'Accept': backend.RESPONSE_FORMATS['columns']})
+    assert response.mimetype == backend.RESPONSE_FORMATS['columns']
+    assert response.get_json()['poli'] == ['poloA', 'poloC']
+    assert get(client, format="columns", polo="poloC").get_json()['poli'] == ['poloC']
+    assert get(client, format="xml").status_code == 406
+    assert get(client, fields="status,colore").status_code == 400
+    assert get(client, fields="status", since="views.2024-10-15.0").status_code == 400
+
+
+def test_msgpack_format(client):
+    msgpack = pytest.importorskip("msgpack")
+    response = get(client, format="msgpack", fields="status")
+    assert response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.data)['poli'] == ['poloA', 'poloC']
@@ -0,0 +1,51 @@
+from bisect import bisect_right
+
+from room_index import AVAILABLE_SOON_SECONDS
+
+
+class DayTimeline:
+    """
+    Stato degli edifici precalcolato per un'intera giornata.
+    La giornata è divisa negli intervalli [instants[i], instants[i+1]) durante i quali lo stato non cambia:
+    states[i] è lo stato valido nell'i-esimo intervallo, quindi una richiesta deve solo trovare l'intervallo
+    che contiene l'istante attuale. Gli stati non vengono mai modificati dopo la costruzione,
+    quindi la timeline può essere letta da più thread senza lock.
+    """
+    __slots__ = ('instants', 'states', 'end')
+
+    def __init__(self, instants, states, end):
+        self.instants = tuple(instants)  # inizio di ogni intervallo (epoch in secondi, ordinati)
+        self.states = tuple(states)  # stato degli edifici in ogni intervallo
+        self.end = end  # fine della giornata coperta dalla timeline
+
+    def interval_at(self, now):
+        """
+        Restituisce l'indice dell'intervallo che contiene 'now'. Gli istanti fuori dalla giornata
+        vengono assegnati al primo o all'ultimo intervallo.
+        """
+        return max(bisect_right(self.instants, now) - 1, 0)
+
+    def status_at(self, now):
+        return self.states[self.interval_at(now)]
+
+    def next_change(self, now):
+        """
+        Restituisce l'istante (epoch) in cui cambierà lo stato dopo 'now', oppure la fine della giornata.
+        """
+        i = self.interval_at(now) + 1
+        if i < len(self.instants):
+            return self.instants[i]
+        return self.end
+
+
+def room_transitions(index):
+    """
+    Restituisce gli istanti in cui può cambiare lo stato di un'aula: inizio e fine di ogni lezione
+    e il momento in cui mancano 30 minuti alla fine.
+    """
+    transitions = []
+    for start, end in zip(index.starts, index.ends):
+        transitions.append(start)
+        transitions.append(end)
+        transitions.append(end - AVAILABLE_SOON_SECONDS)
+    return transitions
@@ -1,266 +1,537 @@
-import re
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo  # Python 3.9+
 import io
+import sys
+import hashlib
+import logging
+import random
+import time
+from functools import lru_cache
+from types import MappingProxyType
 import requests
+from requests.adapters import HTTPAdapter
 import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import vercel_blob
+import metrics
+from geo import PoloLocator
+import occupancy
+from opening_hours import load_opening_hours
+from sites import CircuitBreaker, RateLimiter, load_sites
+from model import STATUS_FIELDS, Building, BuildingStatus, Lesson, RoomStatus, format_local_time, status_to_json
+from room_index import RoomIndex
+from timeline import DayTimeline, room_transitions
 from dotenv import load_dotenv
 
 
-files = {} # Contiene i calendari (scaricati all'avvio del backend)
-buildings_status =  {} # contiene lo stato degli edifici (aggiornato ogni volta che si chiama la funzione get_open_classrooms)
-usually_open_dict = {} # contiene le aule che sono di solito aperte (scaricato all'avvio del backend)
+log = logging.getLogger(__name__)
+
+polo_cache = {} # (polo, 'YYYY-MM-DD') -> hash, ETag/Last-Modified, lezioni e indice dell'ultimo calendario scaricato
+last_snapshots = {} # 'YYYY-MM-DD' -> (chiave dei contenuti, snapshot) dell'ultimo caricamento della giornata
+last_good = {} # polo -> voce di polo_cache dell'ultimo calendario scaricato con successo (anche di giornate precedenti)
+EMPTY_BUILDINGS_STATUS = () # stato restituito quando non c'è ancora una timeline
 pisa_timezone = ZoneInfo("Europe/Rome") 
 
-poli_calendar_ids = {
-            'poloA': '63247d96e3772a0690e3bcb4',
-            'poloB': '63247e36ac73c806bfa2dfc2',
-            'poloC': '63247e5ee3772a0690e3bd51',
-            'poloPN': '63247c2237746802ea1c1cae',
-            'poloF': '63247ea337746802ea1c1d4b',
-            'poloFibonacci': '63223a029f080a0aab032afc',
-            'poloBenedettine': '63247fadac73c806bfa2e09a',
-            'poloEconomia': '6501c7315640d3007d1012b9',
-            'poloPiagge': '631e682b617f10007c563735',
-            'poloCarmignani': '63247758e3772a0690e3b9f3',
-            'poloGuidotti': '64ff310b0c7dac007d24cdc3',
-            'poloNobili': '64ff316f3f77cd0078076002',
-            'poloP.Ricci': '64ff2e89dd600900782c3cc3',
-            'poloP.Boileau': '6501c860675557007eb417c0',
-            'poloS.Rossore': '63247d5f75616d04046a0779',
-            'poloSapienza' : '63247af9ac73c806bfa2def2',
-            'poloFarmacia' : '5dd7953c1c9f510011e17fbf'
-            }
-
-poli_coordinates = {
-            'poloA' : [10.389842986424895, 43.72105258709789],
-            'poloB' : [10.389289766627002, 43.72208800629937],
-            'poloC' : [10.38901079266688, 43.72140114553582],
-            'poloF' : [10.388287350482187, 43.72085438583843],
-            'poloPN': [10.391229871075552, 43.72584890979181],
-            'poloFibonacci': [10.408037918667361, 43.720879347333835],
-            'poloBenedettine': [10.39397528101884,43.71344829248517],
-            'poloEconomia': [10.410379473942072, 43.711018978876695],
-            'poloPiagge': [10.412023465973618, 43.710610273943814],
-            'poloCarmignani': [10.40094950738802, 43.72011831490275],
-            'poloGuidotti': [10.392386095658338, 43.71741398544361],
-            'poloNobili': [10.395924531247118, 43.71849818636451],
-            'poloP.Ricci': [10.396921563725783, 43.717686512092854],
-            'poloP.Boileau' : [10.397074275993532, 43.71998968935904],
-            'poloS.Rossore': [10.392641884389207, 43.717998675187204],
-            'poloSapienza' : [10.399496403929106, 43.717311583201365],
-            'poloFarmacia' : [10.3889513118217, 43.71661901268172]
-            }
+site_registry = load_sites() # poli, clienti Cineca e limiti dei download, da 'sites.json'
+poli_calendar_ids = site_registry.calendar_ids() # polo -> linkCalendarioId
+poli_coordinates = site_registry.coordinates() # polo -> [longitudine, latitudine]
+
+polo_locator = PoloLocator(poli_coordinates) # indice spaziale dei poli, per ordinare le aule libere per distanza
+opening_hours = load_opening_hours(pisa_timezone, poli=site_registry.hours()) # orari di apertura, da 'opening_hours.json' e dal registro
+
+# Metriche dell'aggiornamento dei calendari, esposte da /metrics. Le fasi di ogni polo sono 'filter_post'
+# (creaFiltroICal), 'ics_get' (impegniICal), 'parse' e 'index'; quelle dell'intero aggiornamento sono
+# 'aule_csv_download', 'timelines', 'occupancy', 'csv_upload' e 'total'. I tempi delle chiamate a Cineca includono
+# le attese del limite di richieste e i nuovi tentativi
+refresh_phase_seconds = metrics.refresh_registry.histogram(
+    'aulepi_refresh_phase_seconds', "Durata delle fasi dell'aggiornamento dei calendari", ['phase'])
+polo_phase_seconds = metrics.refresh_registry.histogram(
+    'aulepi_refresh_polo_phase_seconds', "Durata delle fasi dell'aggiornamento di ogni polo", ['polo', 'phase'])
+downloaded_bytes = metrics.refresh_registry.counter(
+    'aulepi_calendar_downloaded_bytes_total', "Bytes dei calendari .ics scaricati", ['polo'])
+lessons_parsed = metrics.refresh_registry.counter(
+    'aulepi_lessons_parsed_total', "Lezioni lette dai calendari .ics", ['polo'])
+cineca_failures = metrics.refresh_registry.counter(
+    'aulepi_cineca_failures_total', "Chiamate a Cineca fallite (errore di rete, 429 o 5xx), compresi i nuovi tentativi", ['host'])
+refreshes = metrics.refresh_registry.counter(
+    'aulepi_refreshes_total', "Aggiornamenti completati: 'new' se hanno prodotto un nuovo snapshot, altrimenti 'unchanged'", ['result'])
+stale_poli = metrics.refresh_registry.gauge(
+    'aulepi_stale_poli', "Poli serviti con l'ultimo calendario valido nell'ultimo aggiornamento")
+last_refresh = metrics.refresh_registry.gauge(
+    'aulepi_refresh_last_completed_timestamp_seconds', "Epoch del completamento dell'ultimo aggiornamento")
 
 # ----------------------------- VercelFS utility functions ------------------------------------------------- #
 
+blob_urls = {} # pathname -> url dei blob su VercelFS, così download e delete non devono elencare i blob ogni volta
+blob_hashes = {} # pathname -> sha256 dell'ultimo contenuto scaricato o caricato, per evitare upload inutili
+_blob_lock = threading.Lock()
+
+
 def list_all_blobs():
-    blobs = vercel_blob.list({
-        'limit': '5',
-    })
-    return blobs
+    """
+    Elenca tutti i blob su VercelFS, seguendo la paginazione.
+    """
+    blobs = []
+    cursor = None
+    while True:
+        options = {'limit': '1000'}
+        if cursor:
+            options['cursor'] = cursor
+        page = vercel_blob.list(options)
+        blobs.extend(page.get('blobs', []))
+        cursor = page.get('cursor')
+        if not page.get('hasMore') or not cursor:
+            return {'blobs': blobs}
+
+
+def refresh_blob_urls():
+    """
+    Ricostruisce l'indice pathname -> url a partire dall'elenco completo dei blob.
+    """
+    blobs = list_all_blobs()
+    with _blob_lock:
+        blob_urls.clear()
+        for blob in blobs['blobs']:
+            blob_urls[blob['pathname']] = blob['url']
+
+
+def get_blob_url(filename, refresh=False):
+    if refresh or filename not in blob_urls:
+        refresh_blob_urls()
+    return blob_urls.get(filename)
 
 
 def upload_a_blob(file_name, file_content):
-    file_content_bytes = file_content.encode('utf-8')  # Codifica la stringa in bytes
-    resp = vercel_blob.put(file_name, file_content_bytes, {
+    if isinstance(file_content, str):
+        file_content = file_content.encode('utf-8')  # Codifica la stringa in bytes
+    resp = vercel_blob.put(file_name, file_content, {
                 "addRandomSuffix": "false",
+                "cacheControlMaxAge": "60",  # il file viene sovrascritto ad ogni aggiornamento
             })
-    print("Vercel response : ",resp,"\n")
+    log.debug("Upload su VercelFS", extra={'blob': file_name, 'bytes': len(file_content), 'url': resp.get('url')})
+    with _blob_lock:
+        if resp.get('url'):
+            blob_urls[file_name] = resp['url']
+        blob_hashes[file_name] = hashlib.sha256(file_content).hexdigest()
+
+
+def upload_a_blob_if_changed(file_name, file_content):
+    """
+    Carica il file su VercelFS solo se il contenuto è diverso dall'ultimo scaricato o caricato.
+    Restituisce True se l'upload è stato fatto.
+    """
+    if isinstance(file_content, str):
+        file_content = file_content.encode('utf-8')
+    if blob_hashes.get(file_name) == hashlib.sha256(file_content).hexdigest():
+        log.debug("Blob invariato, upload non necessario", extra={'blob': file_name})
+        return False
+    upload_a_blob(file_name, file_content)
+    return True
+
+
+def download_blob_from_vercelFS(filename):
+    """
+    Scarica da VercelFS il contenuto (bytes) del file 'filename', oppure None se non esiste o il download fallisce.
+    L'url viene preso dall'indice 'blob_urls': l'elenco dei blob viene richiesto solo se l'url non è noto
+    o non è più valido.
+    """
+    url = get_blob_url(filename)
+    if url is None:
+        log.warning("File non trovato su VercelFS", extra={'blob': filename})
+        return
+    response = requests.get(url, timeout=CALENDAR_HTTP_TIMEOUT)
+    if response.status_code == 404:
+        # L'url memorizzato non è più valido (es. il blob è stato eliminato): ricostruisce l'indice e riprova
+        url = get_blob_url(filename, refresh=True)
+        if url is None:
+            log.warning("File non trovato su VercelFS", extra={'blob': filename})
+            return
+        response = requests.get(url, timeout=CALENDAR_HTTP_TIMEOUT)
+    if response.status_code != 200:
+        log.error("Errore nel download da VercelFS", extra={'blob': filename, 'status': response.status_code})
+        return
+    log.debug("File scaricato da VercelFS", extra={'blob': filename, 'bytes': len(response.content)})
+    with _blob_lock:
+        blob_hashes[filename] = hashlib.sha256(response.content).hexdigest()
+    return response.content
 
 
 def download_file_from_vercelFS(filename):
-    blobs = list_all_blobs()
-    for blob in blobs['blobs']:
-        if blob['pathname'] == filename:
-            response = requests.get(blob['url'])
-            if response.status_code == 200:
-                content = response.content.decode('utf-8')
-                print(f"{filename} caricato in memoria con successo.")
-                #print(content)
-                if content != None and content != "":
-                    return content
-            else:
-                print(f"Errore nel download di {filename}: {response.status_code}")
-                return
-    print(f"File {filename} non trovato su VercelFS.")
+    content = download_blob_from_vercelFS(filename)
+    if content != None and content != b"":
+        return content.decode('utf-8')
 
 
 def delete_blob_by_filename(filename):
     # Trova l'URL del blob utilizzando il nome del file
-    blobs = list_all_blobs()
-    for blob in blobs['blobs']:
-        if blob['pathname'] == filename:
-            # Elimina il blob se trovato
-            resp = vercel_blob.delete(blob['url'])
-            print(f"Eliminato {filename}: {resp}")
-    else:
-        print(f"File {filename} non trovato.")
+    url = get_blob_url(filename)
+    if url is None:
+        log.warning("File non trovato su VercelFS", extra={'blob': filename})
+        return
+    # Elimina il blob se trovato
+    vercel_blob.delete(url)
+    log.info("Blob eliminato da VercelFS", extra={'blob': filename})
+    with _blob_lock:
+        blob_urls.pop(filename, None)
+        blob_hashes.pop(filename, None)
 
 
 # ----------------------------- functions to interact with the university of Pisa APIs ------------------------------------------------- #
 
 
-def get_unipi_calendars():
-    global poli_calendar_ids
+CALENDAR_DAYS = 7 # giornate coperte da ogni caricamento dei calendari (la giornata richiesta e le 6 successive)
+# Timeout (connessione, lettura) in secondi per ogni chiamata a Cineca: una connessione bloccata non deve fermare l'aggiornamento
+CALENDAR_HTTP_TIMEOUT = (5, 30)
+CALENDAR_RETRIES = 2 # tentativi aggiuntivi per una chiamata fallita (errore di rete, 429 o 5xx)
+CALENDAR_RETRY_BACKOFF = 1 # secondi dell'attesa massima prima del primo nuovo tentativo, raddoppiata ad ogni tentativo
+CALENDAR_RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+# Durata massima dei download di un aggiornamento: i poli non ancora scaricati usano l'ultimo calendario valido
+CALENDAR_REFRESH_DEADLINE = 120
+
+# Una sessione HTTP e un limite di richieste al secondo per host Cineca (es. unipi e unich), così le connessioni
+# keep-alive vengono riutilizzate tra un polo e l'altro e nessun host riceve più richieste di quelle configurate
+_http_sessions = {}
+_rate_limiters = {}
+_circuit_breakers = {}
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(host):
+    with _http_sessions_lock:
+        session = _http_sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            pool_size = max((tenant.concurrency for tenant in site_registry.tenants.values() if tenant.host == host), default=1)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_sessions[host] = session
+        return session
+
+
+def get_rate_limiter(tenant):
+    with _http_sessions_lock:
+        limiter = _rate_limiters.get(tenant.host)
+        if limiter is None:
+            limiter = RateLimiter(tenant.requests_per_second, burst=tenant.concurrency)
+            _rate_limiters[tenant.host] = limiter
+        return limiter
+
+
+def get_circuit_breaker(tenant):
+    with _http_sessions_lock:
+        breaker = _circuit_breakers.get(tenant.host)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            _circuit_breakers[tenant.host] = breaker
+        return breaker
+
+
+def cineca_request(tenant, method, url, deadline, **kwargs):
+    """
+    Esegue una chiamata HTTP verso l'host del cliente Cineca rispettando il suo limite di richieste al secondo.
+    Gli errori di rete e le risposte 429/5xx vengono ritentati fino a CALENDAR_RETRIES volte, con un'attesa casuale
+    (jitter) che raddoppia ad ogni tentativo, ma solo se l'attesa finisce prima di 'deadline' (time.monotonic()).
+    Se l'interruttore dell'host è aperto la chiamata non viene fatta.
+    Restituisce l'ultima risposta ricevuta, oppure None se non è arrivata nessuna risposta.
+    """
+    session = get_http_session(tenant.host)
+    limiter = get_rate_limiter(tenant)
+    breaker = get_circuit_breaker(tenant)
+    response = None
+    for attempt in range(CALENDAR_RETRIES + 1):
+        if not breaker.allow():
+            log.warning("Troppi errori da Cineca: chiamata saltata", extra={'host': tenant.host})
+            return response
+        limiter.acquire()
+        try:
+            response = getattr(session, method)(url, timeout=CALENDAR_HTTP_TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            log.warning("Errore nella chiamata a Cineca", extra={'host': tenant.host, 'error': str(e), 'attempt': attempt})
+            response = None
+        if response is not None and response.status_code not in CALENDAR_RETRY_STATUS:
+            breaker.record_success()
+            return response
+        breaker.record_failure()
+        cineca_failures.inc(host=tenant.host)
+        delay = random.uniform(0, CALENDAR_RETRY_BACKOFF * 2 ** attempt)
+        if attempt == CALENDAR_RETRIES or time.monotonic() + delay >= deadline:
+            break
+        time.sleep(delay)
+    return response
+
+
+def download_polo_calendar(polo, today, cached=None, days=CALENDAR_DAYS, deadline=None):
+    """
+    Scarica il calendario .ics di un singolo polo per le 'days' giornate a partire da 'today':
+    POST a creaFiltroICal per ottenere l'id e GET di impegniICal.
+    Se 'cached' contiene l'ETag o il Last-Modified di un download precedente, la GET è condizionale.
+    Restituisce un dizionario con chiavi 'content', 'etag' e 'last_modified' ('content' è None se il file
+    non è cambiato, cioè la risposta è 304), oppure None in caso di errore.
+    Le chiamate vengono ritentate (vedi `cineca_request`) finché c'è tempo prima di 'deadline' (time.monotonic()).
+    """
+    if deadline is None:
+        deadline = time.monotonic() + CALENDAR_REFRESH_DEADLINE
+    # Host e clienteId dipendono dal cliente Cineca del polo (es. il polo Farmacia è gestito da unich)
+    site = site_registry.sites[polo]
+    cliente_id = site.tenant.cliente_id
 
     # url iniziale per ottenere id del calendario
-    url_filtro = "https://unipi.prod.up.cineca.it/api/FiltriICal/creaFiltroICal"
-    url_filtro_farmacia = "https://unich.prod.up.cineca.it/api/FiltriICal/creaFiltroICal"
-
+    url_filtro = f"{site.tenant.base_url}/api/FiltriICal/creaFiltroICal"
     # URL base per ottenere gli impegni, da concatenare con l'id ricevuto
-    base_url = "https://unipi.prod.up.cineca.it:443/api/FiltriICal/impegniICal?id="
-    base_url_farmacia = "https://unich.prod.up.cineca.it/api/FiltriICal/impegniICal?id="
-
-    
+    base_url = f"{site.tenant.base_url}/api/FiltriICal/impegniICal?id="
+
+    headers = {
+        "Content-Type": "application/json;charset=UTF-8",
+        "Accept": "application/json, text/plain, */*",
+    }
+
+    # Crea le date esatte come descritto
+    dataDa = (today - timedelta(days=1)).strftime("%Y-%m-%d") + "T22:00:00.000Z"
+    dataA = (today + timedelta(days=days)).strftime("%Y-%m-%d") + "T22:59:59.999Z"
+    dataScadenza = (today + timedelta(days=days)).strftime("%Y-%m-%d") + "T23:00:00.000Z"
+
+    # Payload per la richiesta
+    data = {
+        "clienteId": cliente_id,
+        "dataA": dataA,
+        "dataDa": dataDa,
+        "dataScadenza": dataScadenza,
+        "linkCalendarioId": site.calendar_id,
+    }
+
+    # Effettua la chiamata POST per ottenere l'ID
+    with polo_phase_seconds.time(polo=polo, phase='filter_post'):
+        response = cineca_request(site.tenant, 'post', url_filtro, deadline, headers=headers, json=data)
+    if response is None:
+        return None
+    if response.status_code != 200:
+        log.error("Errore nella creazione del filtro", extra={'polo': polo, 'status': response.status_code,
+                                                             'response': response.text[:200]})
+        return None
+
+    # Estrai l'ID dalla risposta e crea il link completo
+    id_impegni = response.json().get("id")
+    if not id_impegni:
+        log.error("Errore nella creazione del filtro: id mancante nella risposta", extra={'polo': polo})
+        return None
+    final_url = base_url + id_impegni
+
+    # Richiesta condizionale: se il calendario non è cambiato dall'ultimo download la risposta è un 304 senza contenuto
+    conditional_headers = {}
+    if cached is not None and cached.get('etag'):
+        conditional_headers['If-None-Match'] = cached['etag']
+    if cached is not None and cached.get('last_modified'):
+        conditional_headers['If-Modified-Since'] = cached['last_modified']
+
+    # Effettua la chiamata GET al link finale per scaricare il file
+    with polo_phase_seconds.time(polo=polo, phase='ics_get'):
+        response_impegni = cineca_request(site.tenant, 'get', final_url, deadline, headers=conditional_headers)
+    if response_impegni is None:
+        return None
+    if response_impegni.status_code == 304 and cached is not None:
+        return {'content': None, 'etag': cached.get('etag'), 'last_modified': cached.get('last_modified')}
+    if response_impegni.status_code != 200:
+        log.error("Errore nel download del calendario", extra={'polo': polo, 'status': response_impegni.status_code})
+        return None
+
+    return {
+        'content': response_impegni.text,
+        'etag': response_impegni.headers.get('ETag'),
+        'last_modified': response_impegni.headers.get('Last-Modified'),
+    }
+
+
+def fetch_order():
+    """
+    Restituisce i poli del registro nell'ordine in cui scaricarli: prima quelli con priorità più alta e,
+    a parità di priorità, quelli con più lezioni nell'ultimo calendario scaricato, così i poli più frequentati
+    vengono aggiornati per primi.
+    """
+    lessons = {}
+    for (polo, _), cached in sorted(polo_cache.items()):
+        lessons[polo] = len(cached['lessons'])
+    return sorted(site_registry.sites.values(), key=lambda site: (-site.priority, -lessons.get(site.name, 0)))
 
-    for polo in poli_calendar_ids:
-        # Esegui la prima richiesta per ottenere l'ID
-        headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json, text/plain, */*",
-        }
 
-       
-        # Ottieni la data di oggi in formato UTC
+def get_unipi_calendars(today=None, days=CALENDAR_DAYS):
+    """
+    Scarica in parallelo i calendari di tutti i poli del registro per le 'days' giornate a partire da 'today'.
+    Ogni cliente Cineca ha il proprio pool di thread (al massimo 'concurrency' download alla volta) e il proprio
+    limite di richieste al secondo, così un host lento non rallenta gli altri e i poli si aggiungono senza
+    allungare l'aggiornamento oltre i limiti configurati. I poli vengono accodati nell'ordine di `fetch_order`.
+    È un generatore: restituisce le coppie (polo, download) man mano che i download terminano,
+    così il chiamante può iniziare il parsing di un polo senza aspettare gli altri.
+    'download' è il dizionario restituito da `download_polo_calendar` (con 'content' None se il calendario
+    non è cambiato rispetto a quello in `polo_cache`); i poli il cui download fallisce non vengono restituiti.
+    """
+    if today is None:
+        # Ottieni la data di oggi
         today = datetime.now(pisa_timezone).date()
+    today_str = today.strftime("%Y-%m-%d")
+
+    deadline = time.monotonic() + CALENDAR_REFRESH_DEADLINE
+    executors = {name: ThreadPoolExecutor(max_workers=tenant.concurrency, thread_name_prefix=f"cineca-{name}")
+                 for name, tenant in site_registry.tenants.items()}
+    try:
+        futures = {}
+        for site in fetch_order():
+            cached = polo_cache.get((site.name, today_str))
+            future = executors[site.tenant.name].submit(download_polo_calendar, site.name, today, cached, days, deadline)
+            futures[future] = site.name
+        for future in as_completed_until(futures, deadline):
+            polo = futures[future]
+            try:
+                download = future.result()
+            except requests.RequestException as e:
+                log.error("Errore nel download del calendario", extra={'polo': polo, 'error': str(e)})
+                continue
+            if download is None:
+                continue
+            yield polo, download
+    finally:
+        # i download ancora in corso dopo la scadenza non vengono aspettati (finiscono al più al loro timeout)
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def as_completed_until(futures, deadline):
+    """
+    Come `as_completed`, ma smette di restituire i download completati allo scadere di 'deadline' (time.monotonic()).
+    """
+    try:
+        yield from as_completed(futures, timeout=max(deadline - time.monotonic(), 0))
+    except FuturesTimeoutError:
+        pending = sorted(polo for future, polo in futures.items() if not future.done())
+        log.warning("Tempo massimo dell'aggiornamento scaduto", extra={'pending': ",".join(pending)})
+
 
-        # Crea le date esatte come descritto
-        dataDa = (today - timedelta(days=1)).strftime("%Y-%m-%d") + "T22:00:00.000Z"
-        dataA = (today + timedelta(days=1)).strftime("%Y-%m-%d") + "T22:59:59.999Z"
-        dataScadenza = (today + timedelta(days=1)).strftime("%Y-%m-%d") + "T23:00:00.000Z"
-
-        # Payload per la richiesta
-
-        if polo == 'poloFarmacia':
-            data = {
-            "clienteId": "5a65a9ebd9fe4f6d0ccf9df6",
-            "dataA": dataA,
-            "dataDa": dataDa,
-            "dataScadenza": dataScadenza,
-            "linkCalendarioId": poli_calendar_ids[polo],
-            }
-        else:
-            data = {
-            "clienteId": "628de8b9b63679f193b87046",
-            "dataA": dataA,
-            "dataDa": dataDa,
-            "dataScadenza": dataScadenza,
-            "linkCalendarioId": poli_calendar_ids[polo],
-            }
-            
-
-        # Effettua la chiamata POST per ottenere l'ID
-        url_id = url_filtro_farmacia if polo == 'poloFarmacia' else url_filtro
-        response = requests.post(url_id, headers=headers, json=data)
-        
-
-        if response.status_code == 200:
-            # Estrai l'ID dalla risposta
-            id_impegni = response.json().get("id")
-            
-            # Crea il link completo concatenando l'ID
-            if polo == 'poloFarmacia':
-                final_url = base_url_farmacia + id_impegni
-            else:
-                final_url = base_url + id_impegni
-
-            # Effettua la chiamata GET al link finale per scaricare il file
-            response_impegni = requests.get(final_url, stream=True)
-            
-            if response_impegni.status_code == 200:
-                # Aggiungi il file alla variabile globale
-                today = datetime.now(pisa_timezone).date()
-                # Converti today to string
-                today_str = today.strftime("%Y-%m-%d")
-                file_name = f"calendario_{polo}_{today_str}.ics"
-                file_content = response_impegni.text
-                # aggiungi il file e il suo contenuto alla variabile globale 
-                files[file_name] = file_content
-            else:
-                print(f"Errore nel download del calendario per il polo "+polo+": {response_impegni.status_code}")
-        else:
-            print(f"Errore nella creazione del filtro: {response.status_code}")
-            print(response.text)
 
+# Proprietà del VEVENT che ci interessano, tutte le altre vengono ignorate durante la lettura
+ICS_EVENT_FIELDS = frozenset(['DTSTART', 'DTEND', 'SUMMARY', 'DESCRIPTION', 'LOCATION'])
 
 
-def parse_ics(ics_file):
-    # rimuovi dal file tutti i caratteri '\n ' (newline e spazio) ma SOLO SE ADIACENTI
-    ics_file = re.sub(r'\n ', '', ics_file)
-    # sostituisci \u00c3\u00a0 con à
-    ics_file = ics_file.replace("\u00c3\u00a0", "à")
+def ics_utc_window(day, days=1):
+    """
+    Restituisce gli estremi [inizio, fine) delle 'days' giornate a partire da 'day' (ora di Pisa) come stringhe UTC
+    nel formato dei timestamp .ics ('YYYYMMDDTHHMMSS'), così il filtro sulla data è un semplice confronto tra stringhe.
+    """
+    start = datetime.combine(day, datetime.min.time(), tzinfo=pisa_timezone)
+    end = datetime.combine(day + timedelta(days=days), datetime.min.time(), tzinfo=pisa_timezone)
+    return (start.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%S"),
+            end.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%S"))
+
+
+def parse_ics(ics_file, day=None, days=1):
+    """
+    Parser in streaming dei VEVENT di un file .ics: legge le righe una alla volta, riunisce al volo le righe
+    'piegate' e raccoglie tutte le proprietà in un solo passaggio. Appena il DTSTART di un evento cade fuori
+    dalle 'days' giornate richieste (a partire da 'day'), il resto dell'evento viene saltato senza ulteriori elaborazioni.
+    'ics_file' può essere il contenuto del file come stringa oppure un iterabile di righe.
+    """
+    if day is None:
+        # Ottieni la data odierna
+        day = datetime.now(pisa_timezone).date()
+    window_start, window_end = ics_utc_window(day, days)
 
-    events = ics_file.split("BEGIN:VEVENT")
+    lines = io.StringIO(ics_file) if isinstance(ics_file, str) else ics_file
     parsed_events = []
-    
-    # Ottieni la data odierna nel formato 'YYYY-MM-DD'
-    today = datetime.now(pisa_timezone).date()
-    for event in events[1:]:
-        # Trova la descrizione, se esiste
-        description_match = re.search(r'DESCRIPTION:(.*?)\n', event)
-        description = description_match.group(1) if description_match else "No description"
-        # taglia via tutto ciò che segue "nNOTE" dalla descrizione
-        description = description.split("\nNOTE")[0]
-        # rimuove tutte le '\r' dalla descrizione
-        description = description.replace("\r", "")
-        
-        # Trova l'inizio, se esiste
-        dtstart_match = re.search(r'DTSTART:(.*?)\n', event)
-        dtstart = dtstart_match.group(1) if dtstart_match else "No start time"
-        dtstart = parse_and_adjust_time(dtstart)
-
-        # Confronta la data di inizio con la data odierna
-        event_date = dtstart.split(" ")[0]  # Ottieni solo la data
-        if event_date != str(today):
-            continue  # Salta questo evento se non è oggi
-        
-        # Trova la fine, se esiste
-        dtend_match = re.search(r'DTEND:(.*?)\n', event)
-        dtend = dtend_match.group(1) if dtend_match else "No end time"
-        dtend = parse_and_adjust_time(dtend)
-
-        # Trova il titolo, se esiste
-        summary_match = re.search(r'SUMMARY:(.*?)\n', event)
-        summary = summary_match.group(1) if summary_match else "No summary"
-        # if 'no description', metto il summary nella description ma solo se il summary è più corto di 30 caratteri
-        if description == "No description" and len(summary) < 20:
-            description = summary
-        
-        # Trova la location, se esiste
-        location_match = re.search(r'LOCATION:(.*?)\n', event)
-        location = location_match.group(1) if location_match else "No location"
-        if location == "No location":
+
+    in_event = False  # siamo dentro un BEGIN:VEVENT ... END:VEVENT
+    skip_event = False  # il DTSTART dell'evento corrente non è nella giornata richiesta
+    properties = {}
+    current_name = None  # proprietà in lettura, che potrebbe continuare sulle righe successive
+    current_parts = None
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+
+        # Una riga che inizia con spazio o tab continua la riga precedente
+        if line[:1] in (" ", "\t"):
+            if current_parts is not None:
+                current_parts.append(line[1:])
             continue
-        aula = location.split("-")[0]  # Ottieni solo l'aula
-        polo = location.split("-")[1]  # Ottieni solo il polo
-        aula = aula.replace(" ", "")
-        # Aggiunge l'evento parsato alla lista
-        parsed_events.append({
-            'professor': description,
-            'start': dtstart,
-            'end': dtend,
-            'location': aula
-        })
-    
+
+        # Inizia una nuova riga logica: chiude la proprietà precedente
+        if current_parts is not None:
+            value = "".join(current_parts)
+            properties[current_name] = value
+            current_parts = None
+            if current_name == 'DTSTART' and not (window_start <= value[:15] < window_end):
+                skip_event = True  # Salta questo evento se non è nelle giornate richieste
+
+        if not in_event:
+            if line == "BEGIN:VEVENT":
+                in_event = True
+                skip_event = False
+                properties = {}
+            continue
+
+        if line == "END:VEVENT":
+            in_event = False
+            if not skip_event:
+                event = build_event(properties)
+                if event is not None:
+                    parsed_events.append(event)
+            continue
+
+        if skip_event:
+            continue
+
+        name, _, value = line.partition(":")
+        name = name.split(";", 1)[0]  # ignora eventuali parametri (es. DESCRIPTION;LANGUAGE=it)
+        if name in ICS_EVENT_FIELDS:
+            current_name = name
+            current_parts = [value]
+
     return parsed_events
 
 
-def parse_aule_csv(content):
+def build_event(properties):
+    """
+    Costruisce la lezione (model.Lesson) a partire dalle proprietà di un VEVENT già filtrato per data.
+    Restituisce None se l'evento non ha una location o un orario valido.
+    """
+    # Trova la location, se esiste
+    location = properties.get('LOCATION')
+    if not location:
+        return None
+
+    # Trova l'inizio e la fine (gli eventi di un giorno intero, senza orario, vengono ignorati)
+    dtstart = properties.get('DTSTART', "")
+    dtend = properties.get('DTEND', "")
+    if len(dtstart) < 15 or len(dtend) < 15:
+        return None
+
+    # Trova la descrizione, se esiste, e sostituisci \u00c3\u00a0 con à
+    description = properties.get('DESCRIPTION', "No description").replace("\u00c3\u00a0", "à")
+    # Trova il titolo, se esiste
+    summary = properties.get('SUMMARY', "No summary").replace("\u00c3\u00a0", "à")
+    # if 'no description', metto il summary nella description ma solo se il summary è più corto di 20 caratteri
+    if description == "No description" and len(summary) < 20:
+        description = summary
+
+    aula = location.replace("\u00c3\u00a0", "à").split("-")[0]  # Ottieni solo l'aula
+    aula = aula.replace(" ", "")
+
+    # Il polo viene assegnato dal chiamante, che sa da quale calendario arriva l'evento
+    return Lesson(None, sys.intern(aula), ics_timestamp_to_epoch(dtstart[:15]), ics_timestamp_to_epoch(dtend[:15]), description)
+
+
+def parse_aule_csv(content, buildings, usually_open_dict):
     """
-    Costruisce la variabile globale 'buildings_status' e 'usually_open_dict'  a partire dal contenuto del file 'aule.csv' scaricato da VercelFS.
+    Riempie i dizionari 'buildings' (polo -> Building) e 'usually_open_dict' a partire dal contenuto del file 'aule.csv' scaricato da VercelFS.
     """
-    global buildings_status
     global poli_coordinates
-    global usually_open_dict
     
     f = io.StringIO(content)  # Per trattare la stringa come se fosse un file
     reader = csv.reader(f)
     next(reader)  # Salta l'intestazione
     for row in reader:
-        polo = row[0]
-        location = row[1]
+        polo = sys.intern(row[0])
+        location = sys.intern(row[1])
         usually_open = row[2] == "True"  # Converte la stringa in booleano
 
         # Aggiungi il polo e l'aula nella struttura 'usually_open_dict'
@@ -270,258 +541,443 @@ def parse_aule_csv(content):
             usually_open_dict[polo][location] = {}
         usually_open_dict[polo][location]['usually_open'] = usually_open
 
-        if polo not in buildings_status:
-            buildings_status[polo] = {}
-            # Aggiungi le coordinate del polo
-            buildings_status[polo]['coordinates'] = poli_coordinates[polo]
-            # Aggiungi la chiave 'free' e 'availableSoon' per il polo
-            buildings_status[polo]['free'] = False
-            buildings_status[polo]['buildingAvailableSoon'] = False
-        
-        # Crea la struttura per l'aula nel polo
-        buildings_status[polo][location] = {
-            'lessons': [],
-            'free': usually_open
-        }
+        if polo not in buildings:
+            buildings[polo] = Building(polo, poli_coordinates[polo])
+        # Aggiungi l'aula al polo
+        buildings[polo].rooms[location] = usually_open
 
     f.close()
 
 
 
-def parse_and_adjust_time(dt):
-    # Trasforma il formato della stringa
-    dt = f"{dt[:4]}-{dt[4:6]}-{dt[6:8]} {dt[9:11]}:{dt[11:13]}:{dt[13:15]}"
-    # Parsing della stringa in datetime con timezone UTC
-    dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-    # Conversione in ora locale (Europa/Roma)
-    dt = dt.astimezone(pisa_timezone)
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
-
-
-def load_calendars_and_parse():
-    global poli_calendar_ids
-    global poli_coordinates
+@lru_cache(maxsize=4096)
+def ics_timestamp_to_epoch(dt):
+    """
+    Converte un timestamp UTC del file .ics ('YYYYMMDDTHHMMSS') in epoch (secondi).
+    """
+    return int(datetime(int(dt[:4]), int(dt[4:6]), int(dt[6:8]), int(dt[9:11]), int(dt[11:13]), int(dt[13:15]), tzinfo=timezone.utc).timestamp())
 
-    # se poli_calendar_ids non ha lo stesso numero di elementi di poli_coordinates, esce
-    if len(poli_calendar_ids) != len(poli_coordinates):
-        print("Errore: poli_calendar_ids e poli_coordinates non hanno lo stesso numero di elementi.")
-        return
 
-    get_unipi_calendars()
-    all_lessons = []  # Lista per accumulare tutte le lezioni    
-    # Itera sui nomi dei file .ics dalla variabile globale
-    for filename in files:
+def load_calendars_and_parse(day=None, days=CALENDAR_DAYS):
+    """
+    Scarica e analizza i calendari delle 'days' giornate a partire da 'day' (di default oggi) e costruisce
+    la timeline dello stato degli edifici di ognuna.
+    Restituisce il nuovo snapshot dei calendari, un dizionario con chiavi 'date', 'lessons', 'buildings' (polo -> Building),
+    'rooms_index', 'usually_open', 'timeline' (giornata 'day'), 'timelines' ('YYYY-MM-DD' -> timeline),
+    'occupancy' ('YYYY-MM-DD' -> matrice di occupazione delle aule), 'stale'
+    (poli serviti con l'ultimo calendario valido perché il download non è riuscito) e 'id'
+    (identificativo dei contenuti, usato per le versioni dello stato),
+    senza toccare quello attualmente servito: sta al chiamante pubblicarlo. Lo snapshot è in sola lettura (vedi `make_snapshot`).
+    """
+    if day is None:
+        day = datetime.now(pisa_timezone).date()
+
+    started = time.perf_counter()
+    day_str = day.strftime("%Y-%m-%d")
+    evict_old_calendars(day)
+
+    # Itera sui calendari man mano che vengono scaricati: il parsing di un polo parte appena il suo .ics è arrivato.
+    # Un polo il cui contenuto non è cambiato dall'ultimo aggiornamento riusa lezioni e indice già calcolati
+    fetched = set()
+    for polo, download in get_unipi_calendars(day, days):
+        fetched.add(polo)
+        cached = polo_cache.get((polo, day_str))
+        if download['content'] is None:
+            cached.update(etag=download['etag'], last_modified=download['last_modified'], fetched_at=time.time())
+            last_good[polo] = cached
+            continue
+        content = download['content'].encode('utf-8')
+        downloaded_bytes.inc(len(content), polo=polo)
+        content_hash = hashlib.sha256(content).hexdigest()
+        if cached is not None and cached['hash'] == content_hash:
+            cached.update(etag=download['etag'], last_modified=download['last_modified'], fetched_at=time.time())
+            last_good[polo] = cached
+            continue
 
-        # Ottengo il polo attuale dal filename
-        polo = filename.split('_')[1]  # Estrai il polo dal nome del file
         # Parsare gli eventi
-        lessons = parse_ics(files[filename])
-        
+        with polo_phase_seconds.time(polo=polo, phase='parse'):
+            lessons = parse_ics(download['content'], day, days)
+        lessons_parsed.inc(len(lessons), polo=polo)
         # Aggiungi ad ogni lesson il polo
         for lesson in lessons:
-            lesson['polo'] = polo
-
-        # Aggiungi le lezioni del file corrente alla lista totale
-        all_lessons.extend(lessons)
-    print("Calendari caricati con successo.")
+            lesson.polo = polo
+        with polo_phase_seconds.time(polo=polo, phase='index'):
+            rooms_index = build_rooms_index(lessons)
+        polo_cache[(polo, day_str)] = {
+            'hash': content_hash,
+            'etag': download['etag'],
+            'last_modified': download['last_modified'],
+            'lessons': lessons,
+            'rooms_index': rooms_index,
+            'fetched_at': time.time(),
+        }
+        log.debug("Calendario analizzato", extra={'polo': polo, 'bytes': len(content), 'lessons': len(lessons)})
+        last_good[polo] = polo_cache[(polo, day_str)]
+
+    # I poli non scaricati (errore, interruttore aperto o tempo scaduto) continuano a usare l'ultimo calendario valido,
+    # anche se di una giornata precedente: copre più giornate, quindi contiene ancora le lezioni di oggi.
+    # Questi poli sono segnalati nello snapshot come 'stale', con l'ora dell'ultimo download riuscito
+    for polo, cached in last_good.items():
+        if polo not in fetched and (polo, day_str) not in polo_cache:
+            polo_cache[(polo, day_str)] = cached
+    stale = {polo: polo_cache[(polo, day_str)]['fetched_at'] for polo in site_registry.sites
+             if polo not in fetched and (polo, day_str) in polo_cache}
+    stale_poli.set(len(stale))
+    if stale:
+        log.warning("Calendari non aggiornati, uso l'ultima versione valida", extra={'stale': ",".join(sorted(stale))})
+    log.info("Calendari caricati", extra={'day': day_str, 'fetched': len(fetched), 'stale': len(stale)})
     load_dotenv()
-    aule_csv_content = download_file_from_vercelFS("aule.csv")
-    if aule_csv_content != None and aule_csv_content != "":
-        parse_aule_csv(aule_csv_content)
-            
-    initialize_buildings_status(all_lessons)
-    buildings_to_csv()
-    
-    return all_lessons  # Restituisci tutte le lezioni accumulate
+    with refresh_phase_seconds.time(phase='aule_csv_download'):
+        aule_csv_content = download_file_from_vercelFS("aule.csv") or ""
+
+    # Se né i calendari né 'aule.csv' sono cambiati dall'ultimo caricamento, lo snapshot precedente è ancora valido
+    # (i poli il cui download è fallito usano l'ultima versione scaricata in giornata)
+    poli_cached = sorted(polo for polo, cached_day in polo_cache if cached_day == day_str)
+    snapshot_key = (tuple((polo, polo_cache[(polo, day_str)]['hash']) for polo in poli_cached),
+                    hashlib.sha256(aule_csv_content.encode('utf-8')).hexdigest(), tuple(sorted(stale)))
+    previous = last_snapshots.get(day_str)
+    if previous is not None and previous[0] == snapshot_key:
+        log.info("Calendari invariati, riuso lo snapshot precedente", extra={'day': day_str})
+        refresh_completed('unchanged', started)
+        return previous[1]
+
+    # Strutture del nuovo snapshot: vengono costruite da zero, lo snapshot servito non viene toccato
+    all_lessons = []  # Lista per accumulare tutte le lezioni
+    buildings = {}
+    usually_open = {}
+    index = {}
+    if aule_csv_content != "":
+        parse_aule_csv(aule_csv_content, buildings, usually_open)
+    for polo in poli_cached:
+        cached = polo_cache[(polo, day_str)]
+        all_lessons.extend(cached['lessons'])
+        index.update(cached['rooms_index'])
+
+    initialize_buildings_status(index, buildings)
+    with refresh_phase_seconds.time(phase='timelines'):
+        timelines = build_timelines(day, days, buildings, index)
+    with refresh_phase_seconds.time(phase='occupancy'):
+        occupancies = build_occupancies(day, days, buildings, index)
+
+    # L'id dipende solo dai contenuti: tutti i processi che caricano o leggono lo stesso snapshot lo vedono uguale
+    snapshot_id = hashlib.sha256(repr((day_str, snapshot_key)).encode('utf-8')).hexdigest()[:12]
+    snapshot = make_snapshot(snapshot_id, day_str, all_lessons, buildings, index, usually_open, timelines, stale,
+                             occupancies)
+    last_snapshots[day_str] = (snapshot_key, snapshot)
+    refresh_completed('new', started)
+    return snapshot
+
+
+def refresh_completed(result, started):
+    """
+    Registra nelle metriche la fine di un aggiornamento iniziato all'istante 'started' (time.perf_counter()).
+    """
+    refresh_phase_seconds.observe(time.perf_counter() - started, phase='total')
+    refreshes.inc(result=result)
+    last_refresh.set(time.time())
 
 
-def initialize_buildings_status(lessons):
+def evict_old_calendars(day):
     """
-    Aggiorna la variabile globale `buildings_status` con lo stato attuale degli edifici.
+    Rimuove dalle cache i calendari delle giornate precedenti a 'day'.
     """
-    global poli_coordinates
-    global buildings_status
+    day_str = day.strftime("%Y-%m-%d")
+    for key in [key for key in polo_cache if key[1] < day_str]:
+        del polo_cache[key]
+    for key in [key for key in last_snapshots if key < day_str]:
+        del last_snapshots[key]
 
 
-    now = datetime.now(pisa_timezone)
-    
-    # Itera su tutte le lezioni
-    for lesson in lessons:
-        polo = lesson['polo']
-        if is_building_closed(polo, now):
-            print("Skipped lesson in closed building: ", lesson)
-            continue
-        location = lesson['location']
-        start_time = datetime.strptime(lesson['start'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pisa_timezone)
-        end_time = datetime.strptime(lesson['end'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pisa_timezone)
+def freeze(mapping):
+    """
+    Restituisce una vista in sola lettura di un dizionario (e dei dizionari annidati).
+    """
+    return MappingProxyType({key: freeze(value) if isinstance(value, dict) else value for key, value in mapping.items()})
 
-        # Crea la struttura per il polo se non esiste già
-        if polo not in buildings_status:
-            buildings_status[polo] = {}
-            # aggiungi le coordinate del polo
-            buildings_status[polo]['coordinates'] = poli_coordinates[polo]
-            buildings_status[polo]['buildingAvailableSoon'] = False
 
-            
-        # Crea la struttura per l'aula se non esiste già
-        if location not in buildings_status[polo]:
-            buildings_status[polo][location] = {
-                'lessons': [],  # Lezioni future o in corso
-                'free': True,    # Presume l'aula libera fino a prova contraria
-                'roomAvailableSoon': False  # Presume l'aula non disponibile a breve fino a prova contraria
-            }
-        
-        # Confronta l'orario per selezionare lezioni future o in corso oggi
-        if start_time.date() == now.date() and end_time > now:
-            if lesson['professor'] != "No description" and len(lesson['professor']) > 0:
-                # rimuovi '\nNOTE:' e tutto ciò che segue da 'lesson['professor']
-                lesson['professor'] = lesson['professor'].split("\\nNOTE")[0]
-                # rimuovi tutte le '\' da 'lesson['professor']
-                lesson['professor'] = lesson['professor'].replace("\\", "")
-                lesson['professor'] = lesson['professor'].replace(" \\(.*?\\)", "")
-                # Divide i nomi separati da virgola
-                cleaned_professors_list = lesson['professor'].split(",")
-            
-                # Rimuove caratteri indesiderati e formatta i nomi
-                cleaned_professors_list = [
-                    prof.strip().split(".")[-1].strip() if "." in prof else " ".join(prof.split()[:-1])
-                    for prof in cleaned_professors_list
-                ]
-
-                # Unisce i nomi dei professori
-                cleaned_professors = ", ".join(cleaned_professors_list)
-            
-                # Limita a 70 caratteri
-                if len(cleaned_professors) <= 70:
-                    lesson['professor'] = cleaned_professors
-                    # mette tutti i nomi in uppercase
-                    lesson['professor'] = lesson['professor'].upper()
-                else:
-                    lesson['professor'] = 'No description'
-            else:
-                lesson['professor'] = 'No description'
+def make_snapshot(snapshot_id, day_str, lessons, buildings, rooms_index, usually_open, timelines, stale=None,
+                  occupancies=None):
+    """
+    Crea lo snapshot dei calendari in sola lettura. Una volta pubblicato viene condiviso da tutti i thread
+    che servono le richieste, quindi non deve più essere modificato: ogni aggiornamento costruisce
+    un nuovo snapshot e lo pubblica sostituendo il riferimento.
+    'stale' (polo -> epoch dell'ultimo download riuscito) contiene i poli serviti con un calendario non aggiornato,
+    'occupancies' ('YYYY-MM-DD' -> occupancy.OccupancyMatrix) l'occupazione delle aule a slot di 5 minuti.
+    """
+    for building in buildings.values():
+        building.rooms = MappingProxyType(building.rooms)
+    return MappingProxyType({
+        'id': snapshot_id,
+        'date': day_str,
+        'lessons': tuple(lessons),
+        'buildings': MappingProxyType(buildings),
+        'rooms_index': MappingProxyType(rooms_index),
+        'usually_open': freeze(usually_open),
+        'timeline': timelines[day_str],
+        'timelines': MappingProxyType(timelines),
+        'stale': freeze(stale or {}),
+        'occupancy': MappingProxyType(occupancies or {}),
+    })
 
-            buildings_status[polo][location]['lessons'].append({
-                'professor': lesson['professor'],
-                'start': start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'end': end_time.strftime('%Y-%m-%d %H:%M:%S'),
-            })
-            
-            
-            # Se c'è una lezione in corso al momento, l'aula non è libera
-            if start_time <= now <= end_time:
-                buildings_status[polo][location]['free'] = False
-
-            # Se la lezione finisce entro 30 minuti, setto il campo 'availableSoon' a True. Come ne trovo una significa che anche il polo è disponibile a breve
-            if end_time - now <= timedelta(minutes=30):
-                buildings_status[polo][location]['roomAvailableSoon'] = True
-                buildings_status[polo]['buildingAvailableSoon'] = True
-    
-    for polo in buildings_status:
-        if is_building_closed(polo, now):
-            buildings_status[polo]['isClosed'] = True
-            buildings_status[polo]['free'] = False
-            buildings_status[polo]['buildingAvailableSoon'] = False
+
+@lru_cache(maxsize=4096)
+def clean_professors(description):
+    """
+    Estrae dalla descrizione della lezione i cognomi dei docenti, in maiuscolo e separati da virgola.
+    Restituisce 'No description' se la descrizione è vuota o il risultato supera i 70 caratteri.
+    """
+    if description == "No description" or len(description) == 0:
+        return 'No description'
+
+    # rimuovi '\nNOTE:' e tutto ciò che segue dalla descrizione
+    description = description.split("\\nNOTE")[0]
+    # rimuovi tutte le '\' dalla descrizione
+    description = description.replace("\\", "")
+    description = description.replace(" \\(.*?\\)", "")
+    # Divide i nomi separati da virgola
+    cleaned_professors_list = description.split(",")
+
+    # Rimuove caratteri indesiderati e formatta i nomi
+    cleaned_professors_list = [
+        prof.strip().split(".")[-1].strip() if "." in prof else " ".join(prof.split()[:-1])
+        for prof in cleaned_professors_list
+    ]
+
+    # Unisce i nomi dei professori
+    cleaned_professors = ", ".join(cleaned_professors_list)
+
+    # Limita a 70 caratteri e mette tutti i nomi in uppercase
+    if len(cleaned_professors) <= 70:
+        return cleaned_professors.upper()
+    return 'No description'
+
+
+def build_rooms_index(lessons):
+    """
+    Costruisce l'indice delle lezioni di ogni aula, (polo, location) -> RoomIndex.
+    Le lezioni che iniziano quando il polo è chiuso vengono scartate (il controllo usa l'orario di inizio
+    della lezione, non quello dell'aggiornamento, perché l'indice copre l'intera giornata).
+    """
+    # Raggruppa le lezioni per aula: (polo, location) -> [Lesson]
+    lessons_by_room = {}
+    for lesson in lessons:
+        polo = lesson.polo
+        # Le lezioni che iniziano quando il polo è chiuso non rendono l'aula occupata
+        if not opening_hours.is_open(polo, lesson.start):
+            log.debug("Lezione scartata: polo chiuso", extra={'polo': polo, 'room': lesson.room, 'start': lesson.start})
             continue
-        else:
-            buildings_status[polo]['isClosed'] = False
-            buildings_status[polo]['free'] = False
-            buildings_status[polo]['buildingAvailableSoon'] = False
 
-        # Imposta inizialmente il polo come non libero e non disponibile a breve
-        is_building_free = False
-        for location in buildings_status[polo]:
-            if location not in ['coordinates', 'buildingAvailableSoon', 'free', 'isClosed']:
-                if buildings_status[polo][location]['free'] == True:
-                    is_building_free = True
-                    break
-        
-        buildings_status[polo]['free'] = is_building_free
+        lessons_by_room.setdefault((polo, lesson.room), []).append(
+            Lesson(polo, lesson.room, lesson.start, lesson.end, clean_professors(lesson.professor)))
 
-    return buildings_status
+    return {room: RoomIndex(room_lessons) for room, room_lessons in lessons_by_room.items()}
 
 
+def initialize_buildings_status(rooms_index, buildings):
+    """
+    Aggiunge a `buildings` i poli e le aule che compaiono nell'indice delle lezioni.
+    Le aule che non sono in 'aule.csv' non sono usually_open.
+    """
+    global poli_coordinates
 
-# Funzione per controllare se una location è "usually_open"
-def is_usually_open(polo, location):
-    global usually_open_dict
-    return usually_open_dict.get(polo, {}).get(location, {}).get('usually_open', False)
+    for polo, location in rooms_index:
+        # Crea la struttura per il polo se non esiste già
+        if polo not in buildings:
+            buildings[polo] = Building(polo, poli_coordinates[polo])
+        # Crea la struttura per l'aula se non esiste già
+        buildings[polo].rooms.setdefault(location, False)
 
 
-def get_buildings_status():
+def compute_buildings_status(now, buildings, rooms_index, previous=None, until=None):
     """
-    Aggiorna e restituisce lo stato attuale degli edifici.
+    Calcola lo stato degli edifici all'istante 'now' (epoch in secondi) usando l'indice delle lezioni di ogni aula.
+    Le lezioni rimanenti di ogni aula sono solo quelle che iniziano prima di 'until' (la fine della giornata).
+    Restituisce una tupla di BuildingStatus, uno per polo nell'ordine di 'buildings': le aule e i poli il cui stato
+    coincide con quello in 'previous' vengono riutilizzati, così stati consecutivi della timeline condividono
+    tutto ciò che non è cambiato.
     """
-    global buildings_status
-    # scorre buildings_status e rimuove le lezioni che sono terminate. Setta:
+    # per ogni aula calcola:
+    # - la lista delle lezioni non ancora terminate
     # - il campo free della location a True se non ci sono lezioni in corso in questo momento
-    # - il campo free del polo a True se c'è almeno una location libera
     # - il campo roomAvailableSoon della location a True se la location sarà libera entro 30 minuti
+    # e per ogni polo:
+    # - il campo free del polo a True se c'è almeno una location libera
     # - il campo buildingAvailableSoon del polo a True se c'è almeno una location che sarà libera entro 30 minuti
-    now = datetime.now(pisa_timezone)
-    for polo in buildings_status:
-        for location in buildings_status[polo]:
-            if location not in ['coordinates', 'buildingAvailableSoon', 'free', 'isClosed']:
-                # Rimuovi le lezioni terminate
-                buildings_status[polo][location]['lessons'] = [lesson for lesson in buildings_status[polo][location]['lessons']
-                                                               if datetime.strptime(lesson['end'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pisa_timezone) > now]
-
-                if not is_usually_open(polo, location):
-                    buildings_status[polo][location]['free'] = False
-                    buildings_status[polo][location]['roomAvailableSoon'] = False
-                    continue
-                
-                # Imposta inizialmente l'aula come libera
-                buildings_status[polo][location]['free'] = True
-                buildings_status[polo][location]['roomAvailableSoon'] = False
-
-                # Se l'aula ha almeno una lezione in corso, non è libera
-                for lesson in buildings_status[polo][location]['lessons']:
-                    start_time = datetime.strptime(lesson['start'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pisa_timezone)
-                    end_time = datetime.strptime(lesson['end'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pisa_timezone)
-                    # Controlla se la lezione è in corso
-                    if start_time <= now <= end_time:
-                        buildings_status[polo][location]['free'] = False
-
-                        # Verifica se la lezione finisce entro 30 minuti
-                        if end_time - now <= timedelta(minutes=30):
-                            # Controlla se c'è un'altra lezione che inizia esattamente quando termina la lezione corrente
-                            # oppure se inizia 15 minuti dopo la fine della lezione corrente
-                            next_lesson_exists = any(
-                                datetime.strptime(next_lesson['start'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pisa_timezone) in {end_time, end_time + timedelta(minutes=15)}
-                                for next_lesson in buildings_status[polo][location]['lessons']
-                                )
-
-                            # Se non c'è un'altra lezione che inizia quando termina l'attuale, setta 'availableSoon' a True
-                            if not next_lesson_exists:
-                                buildings_status[polo][location]['roomAvailableSoon'] = True
-        
-
-        # Se il polo ha almeno una aula liberata, il polo è considerato libero
-        buildings_status[polo]['free'] = False
-        for location in buildings_status[polo]:
-            if location not in ['coordinates', 'buildingAvailableSoon', 'free','isClosed']:
-                if buildings_status[polo][location]['free'] == True:
-                    buildings_status[polo]['free'] = True
-                    break
-    
-        # se il polo ha almeno una aula che sarà libera entro 30 minuti, il polo è considerato disponibile a breve
-        buildings_status[polo]['buildingAvailableSoon'] = False
-        for location in buildings_status[polo]:
-            if location not in ['coordinates', 'buildingAvailableSoon', 'free', 'isClosed']:
-                if buildings_status[polo][location]['roomAvailableSoon'] == True:
-                    buildings_status[polo]['buildingAvailableSoon'] = True
-                    break
-    
-    return buildings_status
+    # - il campo isClosed del polo in base agli orari di apertura
+    status = []
+    day_hours = opening_hours.at(now)
+    for i, building in enumerate(buildings.values()):
+        previous_building = previous[i] if previous is not None else None
+        polo = building.name
+        free = False
+        available_soon = False
+        rooms = []
+        for j, (location, usually_open) in enumerate(building.rooms.items()):
+            index = rooms_index.get((polo, location))
+            # Rimuovi le lezioni terminate
+            lessons = index.remaining_lessons(now, until) if index is not None else ()
+
+            if not usually_open:
+                occupied, room_available_soon = True, False
+            else:
+                occupied, room_available_soon = index.status(now) if index is not None else (False, False)
+                # Se il polo ha almeno una aula libera (o che sarà libera entro 30 minuti), il polo è considerato libero (o disponibile a breve)
+                free = free or not occupied
+                available_soon = available_soon or room_available_soon
+
+            room = RoomStatus(location, lessons, not occupied, room_available_soon)
+            # Riusa l'aula dello stato precedente se non è cambiata
+            previous_room = previous_building.rooms[j] if previous_building is not None else None
+            rooms.append(previous_room if room.same_as(previous_room) else room)
+
+        building_status = BuildingStatus(building, free, available_soon, not day_hours.is_open(polo, now), tuple(rooms))
+        # Riusa il polo dello stato precedente se non è cambiato
+        status.append(previous_building if building_status.same_as(previous_building) else building_status)
 
+    return tuple(status)
 
-def buildings_to_csv():
+
+def build_day_timeline(day, buildings, rooms_index):
+    """
+    Costruisce la timeline della giornata: raccoglie tutti gli istanti in cui lo stato può cambiare
+    (inizio e fine delle lezioni, 30 minuti prima della fine, apertura e chiusura dei poli)
+    e calcola lo stato degli edifici per ognuno degli intervalli che ne risultano.
+    """
+
+    day_start = int(datetime.combine(day, datetime.min.time(), tzinfo=pisa_timezone).timestamp())
+    day_end = int(datetime.combine(day + timedelta(days=1), datetime.min.time(), tzinfo=pisa_timezone).timestamp())
+
+    instants = {day_start}
+    for index in rooms_index.values():
+        instants.update(room_transitions(index))
+    day_hours = opening_hours.day(day)
+    for polo in buildings:
+        instants.update(day_hours.transitions(polo))
+    instants = sorted(t for t in instants if day_start <= t < day_end)
+
+    states = []
+    previous = None
+    for t in instants:
+        previous = compute_buildings_status(t, buildings, rooms_index, previous, day_end)
+        states.append(previous)
+
+    return DayTimeline(instants, states, day_end)
+
+
+def build_timelines(day, days, buildings, rooms_index):
+    """
+    Costruisce le timeline delle 'days' giornate a partire da 'day': 'YYYY-MM-DD' -> DayTimeline.
+    """
+    timelines = {}
+    for i in range(days):
+        current_day = day + timedelta(days=i)
+        timelines[current_day.strftime("%Y-%m-%d")] = build_day_timeline(current_day, buildings, rooms_index)
+    return timelines
+
+
+def build_occupancies(day, days, buildings, rooms_index):
+    """
+    Costruisce le matrici di occupazione delle 'days' giornate a partire da 'day': 'YYYY-MM-DD' -> OccupancyMatrix.
+    Senza NumPy restituisce un dizionario vuoto.
+    """
+    if occupancy.np is None:
+        return {}
+    occupancies = {}
+    for i in range(days):
+        current_day = day + timedelta(days=i)
+        occupancies[current_day.strftime("%Y-%m-%d")] = occupancy.build_occupancy(opening_hours.day(current_day),
+                                                                                buildings, rooms_index)
+    return occupancies
+
+
+def timeline_at(snapshot, at):
+    """
+    Restituisce la timeline dello snapshot che contiene l'istante 'at' (epoch in secondi),
+    oppure None se 'at' è fuori dalle giornate caricate.
+    """
+    return snapshot['timelines'].get(datetime.fromtimestamp(at, pisa_timezone).strftime("%Y-%m-%d"))
+
+
+def get_buildings_status(timeline, at=None):
+    """
+    Restituisce lo stato degli edifici (tupla di BuildingStatus) adesso o all'istante 'at' (epoch in secondi),
+    letto dalla timeline precalcolata della giornata.
+    Senza timeline restituisce sempre la stessa tupla vuota, così la cache della risposta resta valida.
+    """
+    if timeline is None:
+        return EMPTY_BUILDINGS_STATUS
+    if at is None:
+        at = datetime.now(pisa_timezone).timestamp()
+    return timeline.status_at(at)
+
+
+def buildings_status_to_json(state, poli=None, rooms=None, fields=STATUS_FIELDS):
+    """
+    Converte lo stato degli edifici nel dizionario restituito da /api/open-classrooms
+    (eventualmente limitato ad alcuni poli, aule e campi, vedi `model.status_to_json`).
+    """
+    return status_to_json(state, pisa_timezone, poli, rooms, fields)
+
+
+FREE_ROOMS_LIMIT = 20 # aule restituite di default da `find_free_rooms`
+
+
+def find_free_rooms(snapshot, at, minutes=0, position=None, limit=FREE_ROOMS_LIMIT):
+    """
+    Cerca le aule libere all'istante 'at' (epoch in secondi) per almeno 'minutes' minuti: l'aula deve essere
+    usually_open, il polo aperto e l'intervallo libero (fino alla prossima lezione o alla chiusura del polo)
+    abbastanza lungo. Se 'position' è una coppia (latitudine, longitudine) le aule sono ordinate per distanza
+    del polo, altrimenti (e a parità di polo) per durata dell'intervallo libero.
+    Restituisce al massimo 'limit' aule, oppure None se 'at' è fuori dalle giornate caricate.
+    """
+    timeline = timeline_at(snapshot, at)
+    if timeline is None:
+        return None
+    state = timeline.status_at(at)
+    distances = {name: distance for distance, name in polo_locator.by_distance(*position)} if position else {}
+
+    candidates = []
+    for building in state:
+        if building.is_closed:
+            continue
+        polo = building.building.name
+        closes_at = min(opening_hours.next_change(polo, at), timeline.end)
+        for room in building.rooms:
+            if not room.free:  # occupata oppure non usually_open
+                continue
+            index = snapshot['rooms_index'].get((polo, room.name))
+            free_until = min(index.free_until(at) if index is not None else closes_at, closes_at)
+            if free_until - at >= minutes * 60:
+                candidates.append((distances.get(polo, 0), -free_until, polo, room.name, building.building))
+    candidates.sort(key=lambda candidate: candidate[:4])
+
+    free_rooms = []
+    for distance, free_until, polo, location, building in candidates[:limit]:
+        free_room = {
+            'polo': polo,
+            'room': location,
+            'coordinates': building.coordinates,
+            'freeUntil': format_local_time(-free_until, pisa_timezone),
+            'freeMinutes': int(-free_until - at) // 60,
+        }
+        if position:
+            free_room['distance'] = round(distance)
+        free_rooms.append(free_room)
+    return free_rooms
+
+
+def get_next_status_change(timeline):
+    """
+    Restituisce l'istante (epoch in secondi) in cui cambierà lo stato restituito da `get_buildings_status`.
+    """
+    return timeline.next_change(datetime.now(pisa_timezone).timestamp())
+
+
+def buildings_to_csv(usually_open_dict):
     """
     Aggiorna il file 'aule.csv' su VercelFS con le aule libere e occupate.
-    Viene chiamata una volta in fase di avvio del backend, dopo aver caricato i calendari.
+    Viene chiamata dopo la pubblicazione di un nuovo snapshot dei calendari.
     """
-    global usually_open_dict
 
      # Crea un oggetto StringIO per gestire il contenuto come una stringa
     f = io.StringIO()
@@ -542,64 +998,11 @@ def buildings_to_csv():
             writer.writerow([polo, location, usually_open])
     
     f.seek(0)
-    print("Uplaod del nuovo 'aule.csv' su VercelFS.")
     aule_csv_content = f.getvalue()
     # La upload_a_blob fa overwrite del file se esiste già su VercelFS -> https://pypi.org/project/vercel_blob/
-    # quindi non serve la delete del file
-    upload_a_blob("aule.csv", aule_csv_content)
+    # quindi non serve la delete del file. Se le aule non sono cambiate l'upload viene saltato
+    with refresh_phase_seconds.time(phase='csv_upload'):
+        uploaded = upload_a_blob_if_changed("aule.csv", aule_csv_content)
+    if uploaded:
+        log.info("Upload del nuovo 'aule.csv' su VercelFS")
     f.close()
-
-
-def is_building_closed(polo: str, now: datetime) -> bool:
-    current_hour = now.hour + now.minute / 60  # Convertiamo i minuti in ore decimali
-    current_day = now.weekday()  # Lunedì è 0, Domenica è 6
-
-    # Domenica: tutti i poli chiusi tranne poloF e poloPN (8:30 - 24)
-    if current_day == 6 and not (polo == 'poloF' or polo == 'poloPN'):
-        return True
-    elif current_day == 6 and (polo == 'poloF' or polo == 'poloPN'):
-        return current_hour < 8.5 or current_hour >= 24
-
-    # Sabato: poloA, poloB  e poloFarmacia aperti dalle 7:30 alle 14
-    if current_day == 5 and (polo == 'poloA' or polo == 'poloB' or polo == 'poloFarmacia'):
-        return current_hour < 7.5 or current_hour >= 14
-
-    # Sabato: poloC e poloEconomia aperti dalle 8 alle 13
-    if current_day == 5 and (polo == 'poloC' or polo == 'poloEconomia'):
-        return current_hour < 8 or current_hour >= 13
-
-    # Lunedì - Venerdì: poloA e poloB aperti dalle 7:30 alle 20
-    if 0 <= current_day <= 4 and (polo == 'poloA' or polo == 'poloB'):
-        return current_hour < 7.5 or current_hour >= 20
-
-    # Lunedì - Venerdì: poloC e poloFarmacia aperti dalle 7:30 alle 19:30
-    if 0 <= current_day <= 4 and (polo == 'poloC' or polo == 'poloFarmacia'):
-        return current_hour < 7.5 or current_hour >= 19.5
-
-    # Lunedì - Sabato: poloF e poloPN aperti dalle 8 alle 24
-    if 0 <= current_day <= 5 and (polo == 'poloF' or polo == 'poloPN'):
-        return current_hour < 8 or current_hour >= 24
-
-    # Lunedì - Venerdì: poloFibonacci aperto dalle 8 alle 19
-    if 0 <= current_day <= 4 and polo == 'poloFibonacci':
-        return current_hour < 8 or current_hour >= 19
-
-    # Lunedì - Venerdì: poloBenedettine e poloEconomia aperti dalle 8 alle 19:30
-    if 0 <= current_day <= 4 and (polo == 'poloBenedettine' or polo == 'poloEconomia'):
-        return current_hour < 8 or current_hour >= 19.5
-
-    # Sabato: poloBenedettine aperto dalle 8:30 alle 14
-    if current_day == 5 and polo == 'poloBenedettine':
-        return current_hour < 8.5 or current_hour >= 14
-
-    # Lunedì - Venerdì: poloPiagge aperto dalle 8 alle 24
-    if 0 <= current_day <= 4 and polo == 'poloPiagge':
-        return current_hour < 8 or current_hour >= 24
-
-    # Lunedì - Venerdì: altri poli aperti dalle 8 alle 19:30
-    if 0 <= current_day <= 4 and polo in ['poloCarmignani', 'poloGuidotti', 'poloNobili', 'poloP.Ricci', 
-                                           'poloP.Boileau', 'poloS.Rossore', 'poloSapienza']:
-        return current_hour < 8 or current_hour >= 19.5
-
-    # Per qualsiasi altra combinazione, consideriamo aperto
-    return False
\ No newline at end of file